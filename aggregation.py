@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+"""
+Aggregation of the values of all batteries.
+
+CellVoltageMatrix holds the cell voltages of all batteries for the max./min. and overvoltage reductions.
+IncrementalAggregator is used by the event driven update mode: instead of summing up all batteries
+on every update, the totals are adjusted by the difference of the contribution of a single battery
+when one of its values changes on DBus.
+DirtyBatteries keeps track of the path groups changed per battery, so the values of the unchanged
+groups are reused from the previous update.
+"""
+
+from array import array
+from collections import defaultdict
+from math import nan
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Terms summed up over all batteries
+# name: (DBus paths the term depends on, contribution of one battery calculated from the read plan values)
+BATTERY_TOTALS = {
+    "Voltage": (("/Dc/0/Voltage",), lambda v: v["/Dc/0/Voltage"].value),
+    "Current": (("/Dc/0/Current",), lambda v: v["/Dc/0/Current"].value),
+    "Power": (("/Dc/0/Power",), lambda v: v["/Dc/0/Power"].value),
+    "InstalledCapacity": (("/InstalledCapacity",), lambda v: v["/InstalledCapacity"].value),
+    "ConsumedAmphours": (("/ConsumedAmphours",), lambda v: v["/ConsumedAmphours"].value),
+    "Capacity": (("/Capacity",), lambda v: v["/Capacity"].value),
+    # weighted by the capacity of the battery
+    "Soc": (("/Soc", "/InstalledCapacity"), lambda v: v["/Soc"].value * v["/InstalledCapacity"].value),
+    "TimeToGo": (("/TimeToGo", "/InstalledCapacity"), lambda v: v["/TimeToGo"].value * v["/InstalledCapacity"].value),
+    "Temperature": (("/Dc/0/Temperature",), lambda v: v["/Dc/0/Temperature"].value),
+    "NrOfModulesOnline": (("/System/NrOfModulesOnline",), lambda v: v["/System/NrOfModulesOnline"].value),
+    "NrOfModulesOffline": (("/System/NrOfModulesOffline",), lambda v: v["/System/NrOfModulesOffline"].value),
+    "NrOfModulesBlockingCharge": (("/System/NrOfModulesBlockingCharge",), lambda v: v["/System/NrOfModulesBlockingCharge"].value),
+    "NrOfModulesBlockingDischarge": (("/System/NrOfModulesBlockingDischarge",), lambda v: v["/System/NrOfModulesBlockingDischarge"].value),
+}
+
+
+# Path groups of a battery, bits of the DirtyBatteries masks
+GROUP_DC = 1
+GROUP_CELLS = 2
+GROUP_ALARMS = 4
+GROUP_LIMITS = 8
+ALL_GROUPS = GROUP_DC | GROUP_CELLS | GROUP_ALARMS | GROUP_LIMITS
+
+# Alarms aggregated as maximum of all batteries, in the order of the alarm partials
+ALARM_PATHS = (
+    "/Alarms/LowVoltage",
+    "/Alarms/HighVoltage",
+    "/Alarms/LowCellVoltage",
+    "/Alarms/LowSoc",
+    "/Alarms/HighChargeCurrent",
+    "/Alarms/HighDischargeCurrent",
+    "/Alarms/CellImbalance",
+    "/Alarms/InternalFailure_alarm",
+    "/Alarms/HighChargeTemperature",
+    "/Alarms/LowChargeTemperature",
+    "/Alarms/HighTemperature",
+    "/Alarms/LowTemperature",
+    "/Alarms/BmsCable",
+)
+
+
+def path_group(path):
+    """
+    :return: group bit of a battery path, everything not in the other groups is DC (voltage, current,
+        capacity, SoC, temperatures, module counts)
+    """
+    if path.startswith("/Voltages/"):
+        return GROUP_CELLS
+    if path.startswith("/Alarms/"):
+        return GROUP_ALARMS
+    if path.startswith("/Info/") or path.startswith("/Io/"):
+        return GROUP_LIMITS
+    return GROUP_DC
+
+
+class DirtyBatteries:
+    """
+    Bitset of the path groups changed since the last update for each battery service.
+
+    mark() is called for every changed value stored by the DbusMonitor, so it only does two
+    dictionary lookups. Batteries added by track() start with all groups dirty.
+    """
+
+    def __init__(self):
+        # service: mask
+        self._masks = {}
+        # path: group, filled on first use
+        self._groups = {}
+
+    def track(self, services):
+        """
+        :param services: services of all aggregated batteries, the masks of the others are dropped
+        """
+        self._masks = {service: self._masks.get(service, ALL_GROUPS) for service in services}
+
+    def mark(self, service, path):
+        mask = self._masks.get(service)
+        if mask is None:
+            return
+        group = self._groups.get(path)
+        if group is None:
+            group = self._groups[path] = path_group(path)
+        self._masks[service] = mask | group
+
+    def mark_all(self):
+        """
+        Recalculate everything at the next update, e.g. after a read error.
+        """
+        self._masks = dict.fromkeys(self._masks, ALL_GROUPS)
+
+    def take(self):
+        """
+        :return: dictionary with service as key and mask as value, all masks are cleared
+        """
+        masks = self._masks
+        self._masks = dict.fromkeys(masks, 0)
+        return masks
+
+
+class CellVoltageMatrix:
+    """
+    Preallocated NR_OF_BATTERIES x NR_OF_CELLS_PER_BATTERY matrix of cell voltages.
+
+    The matrix is a flat array('d'), which is filled in place on every update and all cell reductions
+    are done over it. NumPy is used for the reductions if available, as a view of the same memory,
+    else plain Python loops. Invalid (None) cell voltages are stored as NaN and ignored by the reductions.
+    """
+
+    def __init__(self, batteries, nr_of_cells):
+        self.batteries = list(batteries)
+        self.nr_of_cells = nr_of_cells
+        self._cells = array("d", [nan]) * (len(self.batteries) * nr_of_cells)
+        if numpy is not None:
+            self._data = numpy.frombuffer(self._cells, dtype=float).reshape(len(self.batteries), nr_of_cells)
+        else:
+            self._data = self._cells
+
+    def fill(self, row, cells):
+        """
+        Copy the cell voltages of one battery into the matrix.
+
+        :param row: index of the battery in batteries
+        :param cells: MonitoredValue objects of the cells in cell order
+        """
+        data = self._cells
+        position = row * self.nr_of_cells
+        for cell in cells:
+            voltage = cell.value
+            data[position] = nan if voltage is None else voltage
+            position += 1
+
+    def _extreme(self, maximum):
+        if numpy is not None:
+            try:
+                index = int(numpy.nanargmax(self._data) if maximum else numpy.nanargmin(self._data))
+            except ValueError:
+                index = None
+        else:
+            best = None
+            index = None
+            for position, voltage in enumerate(self._data):
+                # NaN is not equal to itself
+                if voltage == voltage and (best is None or (voltage > best if maximum else voltage < best)):
+                    best = voltage
+                    index = position
+        if index is None:
+            raise TypeError("No valid cell voltage received from the batteries")
+        row, cell = divmod(index, self.nr_of_cells)
+        return row, cell, float(self._data.flat[index] if numpy is not None else self._data[index])
+
+    def max(self):
+        """
+        :return: (battery index, cell index, voltage) of the highest cell of all batteries
+        """
+        return self._extreme(True)
+
+    def min(self):
+        """
+        :return: (battery index, cell index, voltage) of the lowest cell of all batteries
+        """
+        return self._extreme(False)
+
+    def overvoltage(self, limit):
+        """
+        :param limit: max. cell voltage
+        :return: list with the sum of voltages above limit of all cells for each battery
+        """
+        if numpy is not None:
+            return numpy.nansum(numpy.clip(self._data - limit, 0, None), axis=1).tolist()
+        result = []
+        for offset in range(0, len(self._data), self.nr_of_cells):
+            overvoltage = 0
+            for voltage in self._data[offset : offset + self.nr_of_cells]:
+                if voltage > limit:
+                    overvoltage += voltage - limit
+            result.append(overvoltage)
+        return result
+
+
+class IncrementalAggregator:
+    """
+    Running totals over all batteries.
+
+    The values are read from the read plans of the batteries, which the DbusMonitor has already updated
+    when the value changed callback arrives. Therefore a change only needs the old contribution of the
+    battery to be replaced by the new one.
+    """
+
+    def __init__(self, plans, terms=BATTERY_TOTALS):
+        self._terms = terms
+        # path: names of the terms depending on it
+        self._termsByPath = defaultdict(list)
+        for name, (paths, _) in terms.items():
+            for path in paths:
+                self._termsByPath[path].append(name)
+        self.rebuild(plans)
+
+    def rebuild(self, plans):
+        """
+        Calculate all totals from scratch. Called on start and periodically to drop
+        the rounding errors accumulated by the incremental updates.
+
+        :param plans: dictionary with battery name as key and read plan as value
+        """
+        self._plans = plans
+        self._batteryByService = {plan.service: battery for battery, plan in plans.items()}
+        self._contributions = {name: {} for name in self._terms}
+        self._totals = dict.fromkeys(self._terms, 0)
+        # number of batteries with invalid (None) contribution per term
+        self._invalid = dict.fromkeys(self._terms, 0)
+        for battery, plan in plans.items():
+            for name in self._terms:
+                contribution = self._contribution(name, plan)
+                self._contributions[name][battery] = contribution
+                if contribution is None:
+                    self._invalid[name] += 1
+                else:
+                    self._totals[name] += contribution
+
+    def _contribution(self, name, plan):
+        try:
+            return self._terms[name][1](plan.values)
+        except (TypeError, KeyError):
+            return None
+
+    def update(self, service, path):
+        """
+        Adjust the totals after a value changed on DBus.
+
+        :param service: DBus service name
+        :param path: DBus path
+        :return: True if the changed value belongs to an aggregated battery
+        """
+        battery = self._batteryByService.get(service)
+        if battery is None:
+            return False
+        plan = self._plans[battery]
+
+        for name in self._termsByPath.get(path, ()):
+            old = self._contributions[name][battery]
+            new = self._contribution(name, plan)
+            if old == new:
+                continue
+            self._contributions[name][battery] = new
+            if old is None:
+                self._invalid[name] -= 1
+            else:
+                self._totals[name] -= old
+            if new is None:
+                self._invalid[name] += 1
+            else:
+                self._totals[name] += new
+        return True
+
+    def __getitem__(self, name):
+        if self._invalid[name]:
+            raise TypeError(f"{self._invalid[name]} battery(s) return None for {name}")
+        return self._totals[name]
+
+    def get(self, name):
+        """
+        :return: total or None, if at least one battery returns None
+        """
+        return None if self._invalid[name] else self._totals[name]
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of the aggregation loop with synthetic battery fleets.
+
+DbusAggBatService is started against a MockDbusMonitor filled with a synthetic fleet of batteries,
+a MultiPlus, MPPTs and a grid meter, and a VeDbusService which is not connected to the DBus.
+Then the update tasks (aggregation, ESS control, cell voltages) are called for a number of ticks, changing
+the battery values between the ticks.
+Reported per fleet: latency percentiles per tick, memory allocated per tick (tracemalloc) and
+ticks per second. The results are printed or saved as JSON to compare them across commits.
+
+Needs dbus-python and PyGObject like the service itself (python3-dbus and python3-gi on Debian/Ubuntu),
+but no DBus daemon.
+
+Usage:
+    python3 benchmark.py
+    python3 benchmark.py --fleets 1x4,8x16,32x32 --ticks 1000 --output benchmark.json
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python"))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python", "test"))
+
+import settings  # noqa: E402
+from statestore import StateStore  # noqa: E402
+import dbusmon  # noqa: E402
+from dbusmonitor import MonitoredValue, Service  # noqa: E402
+from mock_dbus_monitor import MockDbusMonitor  # noqa: E402
+from mock_gobject import MockTimerManager  # noqa: E402
+from vedbus import VeDbusService  # noqa: E402
+
+DEFAULT_FLEETS = "1x4,2x8,4x16,8x16,16x16,16x32,32x32"
+MULTI_SERVICE = "com.victronenergy.vebus.ttyS4"
+GRID_SERVICE = "com.victronenergy.grid.cgwacs_ttyUSB0_mb1"
+
+
+def load_service_module():
+    # the file name of the service is not a valid module name
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dbus-aggregate-batteries.py")
+    spec = importlib.util.spec_from_file_location("dbus_aggregate_batteries", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FleetDbusMonitor(MockDbusMonitor):
+    """
+    MockDbusMonitor with the servicesByName table of the DbusMonitor, from which the read plans
+    of the batteries are resolved. Replaces the AsyncDbusMonitor too, the scan is completed by
+    calling scanCompleteCallback after the fleet is populated.
+    """
+
+    def __init__(self, dbusTree, scanCompleteCallback=None, valueStoredCallback=None, **kwargs):
+        self.servicesByName = {}
+        self.scanCompleteCallback = scanCompleteCallback
+        self.valueStoredCallback = valueStoredCallback
+        super().__init__(dbusTree, **kwargs)
+
+    def add_service(self, service, values):
+        self.servicesByName[service] = Service(len(self.servicesByName), service, values.get("/DeviceInstance"))
+        super().add_service(service, values)
+
+    def remove_service(self, service):
+        self.servicesByName.pop(service, None)
+        super().remove_service(service)
+
+    def add_value(self, service, path, value):
+        super().add_value(service, path, value)
+        self.servicesByName[service].paths[path] = MonitoredValue(value, str(value), {})
+
+    def set_value(self, serviceName, objectPath, value):
+        # update the monitored value first, the value changed callback reads it from the read plan
+        entry = self.servicesByName.get(serviceName)
+        if entry is not None and objectPath in entry.paths and entry.paths[objectPath].value != value:
+            entry.paths[objectPath].value = value
+            if self.valueStoredCallback is not None:
+                self.valueStoredCallback(serviceName, objectPath)
+        return super().set_value(serviceName, objectPath, value)
+
+    def get_device_instance(self, serviceName):
+        return self.servicesByName[serviceName].deviceInstance
+
+
+class NullConnection:
+    """
+    Stands in for the DBus connection of the exported objects. dbus.service.Object registers its object
+    path on it and sends its signals to it, which are marshalled and then dropped.
+    """
+
+    def __init__(self):
+        self.signals = 0
+
+    def _register_object_path(self, path, on_message, on_unregister=None, fallback=False):
+        pass
+
+    def _unregister_object_path(self, path):
+        pass
+
+    def send_message(self, message):
+        self.signals += 1
+
+
+class StubVeDbusService(VeDbusService):
+    """
+    VeDbusService with the real exported items, on a NullConnection instead of the DBus.
+    """
+
+    def __init__(self, servicename, bus=None, register=None, lazytext=False, virtual=False):
+        super().__init__(servicename, bus=NullConnection(), register=False, lazytext=lazytext, virtual=virtual)
+
+    def register(self):
+        pass
+
+
+class StubSettingsDevice:
+    def __init__(self, bus, supportedSettings, eventCallback, *args, **kwargs):
+        self._values = {name: setting[1] for name, setting in supportedSettings.items()}
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __setitem__(self, name, value):
+        self._values[name] = value
+
+
+class Fleet:
+    """
+    Synthetic batteries with slowly drifting values, reproducible by the seed.
+    """
+
+    def __init__(self, nr_of_batteries, nr_of_cells, nr_of_mppts, seed=1):
+        self.nr_of_batteries = nr_of_batteries
+        self.nr_of_cells = nr_of_cells
+        self.nr_of_mppts = nr_of_mppts
+        self._random = random.Random(seed)
+        self.batteries = ["com.victronenergy.battery.ttyUSB%d" % i for i in range(nr_of_batteries)]
+        self.mppts = ["com.victronenergy.solarcharger.ttyUSB%d" % (nr_of_batteries + i) for i in range(nr_of_mppts)]
+
+    def battery_values(self, index):
+        values = {
+            "/Connected": 1,
+            "/ProductName": settings.BATTERY_PRODUCT_NAME,
+            "/CustomName": "Battery %d" % (index + 1),
+            "/Serial": "BAT%04d" % (index + 1),
+            "/Mgmt/Connection": "Serial",
+            "/DeviceInstance": index + 1,
+            "/Dc/0/Voltage": 3.3 * self.nr_of_cells,
+            "/Dc/0/Current": 10.0,
+            "/Dc/0/Power": 33.0 * self.nr_of_cells,
+            "/InstalledCapacity": 280.0,
+            "/ConsumedAmphours": 140.0,
+            "/Capacity": 140.0,
+            "/Soc": 50.0,
+            "/Dc/0/Temperature": 20.0,
+            "/System/MaxCellTemperature": 21.0,
+            "/System/MinCellTemperature": 19.0,
+            "/System/MaxVoltageCellId": "C1",
+            "/System/MaxCellVoltage": 3.3,
+            "/System/MinVoltageCellId": "C2",
+            "/System/MinCellVoltage": 3.3,
+            "/System/NrOfCellsPerBattery": self.nr_of_cells,
+            "/System/NrOfModulesOnline": 1,
+            "/System/NrOfModulesOffline": 0,
+            "/System/NrOfModulesBlockingCharge": 0,
+            "/System/NrOfModulesBlockingDischarge": 0,
+            "/TimeToGo": 36000,
+            "/Voltages/Diff": 0.0,
+            "/Voltages/Sum": 3.3 * self.nr_of_cells,
+            "/Info/MaxChargeCurrent": 100.0,
+            "/Info/MaxDischargeCurrent": 100.0,
+            "/Info/MaxChargeVoltage": 3.45 * self.nr_of_cells,
+            "/Info/ChargeMode": "Bulk",
+            "/Io/AllowToCharge": 1,
+            "/Io/AllowToDischarge": 1,
+            "/Io/AllowToBalance": 1,
+        }
+        for alarm in (
+            "LowVoltage",
+            "HighVoltage",
+            "LowCellVoltage",
+            "HighCellVoltage",
+            "LowSoc",
+            "HighChargeCurrent",
+            "HighDischargeCurrent",
+            "CellImbalance",
+            "InternalFailure_alarm",
+            "HighChargeTemperature",
+            "LowChargeTemperature",
+            "HighTemperature",
+            "LowTemperature",
+            "BmsCable",
+        ):
+            values["/Alarms/%s" % alarm] = 0
+        for cellId in range(1, self.nr_of_cells + 1):
+            values["/Voltages/Cell%d" % cellId] = round(3.3 + self._random.uniform(-0.01, 0.01), 3)
+        return values
+
+    def populate(self, monitor):
+        for index, service in enumerate(self.batteries):
+            monitor.add_service(service, self.battery_values(index))
+        monitor.add_service(
+            MULTI_SERVICE,
+            {
+                "/Connected": 1,
+                "/Dc/0/Current": 10.0 * self.nr_of_batteries,
+                "/ProductName": "MultiPlus-II 48/5000/70-50",
+                "/Devices/0/Ac/In/P": 500.0,
+                "/Devices/0/Ac/Out/P": 300.0,
+                "/Devices/0/Ac/Inverter/P": -200.0,
+                "/Hub4/L1/AcPowerSetpoint": 0,
+                "/Hub4/DisableCharge": 0,
+                "/Hub4/DisableFeedIn": 0,
+            },
+        )
+        for service in self.mppts:
+            monitor.add_service(service, {"/Dc/0/Current": 5.0, "/ProductName": "SmartSolar Charger MPPT 150/35"})
+        monitor.add_service(
+            GRID_SERVICE,
+            {"/Ac/Power": 100.0, "/Ac/L1/Power": 100.0, "/Ac/L2/Power": 0.0, "/Ac/L3/Power": 0.0, "/ProductName": "Grid meter"},
+        )
+        monitor.add_service(
+            "com.victronenergy.settings",
+            {
+                "/Settings/CGwacs/OvervoltageFeedIn": 1,
+                "/Settings/CGwacs/Hub4Mode": 3,
+                "/Settings/CGwacs/AcPowerSetPoint": 0,
+                "/Settings/CGwacs/BatteryLife/MinimumSocLimit": 10,
+                "/Settings/MyEss/Active": 4,
+                "/Settings/MyEss/CorrectionI": 0.419,
+                "/Settings/MyEss/MinSocLimit": 20,
+                "/Settings/MyEss/SmoothFilter": 250,
+                "/Settings/CGwacs/MaxDischargePower": -1,
+            },
+        )
+        system = {"/SystemState/LowSoc": 0, "/SystemState/BatteryLife": 0}
+        for phase in ("L1", "L2", "L3"):
+            system["/Ac/ConsumptionOnInput/%s/Power" % phase] = 200.0
+            system["/Ac/PvOnGrid/%s/Power" % phase] = 0.0
+        monitor.add_service("com.victronenergy.system", system)
+
+    def step(self, monitor):
+        """
+        Change the values of the batteries like between two updates: all cell voltages drift by
+        up to 2 mV, the voltage, current and power follow.
+        """
+        uniform = self._random.uniform
+        for service in self.batteries:
+            paths = monitor.servicesByName[service].paths
+            voltage = 0
+            for cellId in range(1, self.nr_of_cells + 1):
+                path = "/Voltages/Cell%d" % cellId
+                cell = round(min(3.45, max(3.0, paths[path].value + uniform(-0.002, 0.002))), 3)
+                monitor.set_value(service, path, cell)
+                voltage += cell
+            current = round(paths["/Dc/0/Current"].value + uniform(-0.5, 0.5), 2)
+            monitor.set_value(service, "/Dc/0/Voltage", round(voltage, 2))
+            monitor.set_value(service, "/Dc/0/Current", current)
+            monitor.set_value(service, "/Dc/0/Power", round(voltage * current, 0))
+        monitor.set_value(MULTI_SERVICE, "/Dc/0/Current", round(uniform(-50, 50), 2))
+        monitor.set_value(GRID_SERVICE, "/Ac/Power", round(uniform(-200, 200), 0))
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def update_tick(service):
+    """
+    :return: function running all update tasks of the scheduler once, which run at different rates on the target
+    """
+    callbacks = [task.callback for name, task in service._scheduler.tasks.items() if name in ("Aggregation", "Ess", "Cells")]
+    if not callbacks:
+        # event driven, the ESS control and the cell voltages are part of _update
+        return service._update
+
+    def tick():
+        for callback in callbacks:
+            callback()
+
+    return tick
+
+
+def run_fleet(module, fleet, ticks, warmup, event_driven):
+    overrides = {
+        "NR_OF_BATTERIES": fleet.nr_of_batteries,
+        "NR_OF_CELLS_PER_BATTERY": fleet.nr_of_cells,
+        "NR_OF_MPPTS": fleet.nr_of_mppts,
+        "CURRENT_FROM_VICTRON": True,
+        "USE_SMARTSHUNTS": False,
+        "SEND_CELL_VOLTAGES": 1,
+        "EVENT_DRIVEN_UPDATE": event_driven,
+        "UPDATE_INTERVAL_FIND_DEVICES": 1,
+        "UPDATE_INTERVAL_DATA": 1,
+        "LOG_PERIOD": 10**9,
+    }
+    timers = MockTimerManager()
+    glib = SimpleNamespace(
+        timeout_add=timers.add_timer,
+        timeout_add_seconds=lambda timeout, callback, *args, **kwargs: timers.add_timer(timeout * 1000, callback, *args, **kwargs),
+        idle_add=timers.add_idle,
+        source_remove=timers.remove_resouce,
+    )
+    bus = mock.Mock()
+
+    with tempfile.TemporaryDirectory() as data:
+        state = StateStore(os.path.join(data, "state.journal"), {})
+        state.update(Charge=140.0 * fleet.nr_of_batteries, LastBalancing=1)
+        state.flush()
+
+        with mock.patch.multiple(settings, **overrides), mock.patch.multiple(
+            module,
+            GLib=glib,
+            VeDbusService=StubVeDbusService,
+            SettingsDevice=StubSettingsDevice,
+            get_bus=lambda: bus,
+            DATA_PATH=data + os.sep,
+            HistoryExport=mock.Mock(),
+        ), mock.patch.object(dbusmon, "DbusMonitor", FleetDbusMonitor), mock.patch.object(dbusmon, "AsyncDbusMonitor", FleetDbusMonitor), mock.patch(
+            "dbus.SystemBus"
+        ), mock.patch(
+            "dbus.SessionBus"
+        ):
+            service = module.DbusAggBatService()
+            monitor = service._dbusMon.dbusmon
+            fleet.populate(monitor)
+
+            # run the discovery on the virtual clock until the update loop would be started,
+            # then the benchmark calls the update tasks directly
+            started = []
+            start_update_loop = service._start_update_loop
+
+            def start():
+                start_update_loop()
+                started.append(True)
+
+            service._start_update_loop = start
+            if monitor.scanCompleteCallback is not None:
+                monitor.scanCompleteCallback(monitor)
+            for _ in range(600):
+                if started:
+                    break
+                timers.run(1000)
+            if not started:
+                raise RuntimeError("Discovery of the %dx%d fleet did not finish" % (fleet.nr_of_batteries, fleet.nr_of_cells))
+            timers.reset()
+            tick = update_tick(service)
+
+            for _ in range(warmup):
+                fleet.step(monitor)
+                tick()
+
+            latencies = []
+            for _ in range(ticks):
+                fleet.step(monitor)
+                start = time.perf_counter()
+                tick()
+                latencies.append(time.perf_counter() - start)
+
+            # separate pass, tracemalloc slows down the allocations
+            tracemalloc.start()
+            allocated = []
+            retained = []
+            for _ in range(min(ticks, 200)):
+                fleet.step(monitor)
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                tick()
+                current, peak = tracemalloc.get_traced_memory()
+                allocated.append(peak - before)
+                retained.append(current - before)
+            tracemalloc.stop()
+
+    total = sum(latencies)
+    return {
+        "batteries": fleet.nr_of_batteries,
+        "cells_per_battery": fleet.nr_of_cells,
+        "mppts": fleet.nr_of_mppts,
+        "event_driven": event_driven,
+        "ticks": ticks,
+        "latency_ms": {
+            "min": min(latencies) * 1000,
+            "p50": percentile(latencies, 50) * 1000,
+            "p90": percentile(latencies, 90) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": max(latencies) * 1000,
+            "mean": total / ticks * 1000,
+        },
+        "allocated_bytes_per_tick": percentile(allocated, 50),
+        "retained_bytes_per_tick": sum(retained) / len(retained),
+        "ticks_per_second": ticks / total,
+    }
+
+
+def parse_fleets(fleets):
+    result = []
+    for fleet in fleets.split(","):
+        batteries, cells = fleet.lower().split("x")
+        result.append((int(batteries), int(cells)))
+    return result
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL)
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the aggregation loop with synthetic battery fleets")
+    parser.add_argument("--fleets", default=DEFAULT_FLEETS, help="comma separated <batteries>x<cells>, default: %(default)s")
+    parser.add_argument("--mppts", type=int, default=2, help="number of MPPTs, default: %(default)s")
+    parser.add_argument("--ticks", type=int, default=500, help="measured ticks per fleet, default: %(default)s")
+    parser.add_argument("--warmup", type=int, default=20, help="ticks before measuring, default: %(default)s")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic values, default: %(default)s")
+    parser.add_argument("--event-driven", action="store_true", help="benchmark the event driven update mode")
+    parser.add_argument("--output", help="save the results as JSON to this file instead of printing them")
+    args = parser.parse_args()
+
+    # the service logs on every discovery step
+    logging.getLogger().setLevel(logging.WARNING)
+    module = load_service_module()
+
+    results = []
+    for batteries, cells in parse_fleets(args.fleets):
+        fleet = Fleet(batteries, cells, args.mppts, seed=args.seed)
+        result = run_fleet(module, fleet, args.ticks, args.warmup, args.event_driven)
+        results.append(result)
+        print(
+            "%3dx%-3d p50 %7.3f ms  p99 %7.3f ms  %8.0f ticks/s  %8d B/tick"
+            % (
+                batteries,
+                cells,
+                result["latency_ms"]["p50"],
+                result["latency_ms"]["p99"],
+                result["ticks_per_second"],
+                result["allocated_bytes_per_tick"],
+            ),
+            file=sys.stderr,
+        )
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmark of unwrap_dbus_value of velib_python.
+
+Compares the type dispatch implementation with the isinstance chain, which is kept as fallback for
+all other types. The payload is like the one on the hot path: the ItemsChanged dictionary of a
+battery with --entries entries of {"Value": ..., "Text": ...} received by the DbusMonitor. Before timing,
+both implementations are checked to return identical results (type, value, variant level and signature)
+for every payload. Exits with 1 if the dispatch is not faster, so it can be used as a check.
+wrap_dbus_value keeps the isinstance chain, which is faster for the published values than a dispatch.
+
+Usage:
+    python3 benchmark_dbus_values.py
+    python3 benchmark_dbus_values.py --entries 100 --number 2000 --output dbus_values.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python"))
+
+import dbus  # noqa: E402
+import ve_utils  # noqa: E402
+
+
+def plain_values(entries, seed):
+    """
+    :return: dictionary path: value with the mix of types published by the aggregate battery
+    """
+    rnd = random.Random(seed)
+    values = {}
+    for index in range(entries):
+        kind = index % 10
+        if kind < 5:
+            value = round(rnd.uniform(2.5, 3.6), 3)
+        elif kind < 8:
+            value = rnd.randint(0, 2)
+        elif kind == 8:
+            value = "Battery %d" % index
+        else:
+            value = None
+        values["/Path/%d" % index] = value
+    # the special cases of the isinstance chain
+    values["/Bool"] = True
+    values["/Int64"] = 2**40
+    values["/List"] = [1, 2.0, "3"]
+    values["/EmptyList"] = []
+    return values
+
+
+def items_changed(values):
+    """
+    :return: ItemsChanged payload, as dbus-python passes it to the signal handler
+    """
+    return dbus.Dictionary(
+        {path: dbus.Dictionary({"Value": ve_utils.wrap_dbus_value(value), "Text": dbus.String(str(value))}) for path, value in values.items()},
+        signature="sa{sv}",
+    )
+
+
+def unwrap_edge_cases():
+    """
+    :return: values of types which are not in the dispatch table of unwrap_dbus_value and take the fallback
+    """
+    return [
+        dbus.Double(1.5),
+        dbus.Int32(-3),
+        dbus.Byte(7),
+        dbus.ObjectPath("/some/path"),
+        dbus.Struct((dbus.Int32(1), dbus.String("a"))),
+        (1, 2.0),
+        {"a": dbus.Array([dbus.Int32(1)])},
+        ve_utils.VEDBUS_INVALID,
+    ]
+
+
+def identical(a, b):
+    if type(a) is not type(b):
+        return False
+    if getattr(a, "variant_level", 0) != getattr(b, "variant_level", 0):
+        return False
+    if isinstance(a, dbus.Array) and a.signature != b.signature:
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(identical(a[key], b[key]) for key in a)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(identical(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def check_equivalence(payload):
+    """
+    :return: number of compared values, raises AssertionError on the first difference
+    """
+    compared = 0
+    for value in list(payload.values()) + [payload] + unwrap_edge_cases():
+        assert identical(ve_utils.unwrap_dbus_value(value), ve_utils._unwrap_dbus_value_isinstance(value)), "unwrap %r" % (value,)
+        compared += 1
+    return compared
+
+
+def best(statement, number, repeat):
+    """
+    :return: best time per call in µs
+    """
+    return min(timeit.repeat(statement, number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark of unwrap_dbus_value")
+    parser.add_argument("--entries", type=int, default=100, help="entries of the ItemsChanged payload, default: %(default)s")
+    parser.add_argument("--number", type=int, default=1000, help="calls per measurement, default: %(default)s")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements, the best is reported, default: %(default)s")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the values, default: %(default)s")
+    parser.add_argument("--output", help="save the results as JSON to this file instead of printing them")
+    args = parser.parse_args()
+
+    values = plain_values(args.entries, args.seed)
+    payload = items_changed(values)
+    compared = check_equivalence(payload)
+
+    def unwrap_items(unwrap):
+        # like DbusMonitor.handler_item_changes
+        return lambda: [unwrap(changes["Value"]) for changes in payload.values()]
+
+    results = {
+        "entries": len(values),
+        "compared_values": compared,
+        "us_per_payload": {
+            "unwrap_dispatch": best(unwrap_items(ve_utils.unwrap_dbus_value), args.number, args.repeat),
+            "unwrap_isinstance": best(unwrap_items(ve_utils._unwrap_dbus_value_isinstance), args.number, args.repeat),
+        },
+    }
+    timings = results["us_per_payload"]
+    results["speedup"] = {
+        "unwrap": timings["unwrap_isinstance"] / timings["unwrap_dispatch"],
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print("%d entries, %d values identical in both implementations" % (results["entries"], compared))
+        for name, us in timings.items():
+            print("%-18s %8.1f µs" % (name, us))
+        print("speedup: unwrap %.2fx" % results["speedup"]["unwrap"])
+
+    slower = [name for name, speedup in results["speedup"].items() if speedup < 1]
+    if slower:
+        print("dispatch is slower than the isinstance chain: %s" % ", ".join(slower), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+
+"""
+Closed-loop benchmark of the ESS control.
+
+The EssController is run against a simulated site instead of the DBus: loads on the AC input and AC output,
+AC-coupled PV (PvOnGrid), DC-coupled PV (MPPTs), a battery with the charge current limited near full and a
+MultiPlus following the AC power setpoint with a first-order response. The grid meter and the aggregated
+battery values are sampled at their own periods, like on a GX device. The controller runs every
+--ess-interval and, with --trigger grid or both, on every new grid meter value.
+
+The loads and the PV are synthetic (load steps and clouds, reproducible by the seed) or read from a CSV file
+with the columns time (s), ac_in_load, ac_out_load, pv_on_grid and mppt_power (W).
+
+Each combination of ESS mode, SmoothFilter and integral gain (ESS_KI) is scored by:
+    grid_error_wh   integrated absolute difference between grid power and grid setpoint
+    export_wh       energy fed into the grid beyond the grid setpoint
+    overshoot_w     max. excursion beyond the grid setpoint against the direction of a load step
+    settling_s      mean time until the grid power stays within --band of the setpoint after a load step
+    reversals_per_h direction changes of the AC power setpoint by more than --band, a measure of oscillation
+    cpu_us          CPU time per control step
+
+Usage:
+    python3 benchmark_ess.py
+    python3 benchmark_ess.py --modes 4,5 --smooth-filters 0,250 --ki 0,0.1,0.419 --trigger both --output ess.json
+"""
+
+import argparse
+import bisect
+import csv
+import json
+import logging
+import math
+import random
+import sys
+import time
+
+from ess import EssController
+
+MULTI_SERVICE = "com.victronenergy.vebus.ttyS4"
+GRID_SERVICE = "com.victronenergy.grid.cgwacs_ttyUSB0_mb1"
+SETTINGS_SERVICE = "com.victronenergy.settings"
+SYSTEM_SERVICE = "com.victronenergy.system"
+
+
+class SyntheticProfile:
+    """
+    Base loads with random steps of household appliances and PV with passing clouds.
+    """
+
+    def __init__(self, duration, seed=1, pv_on_grid=2000.0, mppt=3000.0):
+        rnd = random.Random(seed)
+        self._times = [0.0]
+        self._values = [(200.0, 300.0, pv_on_grid * 0.8, mppt * 0.8)]
+        now = 0.0
+        while now < duration:
+            now += rnd.uniform(30, 300)
+            acIn, acOut, pvOnGrid, mpptPower = self._values[-1]
+            kind = rnd.random()
+            if kind < 0.35:
+                acIn = max(100.0, min(4000.0, acIn + rnd.choice((-1, 1)) * rnd.uniform(500, 2500)))
+            elif kind < 0.7:
+                acOut = max(100.0, min(4000.0, acOut + rnd.choice((-1, 1)) * rnd.uniform(500, 2500)))
+            else:
+                cloud = rnd.uniform(0.2, 1.0)
+                pvOnGrid = pv_on_grid * cloud
+                mpptPower = mppt * cloud
+            self._times.append(now)
+            self._values.append((acIn, acOut, pvOnGrid, mpptPower))
+
+    @property
+    def steps(self):
+        return self._times[1:]
+
+    def __call__(self, now):
+        """
+        :return: AC input load, AC output load, PvOnGrid and MPPT power in W at time now
+        """
+        return self._values[bisect.bisect_right(self._times, now) - 1]
+
+
+class RecordedProfile(SyntheticProfile):
+    """
+    Profile read from a CSV file, each row holds until the next one.
+    """
+
+    def __init__(self, path):
+        self._times = []
+        self._values = []
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                self._times.append(float(row["time"]))
+                self._values.append((float(row["ac_in_load"]), float(row["ac_out_load"]), float(row["pv_on_grid"]), float(row["mppt_power"])))
+
+
+class Site:
+    """
+    Values read by the EssController, in place of the DbusMonitor, and the AC power setpoint written by it,
+    in place of the WriteQueue.
+    """
+
+    def __init__(self, grid_setpoint):
+        self.values = {
+            (SETTINGS_SERVICE, "/Settings/CGwacs/AcPowerSetPoint"): grid_setpoint,
+            (MULTI_SERVICE, "/Hub4/L1/AcPowerSetpoint"): 0.0,
+        }
+
+    def get_value(self, serviceName, objectPath, default_value=None):
+        value = self.values.get((serviceName, objectPath))
+        return default_value if value is None else value
+
+    def set_value(self, serviceName, objectPath, value):
+        self.values[(serviceName, objectPath)] = value
+
+    @property
+    def setpoint(self):
+        return self.values[(MULTI_SERVICE, "/Hub4/L1/AcPowerSetpoint")]
+
+
+class Plant:
+    """
+    MultiPlus with a first-order response to the AC power setpoint and a battery limiting the charge current near full.
+    """
+
+    def __init__(self, capacity=280.0, soc=60.0, cells=16, max_current=100.0, inverter_power=5000.0, time_constant=1.5, efficiency=0.93):
+        self.capacity = capacity
+        self.soc = soc
+        self.cells = cells
+        self.maxCurrent = max_current
+        self.inverterPower = inverter_power
+        self.timeConstant = time_constant
+        self.efficiency = efficiency
+        self.acIn = 0.0
+        self.dc = 0.0
+        self.mppt = 0.0
+        self.current = 0.0
+
+    @property
+    def voltage(self):
+        return self.cells * (3.2 + 0.002 * self.soc) + self.current * 0.005
+
+    @property
+    def chargeCurrentLimit(self):
+        # tapered above 90% like the CCL of the BMS
+        return self.maxCurrent * min(1.0, max(0.05, (100 - self.soc) / 10))
+
+    def step(self, setpoint, acOut, mpptAvailable, dt):
+        setpoint = max(acOut - self.inverterPower, min(acOut + self.inverterPower, setpoint))
+        self.acIn += (setpoint - self.acIn) * (1 - math.exp(-dt / self.timeConstant))
+        ac = self.acIn - acOut
+        self.dc = ac * self.efficiency if ac > 0 else ac / self.efficiency
+        voltage = self.voltage
+        # the MPPTs curtail if the battery is at its charge current limit
+        self.mppt = max(0.0, min(mpptAvailable, self.chargeCurrentLimit * voltage - self.dc))
+        self.current = (self.dc + self.mppt) / voltage
+        self.soc = max(0.0, min(100.0, self.soc + 100 * self.current * dt / 3600 / self.capacity))
+
+
+def run(mode, smooth_filter, ki, args, profile):
+    """
+    :return: scores of one combination of ESS mode, SmoothFilter and integral gain
+    """
+    now = 0.0
+    site = Site(args.grid_setpoint)
+    plant = Plant()
+    controller = EssController(site, site, plant.cells, args.kp, ki, args.max_correction, clock=lambda: now)
+    controller.active = mode
+    controller.smoothFilter = smooth_filter
+    controller.minSocLimit = 20
+    controller.multi = MULTI_SERVICE
+    controller.grid = GRID_SERVICE
+    bus = {}
+
+    aggregated = None
+    nextAggregation = nextMeter = nextEss = 0.0
+    meterPending = []
+    steps = profile.steps
+    nextStep = 0
+    stepTime = None
+    stepSign = 0
+    settled = None
+    settling = []
+    overshoot = 0.0
+    gridError = export = 0.0
+    cpu = []
+    lastSetpoint = None
+    direction = 0
+    reversals = 0
+
+    while now < args.duration:
+        acInLoad, acOut, pvOnGrid, mpptAvailable = profile(now)
+        plant.step(site.setpoint, acOut, mpptAvailable, args.dt)
+        grid = plant.acIn + acInLoad - pvOnGrid
+        error = grid - args.grid_setpoint
+        gridError += abs(error) * args.dt / 3600
+        export += max(0.0, -error) * args.dt / 3600
+
+        # load steps: overshoot against the direction of the disturbance, time until settled
+        if nextStep < len(steps) and now >= steps[nextStep]:
+            nextStep += 1
+            if stepTime is not None and settled is None:
+                settling.append(now - stepTime)
+            stepTime = now
+            settled = None
+            stepSign = 0
+        if stepTime is not None:
+            if stepSign == 0 and abs(error) > args.band:
+                stepSign = 1 if error > 0 else -1
+            if stepSign != 0 and error * stepSign < 0:
+                overshoot = max(overshoot, abs(error))
+            if abs(error) <= args.band:
+                if settled is None:
+                    settled = now
+            else:
+                settled = None
+            if settled is not None and now - settled >= args.settle_hold:
+                settling.append(settled - stepTime)
+                stepTime = None
+
+        # the aggregation publishes the battery values of its last update
+        if now >= nextAggregation:
+            nextAggregation += args.aggregation_interval
+            voltage = plant.voltage
+            aggregated = {
+                "Voltage": voltage,
+                "Current": plant.current,
+                "Power": plant.current * voltage,
+                "Soc": plant.soc,
+                "MpptCurrent": plant.mppt / voltage,
+                "MpptPower": plant.mppt,
+                "MaxChargeVoltage": plant.cells * 3.45,
+                "MaxChargeCurrent": plant.chargeCurrentLimit,
+                "MaxDischargeCurrent": plant.maxCurrent,
+            }
+
+        # the grid meter measures now and publishes after its latency
+        triggered = False
+        if now >= nextMeter:
+            nextMeter += args.meter_interval
+            meterPending.append((now + args.meter_latency, grid, acInLoad, pvOnGrid, plant.acIn, acOut, plant.dc))
+        while meterPending and meterPending[0][0] <= now:
+            _, meterGrid, meterAcInLoad, meterPvOnGrid, acIn, meterAcOut, dc = meterPending.pop(0)
+            site.values.update(
+                {
+                    (GRID_SERVICE, "/Ac/Power"): meterGrid,
+                    (GRID_SERVICE, "/Ac/L1/Power"): meterGrid,
+                    (GRID_SERVICE, "/Ac/L2/Power"): 0.0,
+                    (GRID_SERVICE, "/Ac/L3/Power"): 0.0,
+                    (SYSTEM_SERVICE, "/Ac/ConsumptionOnInput/L1/Power"): meterAcInLoad,
+                    (SYSTEM_SERVICE, "/Ac/ConsumptionOnInput/L2/Power"): 0.0,
+                    (SYSTEM_SERVICE, "/Ac/ConsumptionOnInput/L3/Power"): 0.0,
+                    (SYSTEM_SERVICE, "/Ac/PvOnGrid/L1/Power"): meterPvOnGrid,
+                    (SYSTEM_SERVICE, "/Ac/PvOnGrid/L2/Power"): 0.0,
+                    (SYSTEM_SERVICE, "/Ac/PvOnGrid/L3/Power"): 0.0,
+                    (MULTI_SERVICE, "/Devices/0/Ac/In/P"): acIn,
+                    (MULTI_SERVICE, "/Devices/0/Ac/Out/P"): meterAcOut,
+                    (MULTI_SERVICE, "/Devices/0/Ac/Inverter/P"): dc,
+                }
+            )
+            triggered = args.trigger in ("grid", "both")
+
+        if args.trigger in ("periodic", "both") and now >= nextEss:
+            nextEss += args.ess_interval
+            triggered = True
+        if triggered and aggregated is not None and (GRID_SERVICE, "/Ac/Power") in site.values:
+            start = time.process_time()
+            controller.control(aggregated, bus)
+            cpu.append(time.process_time() - start)
+            setpoint = site.setpoint
+            if lastSetpoint is not None and abs(setpoint - lastSetpoint) > args.band:
+                current = 1 if setpoint > lastSetpoint else -1
+                if direction and current != direction:
+                    reversals += 1
+                direction = current
+            lastSetpoint = setpoint
+
+        now += args.dt
+
+    return {
+        "mode": mode,
+        "smooth_filter": smooth_filter,
+        "ki": ki,
+        "grid_error_wh": round(gridError, 1),
+        "export_wh": round(export, 1),
+        "overshoot_w": round(overshoot, 0),
+        "settling_s": round(sum(settling) / len(settling), 1) if settling else None,
+        "reversals_per_h": round(reversals * 3600 / args.duration, 1),
+        "cpu_us": round(sum(cpu) / len(cpu) * 1e6, 1) if cpu else None,
+        "final_soc": round(plant.soc, 1),
+    }
+
+
+def parse_list(values, type):
+    return [type(value) for value in values.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Closed-loop benchmark of the ESS control")
+    parser.add_argument("--modes", default="1,2,3,4,5", help="comma separated ESS modes, default: %(default)s")
+    parser.add_argument("--smooth-filters", default="0,50,250", help="comma separated SmoothFilter values, default: %(default)s")
+    parser.add_argument("--ki", default="0,0.1,0.2,0.419", help="comma separated integral gains in 1/s, default: %(default)s")
+    parser.add_argument("--kp", type=float, default=0.3, help="proportional gain, default: %(default)s")
+    parser.add_argument("--max-correction", type=float, default=1000, help="max. correction in W, default: %(default)s")
+    parser.add_argument("--trigger", choices=("periodic", "grid", "both"), default="both", help="when the control runs, default: %(default)s")
+    parser.add_argument("--grid-setpoint", type=float, default=50, help="grid setpoint in W, default: %(default)s")
+    parser.add_argument("--duration", type=float, default=1800, help="simulated time per run in s, default: %(default)s")
+    parser.add_argument("--dt", type=float, default=0.05, help="time step of the plant in s, default: %(default)s")
+    parser.add_argument("--ess-interval", type=float, default=1.0, help="period of the ESS control in s, default: %(default)s")
+    parser.add_argument("--aggregation-interval", type=float, default=0.25, help="period of the aggregation in s, default: %(default)s")
+    parser.add_argument("--meter-interval", type=float, default=0.5, help="period of the grid meter in s, default: %(default)s")
+    parser.add_argument("--meter-latency", type=float, default=0.3, help="latency of the grid meter in s, default: %(default)s")
+    parser.add_argument("--band", type=float, default=50, help="tolerance of the grid power in W, default: %(default)s")
+    parser.add_argument("--settle-hold", type=float, default=5, help="time within the band to count as settled in s, default: %(default)s")
+    parser.add_argument("--profile", help="CSV file with the columns time, ac_in_load, ac_out_load, pv_on_grid, mppt_power")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic profile, default: %(default)s")
+    parser.add_argument("--output", help="save the results as JSON to this file instead of printing them")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    profile = RecordedProfile(args.profile) if args.profile else SyntheticProfile(args.duration, seed=args.seed)
+
+    results = []
+    for mode in parse_list(args.modes, int):
+        for smooth_filter in parse_list(args.smooth_filters, float):
+            for ki in parse_list(args.ki, float):
+                result = run(mode, smooth_filter, ki, args, profile)
+                results.append(result)
+                print(
+                    "mode %d  SmoothFilter %5g  Ki %5g  grid error %7.1f Wh  export %6.1f Wh  overshoot %5.0f W  "
+                    "settling %5s s  reversals %5.1f/h  cpu %5s us"
+                    % (
+                        mode,
+                        smooth_filter,
+                        ki,
+                        result["grid_error_wh"],
+                        result["export_wh"],
+                        result["overshoot_w"],
+                        result["settling_s"],
+                        result["reversals_per_h"],
+                        result["cpu_us"],
+                    ),
+                    file=sys.stderr,
+                )
+
+    report = {"settings": vars(args), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -19,10 +19,20 @@ import logging
 import sys
 import os
 import platform
+import signal
 import dbus
 import re
 import settings
 from functions import Functions
+from aggregation import ALARM_PATHS, ALL_GROUPS, GROUP_ALARMS, GROUP_CELLS, GROUP_DC, GROUP_LIMITS, CellVoltageMatrix, DirtyBatteries, IncrementalAggregator
+from publishing import PublishPlan
+from ticktiming import TickTiming
+from scheduler import Scheduler
+from writequeue import WriteQueue
+from ess import EssController
+from statestore import StateStore
+from history import History, HistoryExport
+from topology import TopologyCache, device
 
 # for UTC time stamps for logging
 from datetime import datetime as dt
@@ -30,7 +40,6 @@ from datetime import datetime as dt
 # for charge measurement
 import time as tt
 from dbusmon import DbusMon
-from threading import Thread
 
 # add ext folder to sys.path
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext"))
@@ -44,6 +53,8 @@ from settingsdevice import SettingsDevice  # available in the velib_python repos
 
 VERSION = "4.0.20251023-beta"
 
+DATA_PATH = "/data/apps/dbus-aggregate-batteries/"
+
 
 class SystemBus(dbus.bus.BusConnection):
     def __new__(cls):
@@ -66,6 +77,27 @@ class DbusAggBatService(object):
         self._batteries_dict = {}
         """ dictionary with battery name as key and dbus service as value """
 
+        self._battery_plans = {}
+        """ dictionary with battery name as key and read plan of the dbus service as value """
+
+        self._cellMatrix = None
+        """ cell voltages of all batteries, rows in order of _battery_plans """
+
+        self._cellPaths = {}
+        """ dictionary with battery name as key and tuple of the published cell voltage paths as value """
+
+        self._publishPlan = None
+        """ all published paths, built after the batteries are found """
+
+        self._dirtyBatteries = DirtyBatteries()
+        """ path groups changed per battery service since the last update """
+
+        self._partials = {}
+        """ dictionary with battery name as key and the values read per path group as value """
+
+        self._reduced = {}
+        """ values of all batteries per path group, reused as long as the group is unchanged """
+
         self._multi = None
         """ dbus service of MultiPlus/Quattro, if found """
 
@@ -79,9 +111,22 @@ class DbusAggBatService(object):
         self._smartShunt_list = []
         """ list of dbus services of SmartShunts, if found """
 
-        # Initialize tread as None
         self._dbusMon = None
 
+        self._settings = None
+        """ dbus service of the settings, if found """
+
+        # names of the device classes found, see _device_finders
+        self._devicesFound = set()
+        # set when the dbusmonitor has scanned all services
+        self._scanComplete = False
+        # set when all devices are found and the update loop is started
+        self._started = False
+        # set by the first SIGTERM/SIGINT
+        self._shuttingDown = False
+        # devices found by the last complete discovery, to start without searching them again
+        self._topologyCache = None
+
         # the number of SmartShunts at the beginning of _smartShunt_list that are in the
         # battery service (dc_load are listed behind)
         self._num_battery_shunts = 0
@@ -99,7 +144,9 @@ class DbusAggBatService(object):
         self._fullyDischarged = False
         self._dbusConn = get_bus()
         logging.info("### Initialise VeDbusService ")
-        self._dbusservice = VeDbusService(servicename, self._dbusConn, register=False)
+        self._dbusservice = VeDbusService(
+            servicename, self._dbusConn, register=False, lazytext=settings.PUBLISH_LAZY_TEXT, virtual=settings.PUBLISH_VIRTUAL_OBJECTS
+        )
         logging.info("|- Done: Init of VeDbusService ")
         self._timeOld = tt.time()
         # written when dynamic CVL limit activated
@@ -112,50 +159,77 @@ class DbusAggBatService(object):
         self._lastBalancing = 0
         # set if the CVL needs to be reduced due to peaking
         self._dynamicCVL = False
-        # last timestamp then the log was printed
-        self._logLastPrintTimeStamp = 0
+        # values of the last aggregation, used by the ESS control and the periodic logging
+        self._aggregated = None
+        # running totals over all batteries, only used if EVENT_DRIVEN_UPDATE = True
+        self._aggregator = None
+        # set while an update triggered by a value change is waiting in the main loop
+        self._updateScheduled = False
+        # (service, path) of the other services, whose changes trigger an update in the event driven mode
+        self._updateTriggers = frozenset()
+        # duration of the update stages
+        self._tickTiming = TickTiming(settings.UPDATE_INTERVAL_MS)
+        # periodic tasks, each at its own rate, started with the update loop
+        self._scheduler = Scheduler(GLib.timeout_add)
+        if settings.EVENT_DRIVEN_UPDATE:
+            # the ESS control and the cell voltages are updated together with the aggregated values
+            self._scheduler.add("Heartbeat", settings.UPDATE_INTERVAL_DATA * 1000, self._update_heartbeat)
+        else:
+            self._scheduler.add("Aggregation", settings.UPDATE_INTERVAL_MS, self._update)
+            self._scheduler.add("Ess", settings.ESS_INTERVAL_MS, self._update_ess)
+            if settings.SEND_CELL_VOLTAGES == 1:
+                self._scheduler.add("Cells", settings.CELL_VOLTAGES_INTERVAL_MS, self._update_cells)
+        # write the changed state at most every STATE_SAVE_INTERVAL
+        self._scheduler.add("Persistence", settings.STATE_SAVE_INTERVAL * 1000, self._save_state)
+        if settings.LOG_PERIOD > 0:
+            self._scheduler.add("Logging", settings.LOG_PERIOD * 1000, self._periodic_logging)
 
         # ESS variables ###############################################################################
-        self._EssActive = 0
-        self._SmoothFilter = 250
-        self._MaxChargeCurrentSm = 0
-        self._MinSocLimit = 0
-        self._CorrectionI = 0
+        # ESS controller, created with the write queue
+        self._ess = None
+        # set while an ESS control triggered by the grid meter is waiting in the main loop
+        self._essScheduled = False
         self._test = -1
         # ESS variables ###############################################################################
 
-        # read initial charge from text file
-        try:
-            self._charge_file = open("/data/apps/dbus-aggregate-batteries/storedvalue_charge", "r")  # read
-            self._ownCharge = float(self._charge_file.readline().strip())
-            self._charge_file.close()
-            self._ownCharge_old = self._ownCharge
-            logging.info("Initial Ah read from file: %.0fAh" % (self._ownCharge))
-        except Exception:
-            logging.error("Charge file read error. Exiting...")
-            tt.sleep(settings.TIME_BEFORE_RESTART)
-            sys.exit(1)
+        # read the state kept across restarts
+        self._state = StateStore(
+            DATA_PATH + "state.journal",
+            {
+                # -1: unknown, calculated from the SoC of the batteries
+                "Charge": -1,
+                "LastBalancing": 0,
+                "Balancing": 0,
+                "DynamicCvl": False,
+                "DynCvlActivated": False,
+                "DcFeedActive": False,
+            },
+        )
+        if self._state.load():
+            logging.info("State read from %s" % self._state.path)
+        self._import_legacy_state()
+        self._ownCharge = self._state["Charge"]
+        self._ownCharge_old = self._ownCharge
+        self._lastBalancing = self._state["LastBalancing"]
+        self._balancing = self._state["Balancing"]
+        self._dynamicCVL = self._state["DynamicCvl"]
+        self._dynCVLactivated = self._state["DynCvlActivated"]
+        self._DCfeedActive = self._state["DcFeedActive"]
+        logging.info("Initial Ah read from file: %.0fAh" % (self._ownCharge))
+
+        if settings.TOPOLOGY_CACHE:
+            self._topologyCache = TopologyCache(DATA_PATH + "topology.journal", self._topology_fingerprint())
+            if self._topologyCache.load() is not None:
+                logging.info("Cached topology read from %s" % self._topologyCache.path)
 
-        # read the day of the last balancing from text file
         if settings.OWN_CHARGE_PARAMETERS:
-            try:
-                self._lastBalancing_file = open(
-                    "/data/apps/dbus-aggregate-batteries/storedvalue_last_balancing",
-                    "r",
-                )
-                self._lastBalancing = int(self._lastBalancing_file.readline().strip())
-                self._lastBalancing_file.close()
-                # in days
-                time_unbalanced = int((dt.now()).strftime("%j")) - self._lastBalancing
-                if time_unbalanced < 0:
-                    # year change
-                    time_unbalanced += 365
-                logging.info("Last balancing done at the %d. day of the year" % (self._lastBalancing))
-                logging.info("Batteries balanced %d days ago." % time_unbalanced)
-            except Exception:
-                logging.error("Last balancing file read error. Exiting...")
-                tt.sleep(settings.TIME_BEFORE_RESTART)
-                sys.exit(1)
+            # in days
+            time_unbalanced = int((dt.now()).strftime("%j")) - self._lastBalancing
+            if time_unbalanced < 0:
+                # year change
+                time_unbalanced += 365
+            logging.info("Last balancing done at the %d. day of the year" % (self._lastBalancing))
+            logging.info("Batteries balanced %d days ago." % time_unbalanced)
 
         # Create the management objects, as specified in the ccgx dbus-api document
         self._dbusservice.add_path("/Mgmt/ProcessName", __file__)
@@ -318,44 +392,353 @@ class DbusAggBatService(object):
         self._dbusservice.add_path('/Ess/AcLoadL3', None, writeable=False, gettextcallback=lambda a, x: "{:.1f} W".format(x))
         self._dbusservice.add_path('/Ess/AcLoad', None, writeable=False, gettextcallback=lambda a, x: "{:.1f} W".format(x))
         self._dbusservice.add_path('/Ess/CorrectionI', None, writeable=False, gettextcallback=lambda a, x: "{:.3f} A".format(x))
+        self._dbusservice.add_path('/Ess/GridCorrectionP', None, writeable=False, gettextcallback=lambda a, x: "{:.0f} W".format(x))
         self._dbusservice.add_path('/Ess/MinimumSocLimit', None, writeable=False, gettextcallback=lambda a, x: "{:.0f} %".format(x))
+
+        # Create debug paths
+        if settings.TICK_TIMING:
+            self._tickTiming.add_paths(self._dbusservice)
+            self._scheduler.add_paths(self._dbusservice)
+
         # add ESS settings #
         self.settings = SettingsDevice(
             bus=dbus.SessionBus()  if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus(),
             supportedSettings={
                 'Active': ['/Settings/MyEss/Active', 4, 0, 5],
                 'MinSocLimit': ['/Settings/MyEss/MinSocLimit', 20, 0, 100],
+                # not used anymore, the integral gain of the ESS control is ESS_KI of config.ini
                 'CorrectionI': ['/Settings/MyEss/CorrectionI', 0.419, -10.0, 10.0],
                 'SmoothFilter' : ['/Settings/MyEss/SmoothFilter', 250, 0, 1000],
                 },eventCallback=self._handle_changed_setting)
         # Create ESS paths ###############################################################################################
 
-        x = Thread(target=self._startMonitor)
-        x.start()
+        # the dbusmonitor scans all services asynchronously in the main loop,
+        # the devices are searched as soon as the scan is complete
+        logging.info("Starting dbusmonitor...")
+        self._dbusMon = DbusMon(
+            valueChangedCallback=self._value_changed_on_dbus if settings.EVENT_DRIVEN_UPDATE else None,
+            deviceAddedCallback=self._device_added,
+            deviceRemovedCallback=self._device_removed,
+            scanCompleteCallback=self._scan_complete,
+            valueStoredCallback=self._dirtyBatteries.mark if settings.DIRTY_TRACKING else None,
+        )
 
-        # wait that Dbus monitor is running else there is no data
-        while self._dbusMon is None:
-            tt.sleep(1)
+        # writes to other services, don't wait for slow services like the vebus
+        self._writeQueue = WriteQueue(
+            self._dbusMon.dbusmon,
+            max_in_flight=settings.WRITE_MAX_IN_FLIGHT,
+            refresh=settings.WRITE_REFRESH_INTERVAL,
+        )
+        self._writeQueue.add_paths(self._dbusservice)
+
+        self._ess = EssController(
+            self._dbusMon.dbusmon,
+            self._writeQueue,
+            settings.NR_OF_CELLS_PER_BATTERY,
+            settings.ESS_KP,
+            settings.ESS_KI,
+            settings.ESS_MAX_CORRECTION,
+        )
 
         # register VeDbusService after all paths where added
         logging.info("### Registering VeDbusService")
         self._dbusservice.register()
 
-        # search com.victronenergy.settings
-        GLib.timeout_add_seconds(settings.UPDATE_INTERVAL_FIND_DEVICES, self._find_settings)
+        # history of the aggregated values, queried by GetHistory on /History
+        self._history = None
+        if settings.HISTORY_LENGTH > 0:
+            self._history = History(settings.HISTORY_LENGTH, settings.HISTORY_PERIOD)
+            self._historyExport = HistoryExport(self._dbusConn, self._history, tt.monotonic)
+            logging.info(
+                "History of %d values every %ds for %d channels: %.1f MB"
+                % (settings.HISTORY_LENGTH, settings.HISTORY_PERIOD, len(self._history.channels), self._history.footprint / 1e6)
+            )
+
+    # ####################################################################
+    # ####################################################################
+    # ## state kept across restarts                                     ###
+    # ####################################################################
+    # ####################################################################
 
-    # #############################################################################################################
-    # #############################################################################################################
-    # ## Starting battery dbus monitor in external thread (otherwise collision with AggregateBatteries service) ###
-    # #############################################################################################################
-    # #############################################################################################################
+    # the text files of former versions, or written by the user to set the initial charge,
+    # are imported into the state journal and renamed afterwards
+    def _import_legacy_state(self):
+        imported = []
+        for name, key, convert in (
+            ("storedvalue_charge", "Charge", float),
+            ("storedvalue_last_balancing", "LastBalancing", int),
+        ):
+            path = DATA_PATH + name
+            if not os.path.isfile(path):
+                continue
+            try:
+                with open(path, "r") as f:
+                    value = convert(f.readline().strip())
+                # -1 (unknown, default file) must not overwrite a known charge
+                if value >= 0 or self._state[key] < 0:
+                    self._state.update(**{key: value})
+                imported.append(path)
+            except (OSError, ValueError):
+                logging.error("%s read error, ignored" % name)
+
+        # keep the files, if the journal can't be written
+        if imported and self._state.flush():
+            for path in imported:
+                os.rename(path, path + ".imported")
+                logging.info("%s imported into %s" % (path, self._state.path))
+
+    def _save_state(self):
+        self._state.flush()
 
-    def _startMonitor(self):
-        logging.info("Starting dbusmonitor...")
-        self._dbusMon = DbusMon()
+    # ####################################################################
+    # ####################################################################
+    # ## shutdown on SIGTERM/SIGINT                                     ###
+    # ####################################################################
+    # ####################################################################
+
+    # stop the periodic tasks, save the state and wait for the pending writes to other services,
+    # then quit the main loop, at the latest after SHUTDOWN_TIMEOUT seconds
+    def shutdown(self, mainloop):
+        # second signal: don't wait any longer
+        if self._shuttingDown:
+            logging.warning("Shutdown forced, %d write(s) pending" % self._writeQueue.pending)
+            mainloop.quit()
+            return True
+        self._shuttingDown = True
+        logging.info("Shutting down...")
+        self._scheduler.stop()
+
+        # re-enable the DC-coupled PV feed-in disabled by the dynamic CVL reduction,
+        # the reduction starts again from scratch on the next start
+        if settings.RESTORE_FEED_IN_ON_EXIT and self._dynCVLactivated:
+            self._writeQueue.set_value("com.victronenergy.settings", "/Settings/CGwacs/OvervoltageFeedIn", self._DCfeedActive)
+            logging.info("DC-coupled PV feed-in restored to %s" % self._DCfeedActive)
+            self._state.update(DynamicCvl=False, DynCvlActivated=False, DcFeedActive=False)
+
+        # the exact charge, not rounded to CHARGE_SAVE_PRECISION
+        if self._ownCharge >= 0:
+            self._state.update(Charge=round(self._ownCharge, 3))
+        if self._state.flush():
+            logging.info("State saved to %s" % self._state.path)
+
+        deadline = tt.monotonic() + settings.SHUTDOWN_TIMEOUT
+
+        def wait_for_writes():
+            if self._writeQueue.pending == 0:
+                mainloop.quit()
+                return False
+            if tt.monotonic() >= deadline:
+                logging.warning("Shutdown timeout, %d write(s) pending" % self._writeQueue.pending)
+                mainloop.quit()
+                return False
+            return True
+
+        if wait_for_writes():
+            GLib.timeout_add(50, wait_for_writes)
+        return True
+
+    # ######################################################################
+    # ######################################################################
+    # ## search all devices in the services found by the dbusmonitor scan ###
+    # ######################################################################
+    # ######################################################################
+
+    def _scan_complete(self, dbusmon):
         logging.info("dbusmonitor started")
+        self._scanComplete = True
+        if self._cached_topology():
+            # all services are scanned now, a service of the cached topology is missing
+            self._warm_start()
+            if self._cached_topology():
+                logging.warning("Device(s) of the cached topology not found, searching all devices")
+                self._topologyCache.discard()
+        if self._started:
+            # batteries not in the cached topology, which were scanned before the warm start
+            for service in list(dbusmon.servicesByName):
+                if settings.BATTERY_SERVICE_NAME in service and service not in self._batteries_dict.values():
+                    self._device_added(service, dbusmon.get_device_instance(service))
+            return
+        self._searchTrials = 1
+        # first trial immediately, then repeat until SEARCH_TRIALS is reached
+        if self._find_devices():
+            GLib.timeout_add_seconds(settings.UPDATE_INTERVAL_FIND_DEVICES, self._find_devices)
+
+    def _device_finders(self):
+        finders = [
+            ("com.victronenergy.settings", self._find_settings),
+            ("batteries", self._find_batteries),
+        ]
+        # Victron devices are only needed if the current is measured by them
+        if settings.CURRENT_FROM_VICTRON:
+            finders += [
+                ("MultiPlus/Quattro", self._find_multis),
+                ("MPPT(s)", self._find_mppts),
+                ("grid meter", self._find_grid),
+            ]
+        return finders
+
+    # search the device classes not found yet and start if all are present
+    # returns the names of the missing device classes
+    def _search_devices(self):
+        missing = []
+        for name, find in self._device_finders():
+            if name in self._devicesFound:
+                continue
+            if find():
+                self._devicesFound.add(name)
+            else:
+                missing.append(name)
+
+        if not missing:
+            self._start()
+        return missing
+
+    def _start(self):
+        self._started = True
+        self._timeOld = tt.time()
+        self._save_topology()
+        if settings.CURRENT_FROM_VICTRON:
+            self._load_settings()
+        else:
+            # if current from BMS start the _update loop
+            self._start_update_loop()
+
+    def _find_devices(self):
+        # already started by a device, which appeared between two trials
+        if self._started:
+            return False
+
+        logging.info("Searching devices: Trial Nr. %d" % self._searchTrials)
+        missing = self._search_devices()
+        if not missing:
+            # all OK, stop calling this function
+            return False
+        elif self._searchTrials < settings.SEARCH_TRIALS:
+            self._searchTrials += 1
+            # next trial
+            return True
+        else:
+            logging.error("%s not found. Exiting..." % ", ".join(missing))
+            tt.sleep(settings.TIME_BEFORE_RESTART)
+            sys.exit(1)
 
     
+    # ####################################################################
+    # ####################################################################
+    # ## warm start with the devices of the last complete discovery     ###
+    # ####################################################################
+    # ####################################################################
+
+    # the settings which change the result of the discovery, a cached topology is only used with the same settings
+    def _topology_fingerprint(self):
+        return repr(
+            (
+                VERSION,
+                settings.NR_OF_BATTERIES,
+                settings.NR_OF_CELLS_PER_BATTERY,
+                settings.BATTERY_SERVICE_NAME,
+                settings.BATTERY_PRODUCT_NAME,
+                settings.BATTERY_PRODUCT_NAME_PATH,
+                settings.BATTERY_INSTANCE_NAME_PATH,
+                settings.DCLOAD_SERVICE_NAME,
+                settings.SMARTSHUNT_NAME_KEYWORD,
+                settings.SMARTSHUNT_INSTANCE_NAME_PATH,
+                settings.USE_SMARTSHUNTS,
+                settings.CURRENT_FROM_VICTRON,
+                settings.MULTI_KEYWORD,
+                settings.MPPT_KEYWORD,
+                settings.NR_OF_MPPTS,
+                settings.GRID_SERVICE_NAME,
+            )
+        )
+
+    # values which identify a battery or SmartShunt besides service name and device instance
+    def _device_checks(self, service):
+        return [
+            self._dbusMon.dbusmon.get_value(service, settings.BATTERY_PRODUCT_NAME_PATH),
+            self._dbusMon.dbusmon.get_value(service, settings.BATTERY_INSTANCE_NAME_PATH),
+            self._dbusMon.dbusmon.get_value(service, settings.SMARTSHUNT_INSTANCE_NAME_PATH),
+            self._dbusMon.dbusmon.get_value(service, "/System/NrOfCellsPerBattery"),
+        ]
+
+    def _cached_topology(self):
+        return not self._started and self._topologyCache is not None and self._topologyCache.topology is not None
+
+    # save the devices found, only if all batteries are found
+    # otherwise the next start would not wait for the missing batteries
+    def _save_topology(self):
+        if self._topologyCache is None or len(self._batteries_dict) != settings.NR_OF_BATTERIES:
+            return
+        monitor = self._dbusMon.dbusmon
+        self._topologyCache.save(
+            {
+                "Settings": device(monitor, self._settings),
+                "Batteries": [
+                    dict(device(monitor, service), Name=BatteryName, Checks=self._device_checks(service))
+                    for BatteryName, service in self._batteries_dict.items()
+                ],
+                "SmartShunts": [dict(device(monitor, service), Checks=self._device_checks(service)) for service in self._smartShunt_list],
+                "NumBatteryShunts": self._num_battery_shunts,
+                "Multi": device(monitor, self._multi) if self._multi is not None else None,
+                "Mppts": [device(monitor, service) for service in self._mppts_list],
+                "Grid": device(monitor, self._grid) if self._grid is not None else None,
+            }
+        )
+
+    # start with the cached topology as soon as all its services are scanned and match
+    # called for each service scanned, a mismatch falls back to the complete discovery
+    def _warm_start(self):
+        cache = self._topologyCache
+        monitor = self._dbusMon.dbusmon
+        if cache.pending(monitor):
+            return
+        mismatch = cache.mismatch(monitor, self._device_checks)
+        if mismatch is not None:
+            logging.warning("Cached topology does not match: %s, searching all devices" % mismatch)
+            cache.discard()
+            return
+
+        topology = cache.topology
+        try:
+            for entry in topology["Batteries"]:
+                self._add_battery(entry["Service"], entry["Name"])
+            if self._ownCharge < 0:
+                self._ownCharge = (
+                    sum(
+                        monitor.get_value(entry["Service"], "/Soc") * monitor.get_value(entry["Service"], "/InstalledCapacity")
+                        for entry in topology["Batteries"]
+                    )
+                    / 100.0
+                )
+        except Exception:
+            (
+                exception_type,
+                exception_object,
+                exception_traceback,
+            ) = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logging.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+            logging.warning("Cached topology could not be used, searching all devices")
+            for BatteryName in list(self._batteries_dict):
+                self._remove_battery(BatteryName)
+            cache.discard()
+            return
+
+        self._settings = topology["Settings"]["Service"]
+        self._smartShunt_list = [entry["Service"] for entry in topology["SmartShunts"]]
+        self._num_battery_shunts = topology["NumBatteryShunts"]
+        self._multi = topology["Multi"]["Service"] if topology["Multi"] is not None else None
+        self._mppts_list = [entry["Service"] for entry in topology["Mppts"]]
+        self._grid = topology["Grid"]["Service"] if topology["Grid"] is not None else None
+        self._rebuild_battery_tables()
+        self._devicesFound.update(name for name, find in self._device_finders())
+        logging.info(
+            "Started with the cached topology: %d batteries, %d SmartShunts, %d MPPT(s)"
+            % (len(self._batteries_dict), len(self._smartShunt_list), len(self._mppts_list))
+        )
+        self._start()
+
     # ####################################################################
     # ####################################################################
     # ## local setting changed callback funtion                        ###
@@ -365,28 +748,25 @@ class DbusAggBatService(object):
     def _handle_changed_setting(self, setting, oldvalue, newvalue):
         if setting == 'Active':
             if newvalue == 0:
-                self._EssActive = newvalue
-                self._dbusMon.dbusmon.set_value('com.victronenergy.settings', '/Settings/CGwacs/Hub4Mode', 1)
-                #self._dbusMon.dbusmon.set_value(self._multi, '/Hub4/DisableCharge', 0)
-                #self._dbusMon.dbusmon.set_value(self._multi, '/Hub4/DisableFeedIn', 0)
+                self._ess.active = newvalue
+                self._writeQueue.set_value('com.victronenergy.settings', '/Settings/CGwacs/Hub4Mode', 1)
+                #self._writeQueue.set_value(self._multi, '/Hub4/DisableCharge', 0)
+                #self._writeQueue.set_value(self._multi, '/Hub4/DisableFeedIn', 0)
                 logging.info('%s: Hub4Mode set to normal control!' % ((dt.now()).strftime('%c')))
             elif newvalue > 0 and newvalue <=5:
-                self._EssActive = newvalue
-                self._dbusMon.dbusmon.set_value('com.victronenergy.settings', '/Settings/CGwacs/Hub4Mode', 3)
-                self._dbusMon.dbusmon.set_value(self._multi, '/Hub4/DisableCharge', 0)
-                self._dbusMon.dbusmon.set_value(self._multi, '/Hub4/DisableFeedIn', 0)
+                self._ess.active = newvalue
+                self._writeQueue.set_value('com.victronenergy.settings', '/Settings/CGwacs/Hub4Mode', 3)
+                self._writeQueue.set_value(self._multi, '/Hub4/DisableCharge', 0)
+                self._writeQueue.set_value(self._multi, '/Hub4/DisableFeedIn', 0)
                 logging.info('%s: Hub4Mode set to external control!' % ((dt.now()).strftime('%c')))
             else:
                 logging.info('%s: wrong value! Reset to old value!' % ((dt.now()).strftime('%c')))
-        elif setting == 'CorrectionI':
-            self._CorrectionI = newvalue
-            logging.info('%s: /settings/myEss/CorrectionI manually set to %g' % ((dt.now()).strftime('%c'), self._CorrectionI))
         elif setting == 'MinSocLimit':
-            self._MinSocLimit = newvalue
-            logging.info('%s: /settings/myEss/MinSocLimit manually set to %d' % ((dt.now()).strftime('%c'), self._MinSocLimit))
+            self._ess.minSocLimit = newvalue
+            logging.info('%s: /settings/myEss/MinSocLimit manually set to %d' % ((dt.now()).strftime('%c'), self._ess.minSocLimit))
         elif setting == 'SmoothFilter':
-            self._SmoothFilter = newvalue
-            logging.info('%s: /Ess/SmoothFilter manually set to %d' % ((dt.now()).strftime('%c'), self._SmoothFilter))
+            self._ess.smoothFilter = newvalue
+            logging.info('%s: /Ess/SmoothFilter manually set to %d' % ((dt.now()).strftime('%c'), self._ess.smoothFilter))
         logging.info('%s: setting changed, setting: %s, old: %s, new: %s' % ((dt.now()).strftime('%c'), setting, oldvalue, newvalue))
         return
 
@@ -398,9 +778,9 @@ class DbusAggBatService(object):
     # ####################################################################
 
     def _find_settings(self):
-        logging.info("Searching Settings: Trial Nr. %d" % self._searchTrials)
+        logging.info("Searching Settings")
         try:
-            for service in self._dbusConn.list_names():
+            for service in self._dbusMon.service_names():
                 if "com.victronenergy.settings" in service:
                     self._settings = service
                     logging.info("|- com.victronenergy.settings found")
@@ -416,20 +796,7 @@ class DbusAggBatService(object):
 
             pass
 
-        if self._settings is not None:
-            self._searchTrials = 1
-            # search batteries on DBus if present
-            GLib.timeout_add_seconds(settings.UPDATE_INTERVAL_FIND_DEVICES, self._find_batteries)
-            # all OK, stop calling this function
-            return False
-        elif self._searchTrials < settings.SEARCH_TRIALS:
-            self._searchTrials += 1
-            # next trial
-            return True
-        else:
-            logging.error("com.victronenergy.settings not found. Exiting...")
-            tt.sleep(settings.TIME_BEFORE_RESTART)
-            sys.exit(1)
+        return self._settings is not None
 
     # #####################################################################
     # #####################################################################
@@ -438,7 +805,9 @@ class DbusAggBatService(object):
     # #####################################################################
 
     def _find_batteries(self):
-        self._batteries_dict = {}
+        # forget the batteries of the previous trial
+        for BatteryName in list(self._batteries_dict):
+            self._remove_battery(BatteryName)
 
         # SmartShunt list - will be populated so battery category SmartShunts are at the beginning of the list
         self._smartShunt_list = []
@@ -485,11 +854,11 @@ class DbusAggBatService(object):
 
         # keep track of SmartShunt (user-defined) name as specified by SMARTSHUNT_INSTANCE_NAME_PATH
         shuntName = ""
-        logging.info("Searching batteries: Trial Nr. %d" % self._searchTrials)
+        logging.info("Searching batteries")
 
         # if Dbus monitor not running yet, new trial instead of exception
         try:
-            service_names = [str(name) for name in self._dbusConn.list_names() if "com.victronenergy" in str(name)]
+            service_names = [str(name) for name in self._dbusMon.service_names() if "com.victronenergy" in str(name)]
             for service in sorted(service_names):
                 logging.info("|- Dbusmonitor sees: %s" % (service))
                 # Current device is in Victron "battery" service
@@ -522,7 +891,7 @@ class DbusAggBatService(object):
                         if BatteryName in self._batteries_dict:
                             BatteryName = "%s%d" % (BatteryName, batteriesCount + 1)
 
-                        self._batteries_dict[BatteryName] = service
+                        self._add_battery(service, BatteryName)
                         logging.info("   |- Battery name: %s" % BatteryName)
                         logging.info("   |- Custom name:  %s" % self._dbusMon.dbusmon.get_value(service, "/CustomName"))
                         logging.info("   |- Product name: %s" % self._dbusMon.dbusmon.get_value(service, "/ProductName"))
@@ -537,20 +906,6 @@ class DbusAggBatService(object):
                             Soc += battery_soc
                             logging.info("      |- SoC: %f / %f Ah" % (battery_soc / 100.0, battery_capacity))
 
-                        # Create voltage paths with battery names
-                        if settings.SEND_CELL_VOLTAGES == 1:
-                            for cellId in range(1, (settings.NR_OF_CELLS_PER_BATTERY) + 1):
-                                self._dbusservice.add_path(
-                                    "/Voltages/%s_Cell%d"
-                                    % (
-                                        re.sub("[^A-Za-z0-9_]+", "", BatteryName),
-                                        cellId,
-                                    ),
-                                    None,
-                                    writeable=True,
-                                    gettextcallback=lambda a, x: "{:.3f}V".format(x),
-                                )
-
                         # Check if Nr. of cells is equal
                         if self._dbusMon.dbusmon.get_value(service, "/System/NrOfCellsPerBattery") != settings.NR_OF_CELLS_PER_BATTERY:
                             logging.error("     |- Number of battery cells does not match config:")
@@ -658,39 +1013,169 @@ class DbusAggBatService(object):
             logging.info("> %d batteries found." % (batteriesCount))
 
         # make sure the correct number of batteries and SmartShunts has been found
-        if (batteriesCount == settings.NR_OF_BATTERIES) and (len(self._smartShunt_list) >= NR_OF_SMARTSHUNTS):
+        # after the last trial, start with the batteries found, the missing ones join when they appear on DBus
+        batteriesComplete = batteriesCount == settings.NR_OF_BATTERIES
+        if (batteriesComplete or (batteriesCount > 0 and self._searchTrials >= settings.SEARCH_TRIALS)) and (
+            len(self._smartShunt_list) >= NR_OF_SMARTSHUNTS
+        ):
+            if not batteriesComplete:
+                logging.warning(
+                    "Only %d of %d batteries found. Starting anyway, missing batteries are added when they appear on DBus."
+                    % (batteriesCount, settings.NR_OF_BATTERIES)
+                )
             if self._ownCharge < 0:
-                self._ownCharge = Soc / 100.0
+                # the charge of the complete fleet, if batteries are missing
+                self._ownCharge = Soc / 100.0 * settings.NR_OF_BATTERIES / batteriesCount
                 Soc /= InstalledCapacity
-            if settings.CURRENT_FROM_VICTRON:
-                self._searchTrials = 1
-                # if current from Victron stuff search multi/quattro on DBus
-                GLib.timeout_add_seconds(settings.UPDATE_INTERVAL_FIND_DEVICES, self._find_multis)
-            else:
-                self._timeOld = tt.time()
-                # if current from BMS start the _update loop
-                GLib.timeout_add_seconds(settings.UPDATE_INTERVAL_MS, self._update)
-
-            # all OK, stop calling this function
-            return False
+            self._rebuild_battery_tables()
+            return True
         # if the correct number has not been found yet, repeat until SEARCH_TRIALS is reached
         elif self._searchTrials < settings.SEARCH_TRIALS:
-            self._searchTrials += 1
-            # next trial
-            return True
-        # bail out if correct number of batteries and SmartShunts can not be found after SEARCH_TRIALS tries
+            return False
+        # log why the batteries and SmartShunts can not be found after SEARCH_TRIALS tries
         else:
             if NR_OF_SMARTSHUNTS > 0:
                 logging.error(
-                    "Required nr of batteries (%d) or SmartShunts (%d) not found. Exiting...",
+                    "Required nr of batteries (%d) or SmartShunts (%d) not found.",
                     settings.NR_OF_BATTERIES,
                     NR_OF_SMARTSHUNTS,
                 )
             else:
                 logging.info(self._batteries_dict)
-                logging.error("Required number of batteries not found. Exiting...")
-            tt.sleep(settings.TIME_BEFORE_RESTART)
-            sys.exit(1)
+                logging.error("Required number of batteries not found.")
+            return False
+
+    # ###########################################################
+    # ###########################################################
+    # ## add and remove batteries (on startup and hot-plug) ###
+    # ###########################################################
+    # ###########################################################
+
+    def _add_battery(self, service, BatteryName):
+        self._batteries_dict[BatteryName] = service
+        # resolve the monitored values once, the _update loop reads them from the plan
+        self._battery_plans[BatteryName] = self._dbusMon.read_plan(service, settings.NR_OF_CELLS_PER_BATTERY)
+
+        # Create voltage paths with battery names
+        if settings.SEND_CELL_VOLTAGES == 1:
+            self._cellPaths[BatteryName] = tuple(
+                "/Voltages/%s_Cell%d"
+                % (
+                    re.sub("[^A-Za-z0-9_]+", "", BatteryName),
+                    cellId,
+                )
+                for cellId in range(1, (settings.NR_OF_CELLS_PER_BATTERY) + 1)
+            )
+            for path in self._cellPaths[BatteryName]:
+                self._dbusservice.add_path(
+                    path,
+                    None,
+                    writeable=True,
+                    gettextcallback=lambda a, x: "{:.3f}V".format(x),
+                )
+
+    def _remove_battery(self, BatteryName):
+        del self._batteries_dict[BatteryName]
+        self._battery_plans.pop(BatteryName, None)
+        for path in self._cellPaths.pop(BatteryName, ()):
+            # invalidate the value for the listeners before the path is removed
+            self._dbusservice[path] = None
+            del self._dbusservice[path]
+
+    # rebuild everything depending on the set of batteries
+    def _rebuild_battery_tables(self):
+        self._cellMatrix = CellVoltageMatrix(self._battery_plans, settings.NR_OF_CELLS_PER_BATTERY)
+        self._publishPlan = self._build_publish_plan()
+        if self._aggregator is not None:
+            self._aggregator.rebuild(self._battery_plans)
+        self._partials = {name: {} for name in self._battery_plans}
+        # the results may contain batteries which are gone
+        self._reduced = {}
+        self._dirtyBatteries.track(plan.service for plan in self._battery_plans.values())
+        self._dirtyBatteries.mark_all()
+
+    def _device_added(self, service, instance):
+        # the services of the cached topology are scanned one by one, start as soon as they are complete
+        if self._cached_topology():
+            self._warm_start()
+        # a device appearing after the scan may complete the required set, then don't wait for the next trial
+        elif self._scanComplete and not self._started:
+            self._search_devices()
+
+        # the watches of the ESS control are dropped when the grid meter or the Multi leaves the DBus
+        if self._started and service in (self._grid, self._multi):
+            self._ess.track_service(service)
+
+        # before the batteries are found, _find_batteries takes care of all batteries
+        if self._cellMatrix is None or settings.BATTERY_SERVICE_NAME not in service or service in self._batteries_dict.values():
+            return
+
+        productName = self._dbusMon.dbusmon.get_value(service, settings.BATTERY_PRODUCT_NAME_PATH)
+        if (productName is None) or (settings.BATTERY_PRODUCT_NAME not in productName):
+            return
+
+        if self._dbusMon.dbusmon.get_value(service, "/System/NrOfCellsPerBattery") != settings.NR_OF_CELLS_PER_BATTERY:
+            logging.error(
+                "Battery %s not added, %s cells found but %d cells specified in config file"
+                % (
+                    service,
+                    self._dbusMon.dbusmon.get_value(service, "/System/NrOfCellsPerBattery"),
+                    settings.NR_OF_CELLS_PER_BATTERY,
+                )
+            )
+            return
+
+        # the current limits and the own charge are for NR_OF_BATTERIES, e.g. a duplicate or renamed BMS service is ignored
+        if len(self._battery_plans) >= settings.NR_OF_BATTERIES:
+            logging.warning("Battery %s not added, already %d of %d batteries aggregated" % (service, len(self._battery_plans), settings.NR_OF_BATTERIES))
+            return
+
+        BatteryName = self._dbusMon.dbusmon.get_value(service, settings.BATTERY_INSTANCE_NAME_PATH)
+        if BatteryName is None:
+            BatteryName = "Battery%d" % (len(self._batteries_dict) + 1)
+        if BatteryName in self._batteries_dict:
+            BatteryName = "%s%d" % (BatteryName, len(self._batteries_dict) + 1)
+
+        try:
+            self._add_battery(service, BatteryName)
+        except Exception:
+            (
+                exception_type,
+                exception_object,
+                exception_traceback,
+            ) = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logging.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+            logging.error("Battery %s could not be added" % service)
+            if BatteryName in self._batteries_dict:
+                self._remove_battery(BatteryName)
+            return
+
+        self._rebuild_battery_tables()
+        self._save_topology()
+        logging.info("Battery %s (%s) added, %d batteries aggregated" % (BatteryName, service, len(self._battery_plans)))
+
+    def _device_removed(self, service, instance):
+        for BatteryName, batteryService in list(self._batteries_dict.items()):
+            if batteryService == service:
+                self._remove_battery(BatteryName)
+                if self._cellMatrix is not None:
+                    self._rebuild_battery_tables()
+                logging.warning("Battery %s (%s) removed, %d batteries aggregated" % (BatteryName, service, len(self._battery_plans)))
+
+    def _build_publish_plan(self):
+        deadbands = {
+            "/Dc/0/Current": settings.PUBLISH_DEADBAND_CURRENT,
+            "/System/MaxCellVoltage": settings.PUBLISH_DEADBAND_CELL_VOLTAGE,
+            "/System/MinCellVoltage": settings.PUBLISH_DEADBAND_CELL_VOLTAGE,
+        }
+        for paths in self._cellPaths.values():
+            deadbands.update(dict.fromkeys(paths, settings.PUBLISH_DEADBAND_CELL_VOLTAGE))
+
+        plan = PublishPlan(self._dbusservice)
+        plan.add_all(deadbands)
+        return plan
 
     # #########################################################################
     # #########################################################################
@@ -704,9 +1189,9 @@ class DbusAggBatService(object):
         # - current detection of MultiPlus/Quattro is not wanted (i.e. SmartShunts are used instead)
         # may still want to aggregate their batteries when using no inverter/no Victron inverter/charger)
         if len(settings.MULTI_KEYWORD) > 0:
-            logging.info("Searching MultiPlus/Quattro VEbus: Trial Nr. %d" % self._searchTrials)
+            logging.info("Searching MultiPlus/Quattro VEbus")
             try:
-                for service in self._dbusConn.list_names():
+                for service in self._dbusMon.service_names():
                     if settings.MULTI_KEYWORD in service:
                         self._multi = service
                         logging.info("|- %s found." % ((self._dbusMon.dbusmon.get_value(service, "/ProductName")),))
@@ -722,28 +1207,11 @@ class DbusAggBatService(object):
 
                 pass
 
-            logging.info("> 1 MultiPlus/Quattro found.")
             if self._multi is None:
-                if self._searchTrials < settings.SEARCH_TRIALS:
-                    self._searchTrials += 1
-                    # next trial
-                    return True
-                else:
-                    logging.error("Multi/Quattro not found. Exiting...")
-                    tt.sleep(settings.TIME_BEFORE_RESTART)
-                    sys.exit(1)
-
-        if settings.NR_OF_MPPTS > 0:
-            self._searchTrials = 1
-            # search MPPTs on DBus if present
-            GLib.timeout_add_seconds(settings.UPDATE_INTERVAL_FIND_DEVICES, self._find_mppts)
-        else:
-            self._timeOld = tt.time()
-            # if no MPPTs start the _update loop
-            GLib.timeout_add_seconds(settings.UPDATE_INTERVAL_DATA, self._find_grid)
+                return False
+            logging.info("> 1 MultiPlus/Quattro found.")
 
-        # all OK, stop calling this function
-        return False
+        return True
 
     # ############################################################
     # ############################################################
@@ -752,11 +1220,15 @@ class DbusAggBatService(object):
     # ############################################################
 
     def _find_mppts(self):
+        # no MPPTs to search
+        if settings.NR_OF_MPPTS == 0:
+            return True
+
         self._mppts_list = []
         mpptsCount = 0
-        logging.info("Searching MPPT(s): Trial Nr. %d" % self._searchTrials)
+        logging.info("Searching MPPT(s)")
         try:
-            for service in self._dbusConn.list_names():
+            for service in self._dbusMon.service_names():
                 if settings.MPPT_KEYWORD in service:
                     self._mppts_list.append(service)
                     logging.info("|- %s found." % ((self._dbusMon.dbusmon.get_value(service, "/ProductName")),))
@@ -774,19 +1246,7 @@ class DbusAggBatService(object):
             pass
 
         logging.info("> %d MPPT(s) found." % (mpptsCount))
-        if mpptsCount == settings.NR_OF_MPPTS:
-            self._timeOld = tt.time()
-            GLib.timeout_add_seconds(settings.UPDATE_INTERVAL_DATA, self._find_grid)
-            # all OK, stop calling this function
-            return False
-        elif self._searchTrials < settings.SEARCH_TRIALS:
-            self._searchTrials += 1
-            # next trial
-            return True
-        else:
-            logging.error("Required number of MPPTs not found. Exiting...")
-            tt.sleep(settings.TIME_BEFORE_RESTART)
-            sys.exit(1)
+        return mpptsCount == settings.NR_OF_MPPTS
 
 
 
@@ -797,10 +1257,10 @@ class DbusAggBatService(object):
     # ############################################################
     
     def _find_grid(self):
-        logging.info("Searching Grid: Trial Nr. %s" % self._searchTrials)
+        logging.info("Searching Grid")
         #logging.info("GRID_SERVICE_NAME = %s" % settings.GRID_SERVICE_NAME)
         try:
-            for service in self._dbusConn.list_names():
+            for service in self._dbusMon.service_names():
                 #logging.info("> service = %s" % (service))
                 if settings.GRID_SERVICE_NAME in service:
                     self._grid = service
@@ -817,19 +1277,7 @@ class DbusAggBatService(object):
 
             pass
             
-        if (self._grid != None):        
-            self._timeOld = tt.time()
-            GLib.timeout_add_seconds(settings.UPDATE_INTERVAL_DATA, self._load_settings)
-             # all OK, stop calling this function 
-            return False
-        elif self._searchTrials < settings.SEARCH_TRIALS:
-            self._searchTrials += 1
-            # next trial
-            return True
-        else:
-            logging.error('%s: Grid meter not found. Exiting.' % (dt.now()).strftime('%c'))
-            tt.sleep(settings.TIME_BEFORE_RESTART)
-            sys.exit(1)
+        return self._grid is not None
 
     # ############################################################
     # ############################################################
@@ -839,17 +1287,105 @@ class DbusAggBatService(object):
 
     def _load_settings(self):
         logging.info('Load settings from dbus:')
-        self._EssActive = self._dbusMon.dbusmon.get_value('com.victronenergy.settings', '/Settings/MyEss/Active',)
-        logging.info('|- /settings/myEss/Active loaded = %g' % self._EssActive)
-        self._CorrectionI = self._dbusMon.dbusmon.get_value('com.victronenergy.settings', '/Settings/MyEss/CorrectionI')
-        logging.info('|- /settings/myEss/CorrectionI loaded = %g' % self._CorrectionI)
-        self._MinSocLimit = self._dbusMon.dbusmon.get_value('com.victronenergy.settings', '/Settings/MyEss/MinSocLimit')
-        logging.info('|- /settings/myEss/MinSocLimit loaded = %g' % self._MinSocLimit)       
-        self._SmoothFilter = self._dbusMon.dbusmon.get_value('com.victronenergy.settings', '/Settings/MyEss/SmoothFilter')
-        logging.info('|- /settings/myEss/SmoothFilter loaded = %g' % self._SmoothFilter)
+        self._ess.active = self._dbusMon.dbusmon.get_value('com.victronenergy.settings', '/Settings/MyEss/Active',)
+        logging.info('|- /settings/myEss/Active loaded = %g' % self._ess.active)
+        self._ess.minSocLimit = self._dbusMon.dbusmon.get_value('com.victronenergy.settings', '/Settings/MyEss/MinSocLimit')
+        logging.info('|- /settings/myEss/MinSocLimit loaded = %g' % self._ess.minSocLimit)       
+        self._ess.smoothFilter = self._dbusMon.dbusmon.get_value('com.victronenergy.settings', '/Settings/MyEss/SmoothFilter')
+        logging.info('|- /settings/myEss/SmoothFilter loaded = %g' % self._ess.smoothFilter)
+        self._start_update_loop()
+
+    # ############################################################
+    # ############################################################
+    # ## start periodic or event driven update ###
+    # ############################################################
+    # ############################################################
+
+    def _start_update_loop(self):
         self._timeOld = tt.time()
-        GLib.timeout_add(settings.UPDATE_INTERVAL_MS, self._update)
+        if settings.EVENT_DRIVEN_UPDATE:
+            logging.info("Starting event driven update")
+            self._aggregator = IncrementalAggregator(self._battery_plans)
+            self._updateTriggers = self._update_triggers()
+            # the heartbeat keeps the charge counter and ESS control running if no value changes
+        self._ess.multi = self._multi
+        self._ess.grid = self._grid
+        if settings.ESS_ON_GRID_CHANGE and self._multi is not None and self._grid is not None:
+            # the AC power setpoint follows a grid or AC load change within one signal
+            self._ess.track(self._ess_signal)
+        self._scheduler.start()
+
+    def _ess_signal(self, changes):
+        # coalesce the grid and AC out changes of one main loop iteration, the dbusmonitor
+        # stores the new values before the main loop runs the control
+        if not self._essScheduled:
+            self._essScheduled = True
+            GLib.idle_add(self._ess_on_change)
+
+    def _ess_on_change(self):
+        self._essScheduled = False
+        self._update_ess()
+        # one-shot
+        return False
+
+    def _update_triggers(self):
+        # the values of the other services feeding the published aggregates, the changes of all other paths
+        # (grid meter, system, settings, AC paths of the Multi) wait for the heartbeat
+        triggers = set()
+        if settings.CURRENT_FROM_VICTRON:
+            if self._multi is not None:
+                triggers.update(((self._multi, "/Connected"), (self._multi, "/Dc/0/Current")))
+            triggers.update((service, "/Dc/0/Current") for service in self._mppts_list + self._smartShunt_list)
+        # without the signal of its own, the ESS control follows the grid and AC load changes with the update
+        if not settings.ESS_ON_GRID_CHANGE:
+            if self._grid is not None:
+                triggers.add((self._grid, "/Ac/Power"))
+            if self._multi is not None:
+                triggers.add((self._multi, "/Devices/0/Ac/Out/P"))
+        return frozenset(triggers)
+
+    def _value_changed_on_dbus(self, service, path, options, changes, deviceInstance):
+        # ignore changes until the update loop is started
+        if self._aggregator is None:
+            return
+        if not self._aggregator.update(service, path) and (service, path) not in self._updateTriggers:
+            return
+        # coalesce all changes processed in one main loop iteration into one update
+        if not self._updateScheduled:
+            self._updateScheduled = True
+            GLib.idle_add(self._update_on_change)
+
+    def _update_on_change(self):
+        self._updateScheduled = False
+        self._update()
+        # one-shot
+        return False
+
+    def _update_heartbeat(self):
+        # drop the rounding errors accumulated by the incremental updates
+        try:
+            self._aggregator.rebuild(self._battery_plans)
+        except Exception:
+            (
+                exception_type,
+                exception_object,
+                exception_traceback,
+            ) = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logging.debug(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+
+        self._update()
 
+    # current limiting factor by the cell voltage, derated by the temperature if configured
+    # the lowest factor of min. and max. cell temperature is used, no derating without temperature values
+    def _limit_factor(self, curve, temperatureCurve, cellVoltage, minCellTemp, maxCellTemp):
+        if temperatureCurve is None or minCellTemp is None or maxCellTemp is None:
+            return curve(cellVoltage)
+        return min(
+            temperatureCurve(cellVoltage, minCellTemp),
+            temperatureCurve(cellVoltage, maxCellTemp),
+        )
 
     # #################################################################################
     # #################################################################################
@@ -858,6 +1394,8 @@ class DbusAggBatService(object):
     # #################################################################################
 
     def _update(self):
+        self._tickTiming.start()
+
 
         # DC
         Voltage = 0
@@ -873,233 +1411,182 @@ class DbusAggBatService(object):
 
         # Temperature
         Temperature = 0
-        # list, maxima of all physical batteries
-        MaxCellTemp_list = []
-        # list, minima of all physical batteries
-        MinCellTemp_list = []
 
         # Extras
-        cellVoltages_dict = {}
-        # dictionary {'ID' : MaxCellVoltage, ... } for all physical batteries
-        MaxCellVoltage_dict = {}
-        # dictionary {'ID' : MinCellVoltage, ... } for all physical batteries
-        MinCellVoltage_dict = {}
         NrOfModulesOnline = 0
         NrOfModulesOffline = 0
         NrOfModulesBlockingCharge = 0
         NrOfModulesBlockingDischarge = 0
-        # battery voltages from sum of cells
-        VoltagesSum_dict = {}
+        # if some cells are above MAX_CELL_VOLTAGE, store here the sum of differences for each battery
         chargeVoltageReduced_list = []
 
-        # Alarms
-        # lists to find maxima
-        LowVoltage_alarm_list = []
-        HighVoltage_alarm_list = []
-        LowCellVoltage_alarm_list = []
-        LowSoc_alarm_list = []
-        HighChargeCurrent_alarm_list = []
-        HighDischargeCurrent_alarm_list = []
-        CellImbalance_alarm_list = []
-        InternalFailure_alarm_list = []
-        HighChargeTemperature_alarm_list = []
-        LowChargeTemperature_alarm_list = []
-        HighTemperature_alarm_list = []
-        LowTemperature_alarm_list = []
-        BmsCable_alarm_list = []
-
-        # Charge/discharge parameters
-
-        # the minimum of MaxChargeCurrent * NR_OF_BATTERIES to be transmitted
-        MaxChargeCurrent_list = []
-        # the minimum of MaxDischargeCurrent * NR_OF_BATTERIES to be transmitted
-        MaxDischargeCurrent_list = []
-        # if some cells are above MAX_CELL_VOLTAGE, store here the sum of differences for each battery
-        MaxChargeVoltage_list = []
-        # minimum of all to be transmitted
-        AllowToCharge_list = []
-        # minimum of all to be transmitted
-        AllowToDischarge_list = []
-        # minimum of all to be transmitted
-        AllowToBalance_list = []
-        # Bulk, Absorption, Float, Keep always max voltage
-        ChargeMode_list = []
-
-        # ESS variables #######################################################################
-        BatteryPower = 0
-        BatteryCurrent = 0
+        # MPPTs and charge/discharge parameters
         MpptCurrent = 0
         MpptPower = 0
-        AcInPower = 0
-        AcInCurrent = 0
-        AcOutPower = 0
-        AcOutCurrent = 0
-        InverterPower = 0
-        InverterCurrent = 0
-
-        MaxChargePower = 0
         MaxChargeCurrent = 0
         MaxChargeVoltage = 0
-
-        MaxDischargePower = 0
         MaxDischargeCurrent = 0
 
-        GridSetpoint = 0
-        GridPower = 0
-        GridL1 = 0
-        GridL2 = 0
-        GridL3 = 0
-        AcPowerSetpoint = 0
-        BatteryCurrentCalc = 0
-        MaxChrgCellVoltage = 0
-
-        ConsumptionInputL1 = 0
-        ConsumptionInputL2 = 0
-        ConsumptionInputL3 = 0
-        ConsumptionInput = 0
-
-        PvOnGridL1 = 0
-        PvOnGridL2 = 0
-        PvOnGridL3 = 0
-        PvOnGrid = 0
-
-        AcLoadL1 = 0
-        AcLoadL2 = 0
-        AcLoadL3 = 0
-        AcLoad = 0
-
-        MinimumSocLimit = 0
-        ######################################################################
-
         ####################################################
         # Get DBus values from all SerialBattery instances #
         ####################################################
 
-        try:
-            for i in self._batteries_dict:
+        # groups of paths changed per battery service since the last update, None: read everything
+        masks = self._dirtyBatteries.take() if settings.DIRTY_TRACKING else None
+        # groups changed in at least one battery, the results of the other groups are reused
+        changed = 0
 
-                # DC
-                # to detect error
-                step = "Read V, I, P"
-                Voltage += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Dc/0/Voltage")
-                Current += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Dc/0/Current")
-                Power += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Dc/0/Power")
+        try:
+            # all batteries may have left while running, then the read trial fails like on missing values
+            step = "Check number of batteries"
+            i = None
+            if not self._battery_plans:
+                raise TypeError("No battery to aggregate")
+
+            for row, (i, plan) in enumerate(self._battery_plans.items()):
+                # re-resolve the plan if the battery service was re-scanned
+                step = "Resolve read plan"
+                mask = ALL_GROUPS if masks is None else masks.get(plan.service, ALL_GROUPS)
+                if plan.refresh():
+                    mask = ALL_GROUPS
+                    if self._aggregator is not None:
+                        self._aggregator.rebuild(self._battery_plans)
+                changed |= mask
+                values = plan.values
+                partials = self._partials[i]
+
+                if mask & GROUP_DC:
+                    # the sums are maintained by the aggregator in event driven mode
+                    if self._aggregator is None:
+                        # DC
+                        step = "Read V, I, P, capacity, SoC, time to go, temperature and battery state"
+                        battery_capacity = values["/InstalledCapacity"].value
+                        if settings.OWN_SOC:
+                            ConsumedAmphours_battery = Capacity_battery = Soc_battery = ttg = 0
+                        else:
+                            ConsumedAmphours_battery = values["/ConsumedAmphours"].value
+                            Capacity_battery = values["/Capacity"].value
+                            # weighted by the capacity
+                            Soc_battery = values["/Soc"].value * battery_capacity
+                            ttg = values["/TimeToGo"].value
+                            if ttg is not None:
+                                ttg *= battery_capacity
+                        partials["TimeToGo"] = ttg
+                        partials["Dc"] = (
+                            values["/Dc/0/Voltage"].value,
+                            values["/Dc/0/Current"].value,
+                            values["/Dc/0/Power"].value,
+                            battery_capacity,
+                            ConsumedAmphours_battery,
+                            Capacity_battery,
+                            Soc_battery,
+                            values["/Dc/0/Temperature"].value,
+                            values["/System/NrOfModulesOnline"].value,
+                            values["/System/NrOfModulesOffline"].value,
+                            values["/System/NrOfModulesBlockingCharge"].value,
+                            values["/System/NrOfModulesBlockingDischarge"].value,
+                        )
 
-                # Capacity
-                step = "Read and calculate capacity, SoC, Time to go"
-                InstalledCapacity += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/InstalledCapacity")
+                    # Temperature
+                    step = "Read temperatures"
+                    partials["Temperatures"] = (values["/System/MaxCellTemperature"].value, values["/System/MinCellTemperature"].value)
 
-                if not settings.OWN_SOC:
-                    ConsumedAmphours += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/ConsumedAmphours")
-                    Capacity += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Capacity")
-                    Soc += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Soc") * self._dbusMon.dbusmon.get_value(
-                        self._batteries_dict[i], "/InstalledCapacity"
-                    )
-                    ttg = self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/TimeToGo")
-                    if (ttg is not None) and (TimeToGo is not None):
-                        TimeToGo += ttg * self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/InstalledCapacity")
+                if mask & GROUP_CELLS:
+                    step = "Read voltage sum"
+                    # here an exception is raised and new read trial initiated if None is on Dbus
+                    volt_sum_get = values["/Voltages/Sum"].value
+                    if volt_sum_get is not None:
+                        partials["VoltagesSum"] = volt_sum_get
                     else:
-                        TimeToGo = None
-
-                # Temperature
-                step = "Read temperatures"
-                Temperature += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Dc/0/Temperature")
-                MaxCellTemp_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/System/MaxCellTemperature"))
-                MinCellTemp_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/System/MinCellTemperature"))
-
-                # Cell voltages
-                # cell ID : its voltage
-                step = "Read max. and min cell voltages and voltage sum"
-                MaxCellVoltage_dict[
-                    "%s_%s"
-                    % (
-                        i,
-                        self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/System/MaxVoltageCellId"),
-                    )
-                ] = self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/System/MaxCellVoltage")
-                MinCellVoltage_dict[
-                    "%s_%s"
-                    % (
-                        i,
-                        self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/System/MinVoltageCellId"),
-                    )
-                ] = self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/System/MinCellVoltage")
+                        raise TypeError(
+                            f"Battery {i} returns None value of /Voltages/Sum. Please check, if the setting "
+                            + "'BATTERY_CELL_DATA_FORMAT=1' in dbus-serialbattery config"
+                        )
 
-                # here an exception is raised and new read trial initiated if None is on Dbus
-                volt_sum_get = self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Voltages/Sum")
-                if volt_sum_get is not None:
-                    VoltagesSum_dict[i] = volt_sum_get
-                else:
-                    raise TypeError(
-                        f"Battery {i} returns None value of /Voltages/Sum. Please check, if the setting "
-                        + "'BATTERY_CELL_DATA_FORMAT=1' in dbus-serialbattery config"
-                    )
+                    step = "Read cell voltages"
+                    self._cellMatrix.fill(row, plan.cells)
+
+                if mask & GROUP_ALARMS:
+                    # Alarms
+                    step = "Read alarms"
+                    partials["Alarms"] = tuple(values[path].value for path in ALARM_PATHS)
+
+                if mask & GROUP_LIMITS:
+                    # Aggregate charge/discharge parameters
+                    if not settings.OWN_CHARGE_PARAMETERS:
+                        step = "Read charge parameters"
+                        # max. charge current, max. discharge current, max. charge voltage and
+                        # charge mode (Bulk, Absorption, Float, Keep always max voltage)
+                        partials["Info"] = (
+                            values["/Info/MaxChargeCurrent"].value,
+                            values["/Info/MaxDischargeCurrent"].value,
+                            values["/Info/MaxChargeVoltage"].value,
+                            values["/Info/ChargeMode"].value,
+                        )
 
-                # Battery state
-                step = "Read battery state"
-                NrOfModulesOnline += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/System/NrOfModulesOnline")
-                NrOfModulesOffline += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/System/NrOfModulesOffline")
-                NrOfModulesBlockingCharge += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/System/NrOfModulesBlockingCharge")
-                # sum of modules blocking discharge
-                NrOfModulesBlockingDischarge += self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/System/NrOfModulesBlockingDischarge")
-
-                step = "Read cell voltages"
-                for j in range(settings.NR_OF_CELLS_PER_BATTERY):
-                    cellVoltages_dict["%s_Cell%d" % (i, j + 1)] = self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Voltages/Cell%d" % (j + 1))
-
-                # Alarms
-                step = "Read alarms"
-                LowVoltage_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/LowVoltage"))
-                HighVoltage_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/HighVoltage"))
-                LowCellVoltage_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/LowCellVoltage"))
-                LowSoc_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/LowSoc"))
-                HighChargeCurrent_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/HighChargeCurrent"))
-                HighDischargeCurrent_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/HighDischargeCurrent"))
-                CellImbalance_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/CellImbalance"))
-                InternalFailure_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/InternalFailure_alarm"))
-                HighChargeTemperature_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/HighChargeTemperature"))
-                LowChargeTemperature_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/LowChargeTemperature"))
-                HighTemperature_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/HighTemperature"))
-                LowTemperature_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/LowTemperature"))
-                BmsCable_alarm_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Alarms/BmsCable"))
+                    step = "Read Allow to"
+                    partials["Io"] = (values["/Io/AllowToCharge"].value, values["/Io/AllowToDischarge"].value, values["/Io/AllowToBalance"].value)
+
+            if self._aggregator is not None:
+                step = "Read running totals"
+                Voltage = self._aggregator["Voltage"]
+                Current = self._aggregator["Current"]
+                Power = self._aggregator["Power"]
+                InstalledCapacity = self._aggregator["InstalledCapacity"]
+                if not settings.OWN_SOC:
+                    ConsumedAmphours = self._aggregator["ConsumedAmphours"]
+                    Capacity = self._aggregator["Capacity"]
+                    Soc = self._aggregator["Soc"]
+                    TimeToGo = self._aggregator.get("TimeToGo")
+                Temperature = self._aggregator["Temperature"]
+                NrOfModulesOnline = self._aggregator["NrOfModulesOnline"]
+                NrOfModulesOffline = self._aggregator["NrOfModulesOffline"]
+                NrOfModulesBlockingCharge = self._aggregator["NrOfModulesBlockingCharge"]
+                NrOfModulesBlockingDischarge = self._aggregator["NrOfModulesBlockingDischarge"]
+            else:
+                if changed & GROUP_DC:
+                    step = "Sum up DC values"
+                    self._reduced["Dc"] = [sum(column) for column in zip(*(partials["Dc"] for partials in self._partials.values()))]
+                    # time to go is None if it is None for any battery
+                    ttg_list = [partials["TimeToGo"] for partials in self._partials.values()]
+                    self._reduced["TimeToGo"] = None if None in ttg_list else sum(ttg_list)
+                (
+                    Voltage,
+                    Current,
+                    Power,
+                    InstalledCapacity,
+                    ConsumedAmphours,
+                    Capacity,
+                    Soc,
+                    Temperature,
+                    NrOfModulesOnline,
+                    NrOfModulesOffline,
+                    NrOfModulesBlockingCharge,
+                    NrOfModulesBlockingDischarge,
+                ) = self._reduced["Dc"]
+                TimeToGo = self._reduced["TimeToGo"]
+
+            self._tickTiming.stage("Read")
+
+            # batteries can join or leave while running, so the number of aggregated batteries is used
+            NrOfBatteries = len(self._battery_plans)
+
+            if changed & GROUP_CELLS:
+                step = "Find max. and min. cell voltage of all batteries"
+                # raises TypeError if no battery sends valid cell voltages
+                row, cellId, MaxCellVoltage = self._cellMatrix.max()
+                MaxVoltageCellId = "%s_C%d" % (self._cellMatrix.batteries[row], cellId + 1)
+                row, cellId, MinCellVoltage = self._cellMatrix.min()
+                MinVoltageCellId = "%s_C%d" % (self._cellMatrix.batteries[row], cellId + 1)
+                VoltagesSum = sum(partials["VoltagesSum"] for partials in self._partials.values()) / NrOfBatteries
 
                 # calculate reduction of charge voltage as sum of overvoltages of all cells
                 if settings.OWN_CHARGE_PARAMETERS:
                     step = "Calculate CVL reduction"
-                    cellOvervoltage = 0
-                    for j in range(settings.NR_OF_CELLS_PER_BATTERY):
-                        cellVoltage = self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Voltages/Cell%d" % (j + 1))
-                        if cellVoltage > settings.MAX_CELL_VOLTAGE:
-                            cellOvervoltage += cellVoltage - settings.MAX_CELL_VOLTAGE
-                    chargeVoltageReduced_list.append(VoltagesSum_dict[i] - cellOvervoltage)
-
-                # Aggregate charge/discharge parameters
-                else:
-                    step = "Read charge parameters"
-                    # list of max. charge currents to find minimum
-                    MaxChargeCurrent_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Info/MaxChargeCurrent"))
-                    # list of max. discharge currents  to find minimum
-                    MaxDischargeCurrent_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Info/MaxDischargeCurrent"))
-                    # list of max. charge voltages  to find minimum
-                    MaxChargeVoltage_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Info/MaxChargeVoltage"))
-                    # list of charge modes of batteries (Bulk, Absorption, Float, Keep always max voltage)
-                    ChargeMode_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Info/ChargeMode"))
-
-                step = "Read Allow to"
-                # list of AllowToCharge to find minimum
-                AllowToCharge_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Io/AllowToCharge"))
-                # list of AllowToDischarge to find minimum
-                AllowToDischarge_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Io/AllowToDischarge"))
-                # list of AllowToBalance to find minimum
-                AllowToBalance_list.append(self._dbusMon.dbusmon.get_value(self._batteries_dict[i], "/Io/AllowToBalance"))
-
-            step = "Find max. and min. cell voltage of all batteries"
-            # placed in try-except structure for the case if some values are of None.
-            # The _max() and _min() don't work with dictionaries
-            MaxVoltageCellId = max(MaxCellVoltage_dict, key=MaxCellVoltage_dict.get)
-            MaxCellVoltage = MaxCellVoltage_dict[MaxVoltageCellId]
-            MinVoltageCellId = min(MinCellVoltage_dict, key=MinCellVoltage_dict.get)
-            MinCellVoltage = MinCellVoltage_dict[MinVoltageCellId]
+                    for i, cellOvervoltage in zip(self._cellMatrix.batteries, self._cellMatrix.overvoltage(settings.MAX_CELL_VOLTAGE)):
+                        chargeVoltageReduced_list.append(self._partials[i]["VoltagesSum"] - cellOvervoltage)
+                self._reduced["Cells"] = (MaxCellVoltage, MaxVoltageCellId, MinCellVoltage, MinVoltageCellId, VoltagesSum, chargeVoltageReduced_list)
+            MaxCellVoltage, MaxVoltageCellId, MinCellVoltage, MinVoltageCellId, VoltagesSum, chargeVoltageReduced_list = self._reduced["Cells"]
 
         except Exception:
             (
@@ -1114,6 +1601,8 @@ class DbusAggBatService(object):
             logging.error(f"Local variables at error: {locals_at_error}")
             logging.error("Occured during step %s, Battery %s." % (step, i))
             logging.error("Read trial nr. %d" % self._readTrials)
+            # the changes taken for this update are lost, read everything again
+            self._dirtyBatteries.mark_all()
             self._readTrials += 1
             if self._readTrials > settings.READ_TRIALS:
                 logging.error("DBus read failed. Exiting...")
@@ -1128,44 +1617,55 @@ class DbusAggBatService(object):
         #####################################################
 
         # averaging
-        Voltage = Voltage / settings.NR_OF_BATTERIES
-        Temperature = Temperature / settings.NR_OF_BATTERIES
-        VoltagesSum = sum(VoltagesSum_dict.values()) / settings.NR_OF_BATTERIES
-
-        # find max and min cell temperature (have no ID)
-        MaxCellTemp = self._fn._max(MaxCellTemp_list)
-        MinCellTemp = self._fn._min(MinCellTemp_list)
-
-        # find max in alarms
-        LowVoltage_alarm = self._fn._max(LowVoltage_alarm_list)
-        HighVoltage_alarm = self._fn._max(HighVoltage_alarm_list)
-        LowCellVoltage_alarm = self._fn._max(LowCellVoltage_alarm_list)
-        LowSoc_alarm = self._fn._max(LowSoc_alarm_list)
-        HighChargeCurrent_alarm = self._fn._max(HighChargeCurrent_alarm_list)
-        HighDischargeCurrent_alarm = self._fn._max(HighDischargeCurrent_alarm_list)
-        CellImbalance_alarm = self._fn._max(CellImbalance_alarm_list)
-        InternalFailure_alarm = self._fn._max(InternalFailure_alarm_list)
-        HighChargeTemperature_alarm = self._fn._max(HighChargeTemperature_alarm_list)
-        LowChargeTemperature_alarm = self._fn._max(LowChargeTemperature_alarm_list)
-        HighTemperature_alarm = self._fn._max(HighTemperature_alarm_list)
-        LowTemperature_alarm = self._fn._max(LowTemperature_alarm_list)
-        BmsCable_alarm = self._fn._max(BmsCable_alarm_list)
-
-        # find max. charge voltage (if needed)
-        if not settings.OWN_CHARGE_PARAMETERS:
-            if settings.KEEP_MAX_CVL and any("Float" in item for item in ChargeMode_list):
-                MaxChargeVoltage = self._fn._max(MaxChargeVoltage_list)
-
-            else:
-                MaxChargeVoltage = self._fn._min(MaxChargeVoltage_list)
-
-            MaxChargeCurrent = self._fn._min(MaxChargeCurrent_list) * settings.NR_OF_BATTERIES
+        Voltage = Voltage / NrOfBatteries
+        Temperature = Temperature / NrOfBatteries
+
+        if changed & GROUP_DC:
+            # find max and min cell temperature (have no ID)
+            MaxCellTemp_list, MinCellTemp_list = zip(*(partials["Temperatures"] for partials in self._partials.values()))
+            self._reduced["Temperatures"] = (self._fn._max(MaxCellTemp_list), self._fn._min(MinCellTemp_list))
+        MaxCellTemp, MinCellTemp = self._reduced["Temperatures"]
+
+        if changed & GROUP_ALARMS:
+            # find max in alarms
+            self._reduced["Alarms"] = tuple(self._fn._max(column) for column in zip(*(partials["Alarms"] for partials in self._partials.values())))
+        (
+            LowVoltage_alarm,
+            HighVoltage_alarm,
+            LowCellVoltage_alarm,
+            LowSoc_alarm,
+            HighChargeCurrent_alarm,
+            HighDischargeCurrent_alarm,
+            CellImbalance_alarm,
+            InternalFailure_alarm,
+            HighChargeTemperature_alarm,
+            LowChargeTemperature_alarm,
+            HighTemperature_alarm,
+            LowTemperature_alarm,
+            BmsCable_alarm,
+        ) = self._reduced["Alarms"]
+
+        if changed & GROUP_LIMITS:
+            # find max. charge voltage (if needed)
+            if not settings.OWN_CHARGE_PARAMETERS:
+                MaxChargeCurrent_list, MaxDischargeCurrent_list, MaxChargeVoltage_list, ChargeMode_list = zip(
+                    *(partials["Info"] for partials in self._partials.values())
+                )
+                if settings.KEEP_MAX_CVL and any("Float" in item for item in ChargeMode_list):
+                    MaxChargeVoltage = self._fn._max(MaxChargeVoltage_list)
+                else:
+                    MaxChargeVoltage = self._fn._min(MaxChargeVoltage_list)
+                MaxChargeCurrent = self._fn._min(MaxChargeCurrent_list) * NrOfBatteries
+                MaxDischargeCurrent = self._fn._min(MaxDischargeCurrent_list) * NrOfBatteries
 
-            MaxDischargeCurrent = self._fn._min(MaxDischargeCurrent_list) * settings.NR_OF_BATTERIES
+            AllowToCharge_list, AllowToDischarge_list, AllowToBalance_list = zip(*(partials["Io"] for partials in self._partials.values()))
+            AllowToCharge = self._fn._min(AllowToCharge_list)
+            AllowToDischarge = self._fn._min(AllowToDischarge_list)
+            AllowToBalance = self._fn._min(AllowToBalance_list)
+            self._reduced["Limits"] = (MaxChargeVoltage, MaxChargeCurrent, MaxDischargeCurrent, AllowToCharge, AllowToDischarge, AllowToBalance)
+        MaxChargeVoltage, MaxChargeCurrent, MaxDischargeCurrent, AllowToCharge, AllowToDischarge, AllowToBalance = self._reduced["Limits"]
 
-        AllowToCharge = self._fn._min(AllowToCharge_list)
-        AllowToDischarge = self._fn._min(AllowToDischarge_list)
-        AllowToBalance = self._fn._min(AllowToBalance_list)
+        self._tickTiming.stage("Reduce")
 
         ####################################
         # Measure current by Victron stuff #
@@ -1269,10 +1769,18 @@ class DbusAggBatService(object):
         # must be reset after try-except of all reads
         self._readTrials = 1
 
+        self._tickTiming.stage("VictronCurrent")
+
         ####################################################################################################
         # Calculate own charge/discharge parameters (overwrite the values received from the SerialBattery) #
         ####################################################################################################
 
+        # the current limits and the own charge are for NR_OF_BATTERIES, while batteries are missing only the share
+        # of the present ones applies, the capacity of the complete fleet is estimated from the present batteries
+        FleetShare = NrOfBatteries / settings.NR_OF_BATTERIES
+        FleetComplete = NrOfBatteries >= settings.NR_OF_BATTERIES
+        FleetCapacity = InstalledCapacity / FleetShare
+
         if settings.OWN_CHARGE_PARAMETERS:
             CVL_NORMAL = settings.NR_OF_CELLS_PER_BATTERY * settings.CHARGE_VOLTAGE_LIST[int((dt.now()).strftime("%m")) - 1]
             CVL_BALANCING = settings.NR_OF_CELLS_PER_BATTERY * settings.BALANCING_VOLTAGE
@@ -1290,12 +1798,14 @@ class DbusAggBatService(object):
                 if (self._balancing == 0) and (time_unbalanced >= settings.BALANCING_REPETITION):
                     # activate increased CVL for balancing
                     self._balancing = 1
+                    self._state.update(Balancing=self._balancing)
                     logging.info("CVL increase for balancing activated")
 
                 if self._balancing == 1:
                     ChargeVoltageBattery = CVL_BALANCING
                     if (Voltage >= CVL_BALANCING) and ((MaxCellVoltage - MinCellVoltage) < settings.CELL_DIFF_MAX):
                         self._balancing = 2
+                        self._state.update(Balancing=self._balancing)
                         logging.info("Balancing goal reached")
 
                 if self._balancing >= 2:
@@ -1305,12 +1815,8 @@ class DbusAggBatService(object):
                     if Voltage <= CVL_NORMAL:
                         self._balancing = 0
                         self._lastBalancing = int((dt.now()).strftime("%j"))
-                        self._lastBalancing_file = open(
-                            "/data/apps/dbus-aggregate-batteries/storedvalue_last_balancing",
-                            "w",
-                        )
-                        self._lastBalancing_file.write("%s" % self._lastBalancing)
-                        self._lastBalancing_file.close()
+                        self._state.update(Balancing=self._balancing, LastBalancing=self._lastBalancing)
+                        self._state.flush()
                         logging.info("CVL increase for balancing de-activated")
 
                 if self._balancing == 0:
@@ -1318,16 +1824,12 @@ class DbusAggBatService(object):
 
             # if normal charging voltage is 100% SoC and balancing is finished
             elif (time_unbalanced > 0) and (Voltage >= CVL_BALANCING) and ((MaxCellVoltage - MinCellVoltage) < settings.CELL_DIFF_MAX):
-                logging.info("Balancing goal reached with full charging set as normal. Updating storedvalue_last_balancing file")
+                logging.info("Balancing goal reached with full charging set as normal. Updating the last balancing day")
                 self._lastBalancing = int((dt.now()).strftime("%j"))
-                self._lastBalancing_file = open(
-                    "/data/apps/dbus-aggregate-batteries/storedvalue_last_balancing",
-                    "w",
-                )
-                self._lastBalancing_file.write("%s" % self._lastBalancing)
-                self._lastBalancing_file.close()
+                self._state.update(LastBalancing=self._lastBalancing)
+                self._state.flush()
 
-            if Voltage >= CVL_BALANCING:
+            if Voltage >= CVL_BALANCING and FleetComplete:
                 # reset Coulumb counter to 100%
                 self._ownCharge = InstalledCapacity
 
@@ -1346,7 +1848,7 @@ class DbusAggBatService(object):
                         )
 
                         # disable DC-coupled PV feed-in
-                        self._dbusMon.dbusmon.set_value(
+                        self._writeQueue.set_value(
                             "com.victronenergy.settings",
                             "/Settings/CGwacs/OvervoltageFeedIn",
                             0,
@@ -1369,7 +1871,7 @@ class DbusAggBatService(object):
                     if (MaxCellVoltage - MinCellVoltage) < settings.CELL_DIFF_MAX:
 
                         # re-enable DC-feed if it was enabled before
-                        self._dbusMon.dbusmon.set_value(
+                        self._writeQueue.set_value(
                             "com.victronenergy.settings",
                             "/Settings/CGwacs/OvervoltageFeedIn",
                             self._DCfeedActive,
@@ -1383,7 +1885,10 @@ class DbusAggBatService(object):
                         self._DCfeedActive = False
                         self._dynCVLactivated = False
 
-            if (MinCellVoltage <= settings.MIN_CELL_VOLTAGE) and settings.ZERO_SOC:
+            # restore the dynamic CVL reduction and the DC-coupled PV feed-in after a restart
+            self._state.update(DynamicCvl=self._dynamicCVL, DynCvlActivated=self._dynCVLactivated, DcFeedActive=self._DCfeedActive)
+
+            if (MinCellVoltage <= settings.MIN_CELL_VOLTAGE) and settings.ZERO_SOC and FleetComplete:
                 # reset Coulumb counter to 0%
                 self._ownCharge = 0
 
@@ -1391,10 +1896,12 @@ class DbusAggBatService(object):
             if NrOfModulesBlockingCharge > 0:
                 MaxChargeCurrent = 0
             else:
-                MaxChargeCurrent = settings.MAX_CHARGE_CURRENT * self._fn._interpolate(
-                    settings.CELL_CHARGE_LIMITING_VOLTAGE,
-                    settings.CELL_CHARGE_LIMITED_CURRENT,
+                MaxChargeCurrent = settings.MAX_CHARGE_CURRENT * FleetShare * self._limit_factor(
+                    settings.CELL_CHARGE_LIMITING_CURVE,
+                    settings.CELL_CHARGE_LIMITING_TEMPERATURE_CURVE,
                     MaxCellVoltage,
+                    MinCellTemp,
+                    MaxCellTemp,
                 )
 
             # manage discharge current
@@ -1406,15 +1913,17 @@ class DbusAggBatService(object):
             if (NrOfModulesBlockingDischarge > 0) or (self._fullyDischarged):
                 MaxDischargeCurrent = 0
             else:
-                MaxDischargeCurrent = settings.MAX_DISCHARGE_CURRENT * self._fn._interpolate(
-                    settings.CELL_DISCHARGE_LIMITING_VOLTAGE,
-                    settings.CELL_DISCHARGE_LIMITED_CURRENT,
+                MaxDischargeCurrent = settings.MAX_DISCHARGE_CURRENT * FleetShare * self._limit_factor(
+                    settings.CELL_DISCHARGE_LIMITING_CURVE,
+                    settings.CELL_DISCHARGE_LIMITING_TEMPERATURE_CURVE,
                     MinCellVoltage,
+                    MinCellTemp,
+                    MaxCellTemp,
                 )
 
         # SoC resetting if OWN_SOC = True and OWN_CHARGE_PARAMETERS = False
         else:
-            if settings.OWN_SOC:
+            if settings.OWN_SOC and FleetComplete:
                 # reset Coulumb counter to 100%
                 if MaxCellVoltage >= settings.MAX_CELL_VOLTAGE_SOC_FULL:
                     self._ownCharge = InstalledCapacity
@@ -1428,27 +1937,27 @@ class DbusAggBatService(object):
 
         deltaTime = tt.time() - self._timeOld
         self._timeOld = tt.time()
-        if Current > 0:
-            # charging (with efficiency)
-            self._ownCharge += Current * (deltaTime / 3600) * settings.BATTERY_EFFICIENCY
-        else:
-            # discharging
-            self._ownCharge += Current * (deltaTime / 3600)
-        self._ownCharge = max(self._ownCharge, 0)
-        self._ownCharge = min(self._ownCharge, InstalledCapacity)
+        # the current of missing batteries is not measured, the charge is kept until the fleet is complete again
+        if FleetComplete:
+            if Current > 0:
+                # charging (with efficiency)
+                self._ownCharge += Current * (deltaTime / 3600) * settings.BATTERY_EFFICIENCY
+            else:
+                # discharging
+                self._ownCharge += Current * (deltaTime / 3600)
+            self._ownCharge = max(self._ownCharge, 0)
+            self._ownCharge = min(self._ownCharge, InstalledCapacity)
 
         # store the charge into text file if changed significantly (avoid frequent file access)
-        if abs(self._ownCharge - self._ownCharge_old) >= (settings.CHARGE_SAVE_PRECISION * InstalledCapacity):
-            self._charge_file = open("/data/apps/dbus-aggregate-batteries/storedvalue_charge", "w")
-            self._charge_file.write("%.3f" % self._ownCharge)
-            self._charge_file.close()
+        if abs(self._ownCharge - self._ownCharge_old) >= (settings.CHARGE_SAVE_PRECISION * FleetCapacity):
+            self._state.update(Charge=round(self._ownCharge, 3))
             self._ownCharge_old = self._ownCharge
 
         # overwrite BMS charge values
         if settings.OWN_SOC:
             Capacity = self._ownCharge
-            Soc = 100 * self._ownCharge / InstalledCapacity
-            ConsumedAmphours = InstalledCapacity - self._ownCharge
+            Soc = 100 * self._ownCharge / FleetCapacity
+            ConsumedAmphours = FleetCapacity - self._ownCharge
             if (self._dbusMon.dbusmon.get_value("com.victronenergy.system", "/SystemState/LowSoc") == 0) and (Current < 0):
                 TimeToGo = -3600 * self._ownCharge / Current
             else:
@@ -1460,117 +1969,34 @@ class DbusAggBatService(object):
                 # weighted sum
                 TimeToGo = TimeToGo / InstalledCapacity
 
-        # ### ESS code ################################################################################################
-        AcInPower = self._dbusMon.dbusmon.get_value(self._multi, '/Devices/0/Ac/In/P')
-        AcInCurrent = AcInPower / 230 if AcInPower is not None else 0
-        
-        AcOutPower = self._dbusMon.dbusmon.get_value(self._multi, '/Devices/0/Ac/Out/P')
-        AcOutCurrent = AcOutPower / 230 if AcOutPower is not None else 0
-
-        InverterPower = self._dbusMon.dbusmon.get_value(self._multi, '/Devices/0/Ac/Inverter/P')
-        InverterCurrent = InverterPower / Voltage if InverterPower is not None else 0
-        
-        GridSetpoint = self._dbusMon.dbusmon.get_value('com.victronenergy.settings', '/Settings/CGwacs/AcPowerSetPoint')
-        #MinimumSocLimit = self._dbusMon.dbusmon.get_value('com.victronenergy.settings', '/Settings/CGwacs/BatteryLife/MinimumSocLimit')
-        #MinimumSocLimit = self._dbusMon.dbusmon.get_value('com.victronenergy.settings', '/Settings/myEss/MinSocLimit')
-        MinimumSocLimit = self._MinSocLimit
-
-        GridPower = self._dbusMon.dbusmon.get_value(self._grid, '/Ac/Power')
-        GridL1 = self._dbusMon.dbusmon.get_value(self._grid, '/Ac/L1/Power')
-        GridL2 = self._dbusMon.dbusmon.get_value(self._grid, '/Ac/L2/Power')
-        GridL3 = self._dbusMon.dbusmon.get_value(self._grid, '/Ac/L3/Power')
-
-        ConsumptionInputL1 = self._dbusMon.dbusmon.get_value('com.victronenergy.system', '/Ac/ConsumptionOnInput/L1/Power')
-        ConsumptionInputL2 = self._dbusMon.dbusmon.get_value('com.victronenergy.system', '/Ac/ConsumptionOnInput/L2/Power')
-        ConsumptionInputL3 = self._dbusMon.dbusmon.get_value('com.victronenergy.system', '/Ac/ConsumptionOnInput/L3/Power')
-        ConsumptionInput = ConsumptionInputL1 + ConsumptionInputL2 + ConsumptionInputL3
-
-        PvOnGridL1 = self._dbusMon.dbusmon.get_value('com.victronenergy.system', '/Ac/PvOnGrid/L1/Power')
-        PvOnGridL2 = self._dbusMon.dbusmon.get_value('com.victronenergy.system', '/Ac/PvOnGrid/L2/Power')
-        PvOnGridL3 = self._dbusMon.dbusmon.get_value('com.victronenergy.system', '/Ac/PvOnGrid/L3/Power')
-        PvOnGrid = PvOnGridL1 + PvOnGridL2 + PvOnGridL3
-
-        AcLoadL1 = GridL1 + PvOnGridL1 - AcInPower
-        AcLoadL2 = GridL2 + PvOnGridL2
-        AcLoadL3 = GridL3 + PvOnGridL3
-        AcLoad = AcLoadL1 + AcLoadL2 + AcLoadL3
-
-        BatteryPower = Power
-        BatteryCurrent = Current
-        BatteryCurrentCalc = MpptCurrent + InverterCurrent
-        MaxChargePower = MaxChargeCurrent * Voltage
-        MaxDischargePower = MaxDischargeCurrent * Voltage
-        MaxChrgCellVoltage = MaxChargeVoltage / settings.NR_OF_CELLS_PER_BATTERY
-        if MaxChargeCurrent > self._MaxChargeCurrentSm:
-            self._MaxChargeCurrentSm = ((self._SmoothFilter * self._MaxChargeCurrentSm) + MaxChargeCurrent) / (self._SmoothFilter + 1)
-        else:
-            self._MaxChargeCurrentSm = MaxChargeCurrent #((self._SmoothFilter * self._MaxChargeCurrentSm) + MaxChargeCurrent) / (self._SmoothFilter + 1)
-        MaxChargePowerSmooth = self._MaxChargeCurrentSm * Voltage
-        
-        CorrectionCurrent = BatteryCurrentCalc - BatteryCurrent
-        CorrectionPower = CorrectionCurrent * Voltage
-
-        ###############################################################################
-        # ESS magic
-        #
-        # Calculation of AcPowerSetpoint
-        # positive AcPowerSetpoint means MP2 is consuming power from the AC input side
-        # negative AcPowerSetpoint means MP2 is sourcing power to the AC input side
-        ###############################################################################
-        
-        # APSp1: compensate AC out power and charge battery with grid and MPPTs using maximum charge power
-        APSp1 = AcOutPower + (MaxChargePowerSmooth - MpptPower) + CorrectionPower
-        
-        # APSp2: maintain gridsetpoint using PvOnGrid and battery (?)
-        APSp2 = GridSetpoint + PvOnGrid - ConsumptionInput
-        
-        # APSp4: maintain gridsepoint and charge battery using PvOnGrid and MPPTs  
-        APSp4 = GridSetpoint + PvOnGrid - AcLoad
-        
-        # APSp5: maintain gridsepoint and charge battery using MPPTs only
-        APSp5 = AcOutPower - MpptPower + min(MpptPower,(MaxChargePowerSmooth + CorrectionPower)) 
-
-        # APSp_noDischarge: prohibit battery discharge
-        APSp_noDischarge = AcOutPower
-
-        if (Soc < MinimumSocLimit):
-            SocOffset = 5
-        else:
-            SocOffset = 0
-        
-        if (self._EssActive > 0):
-            if (self._EssActive == 1):
-                AcPowerSetpoint = APSp1
-            elif (self._EssActive == 2):
-                AcPowerSetpoint = APSp2
-            elif (self._EssActive == 3):
-                AcPowerSetpoint = min(APSp1,APSp2)
-            elif (self._EssActive == 4):  # winter?!
-                AcPowerSetpoint = min(APSp1,APSp4)
-                if (Soc < (MinimumSocLimit + SocOffset)):
-                    AcPowerSetpoint = max(min(APSp1,APSp4),APSp_noDischarge)
-            elif (self._EssActive == 5): # summer
-                AcPowerSetpoint = min(APSp5,APSp4)
-                if (Soc < (MinimumSocLimit + SocOffset)):
-                    AcPowerSetpoint = max(min(APSp5,APSp4),APSp_noDischarge)
-            self._dbusMon.dbusmon.set_value(self._multi, '/Hub4/L1/AcPowerSetpoint',AcPowerSetpoint)
-            #switch off inverter
-            #self._dbusMon.dbusmon.set_value('com.victronenergy.settings', '/Settings/CGwacs/MaxDischargePower', 0)
-            #switch on inverter
-            #self._dbusMon.dbusmon.set_value('com.victronenergy.settings', '/Settings/CGwacs/MaxDischargePower', -1)
-        else:
-            AcPowerSetpoint = self._dbusMon.dbusmon.get_value(self._multi, '/Hub4/L1/AcPowerSetpoint')
-
-        #logging.info('1=%d | 2=%d | 4=%d | 5=%d | nD=%d | APS=%d' % (APSp1,APSp2,APSp4,APSp5,APSp_noDischarge,AcPowerSetpoint))
-
-        # ### ESS code ################################################################################################
-
+        self._tickTiming.stage("ChargeParameters")
+
+        # used by the ESS control and the periodic logging until the next aggregation
+        self._aggregated = {
+            "Voltage": Voltage,
+            "Current": Current,
+            "Power": Power,
+            "Soc": Soc,
+            "MpptCurrent": MpptCurrent,
+            "MpptPower": MpptPower,
+            "MaxChargeVoltage": MaxChargeVoltage,
+            "MaxChargeCurrent": MaxChargeCurrent,
+            "MaxDischargeCurrent": MaxDischargeCurrent,
+            "MinVoltageCellId": MinVoltageCellId,
+            "MinCellVoltage": MinCellVoltage,
+            "MaxVoltageCellId": MaxVoltageCellId,
+            "MaxCellVoltage": MaxCellVoltage,
+        }
 
         #######################
         # Send values to DBus #
         #######################
 
-        with self._dbusservice as bus:
+        with self._publishPlan as bus:
+            # ESS control at the rate of the update, if it is not a task of its own
+            if "Ess" not in self._scheduler.tasks:
+                self._ess.control(self._aggregated, bus)
+            self._tickTiming.stage("Ess")
 
             # send DC
             bus["/Dc/0/Voltage"] = Voltage
@@ -1600,9 +2026,9 @@ class DbusAggBatService(object):
             bus["/Voltages/Sum"] = VoltagesSum
             bus["/Voltages/Diff"] = round(MaxCellVoltage - MinCellVoltage, 3)
 
-            if settings.SEND_CELL_VOLTAGES == 1:
-                for cellId, currentCell in enumerate(cellVoltages_dict):
-                    bus["/Voltages/%s" % (re.sub("[^A-Za-z0-9_]+", "", currentCell))] = cellVoltages_dict[currentCell]
+            # cell voltages at the rate of the update, if they are not a task of their own
+            if "Cells" not in self._scheduler.tasks:
+                self._publish_cells(bus)
 
             # send battery state
             bus["/System/NrOfCellsPerBattery"] = settings.NR_OF_CELLS_PER_BATTERY
@@ -1647,70 +2073,98 @@ class DbusAggBatService(object):
                 logging.error("BMS connection lost.")
             """
 
-                       # ess stuff ##########################################################
-            bus['/Ess/BatteryP'] = round(BatteryPower,0)
-            bus['/Ess/BatteryI'] = round(BatteryCurrent,0)
-            bus['/Ess/BatteryCalcI'] = round(BatteryCurrentCalc,2)
-            bus['/Ess/MpptP'] = round(MpptPower,0)
-            bus['/Ess/MpptI'] = round(MpptCurrent, 2)
-            bus['/Ess/AcInP'] = round(AcInPower,0) if AcInPower is not None else 0
-            bus['/Ess/AcInI'] = round(AcInCurrent,2) 
-            bus['/Ess/AcOutP'] = round(AcOutPower,0) if AcOutPower is not None else 0
-            bus['/Ess/AcOutI'] = round(AcOutCurrent,2)
-            bus['/Ess/InverterP'] = round(InverterPower,0) if InverterPower is not None else 0
-            bus['/Ess/InverterI'] = round(InverterCurrent,2)
-            bus['/Ess/MaxChargeP'] = round(MaxChargePower,0)
-            bus['/Ess/MaxChargeI'] = round(MaxChargeCurrent,2)
-            bus['/Ess/MaxChargeIsm'] = round(self._MaxChargeCurrentSm,2)
-            bus['/Ess/GridSetpoint'] = round(GridSetpoint,0) if GridSetpoint is not None else -1
-            bus['/Ess/GridP'] = round(GridPower,0)    
-            bus['/Ess/AcPowerSetpoint'] = round(AcPowerSetpoint,0) if AcPowerSetpoint is not None else -1  
-            bus['/Ess/MaxChrgCellVoltage'] = round(MaxChrgCellVoltage,3)
-            bus['/Ess/ConsumptionInputL1'] = round(ConsumptionInputL1,1) if ConsumptionInputL1 is not None else -1  
-            bus['/Ess/ConsumptionInputL2'] = round(ConsumptionInputL2,1) if ConsumptionInputL2 is not None else -1 
-            bus['/Ess/ConsumptionInputL3'] = round(ConsumptionInputL3,1) if ConsumptionInputL3 is not None else -1 
-            bus['/Ess/ConsumptionInput'] = round(ConsumptionInput,1)
-            bus['/Ess/PvOnGridL1'] = round(PvOnGridL1,1) if PvOnGridL1 is not None else -1  
-            bus['/Ess/PvOnGridL2'] = round(PvOnGridL2,1) if PvOnGridL2 is not None else -1 
-            bus['/Ess/PvOnGridL3'] = round(PvOnGridL3,1) if PvOnGridL3 is not None else -1 
-            bus['/Ess/PvOnGrid'] = round(PvOnGrid,1)
-            bus['/Ess/AcLoadL1'] = round(AcLoadL1,1) if AcLoadL1 is not None else -1  
-            bus['/Ess/AcLoadL2'] = round(AcLoadL2,1) if AcLoadL2 is not None else -1 
-            bus['/Ess/AcLoadL3'] = round(AcLoadL3,1) if AcLoadL3 is not None else -1 
-            bus['/Ess/AcLoad'] = round(AcLoad,1)
-            bus['/Ess/CorrectionI'] = round(CorrectionCurrent,3)
-            bus['/Ess/MinimumSocLimit'] = self._MinSocLimit
-            bus['/Ess/Active'] = self._EssActive
-            bus['/Ess/SmoothFilter'] = self._SmoothFilter
-            # ess stuff ##########################################################
-
 
             # this does not control the charger, is only displayed in GUI
             bus["/Io/AllowToCharge"] = AllowToCharge
             bus["/Io/AllowToDischarge"] = AllowToDischarge
             bus["/Io/AllowToBalance"] = AllowToBalance
 
-        # ##########################################################
-        # ################ Periodic logging ########################
-        # ##########################################################
+            # timing of the previous update
+            if settings.TICK_TIMING:
+                self._tickTiming.publish(bus)
+                self._scheduler.publish(bus)
+
+            # counters of the writes to other services
+            self._writeQueue.publish(bus)
+
+        now = tt.monotonic()
+        if self._history is not None and self._history.due(now):
+            AcPowerSetpoint, GridPower, AcLoad, PvOnGrid = self._ess.values
+            # written directly into the columns of the history
+            history = self._history
+            history.set("Voltage", Voltage)
+            history.set("Current", Current)
+            history.set("Power", Power)
+            history.set("Soc", Soc)
+            history.set("Temperature", Temperature)
+            history.set("MaxCellVoltage", MaxCellVoltage)
+            history.set("MinCellVoltage", MinCellVoltage)
+            history.set("MaxCellTemperature", MaxCellTemp)
+            history.set("MinCellTemperature", MinCellTemp)
+            history.set("MaxChargeVoltage", MaxChargeVoltage)
+            history.set("MaxChargeCurrent", MaxChargeCurrent)
+            history.set("MaxDischargeCurrent", MaxDischargeCurrent)
+            history.set("OwnCharge", self._ownCharge)
+            history.set("Balancing", self._balancing)
+            history.set("DynamicCvl", self._dynamicCVL)
+            history.set("AcPowerSetpoint", AcPowerSetpoint)
+            history.set("GridPower", GridPower)
+            history.set("AcLoad", AcLoad)
+            history.set("MpptPower", MpptPower)
+            history.set("PvOnGrid", PvOnGrid)
+            history.record(now)
+
+        self._tickTiming.stage("Publish")
+
+        self._tickTiming.finish()
+        return True
 
-        if settings.LOG_PERIOD > 0 and int(tt.time()) - self._logLastPrintTimeStamp >= settings.LOG_PERIOD:
-            self._logLastPrintTimeStamp = int(tt.time())
-            logging.info(f"Repetitive logging (every {settings.LOG_PERIOD}s)")
-            logging.info("|- CVL: %.1fV, CCL: %.0fA, DCL: %.0fA" % (MaxChargeVoltage, MaxChargeCurrent, MaxDischargeCurrent))
-            logging.info("|- Bat. voltage: %.1fV, Bat. current: %.0fA, SoC: %.1f%%, Balancing state: %d" % (Voltage, Current, Soc, self._balancing))
-            logging.info(
-                "|- Min. cell voltage: %s: %.3fV, Max. cell voltage: %s: %.3fV, difference: %.3fV"
-                % (
-                    MinVoltageCellId,
-                    MinCellVoltage,
-                    MaxVoltageCellId,
-                    MaxCellVoltage,
-                    MaxCellVoltage - MinCellVoltage,
-                )
+    def _update_ess(self):
+        # nothing to control before the first aggregation
+        if self._aggregated is None:
+            return
+        with self._publishPlan as bus:
+            self._ess.control(self._aggregated, bus)
+
+    def _publish_cells(self, bus):
+        for i, paths in self._cellPaths.items():
+            for path, cell in zip(paths, self._battery_plans[i].cells):
+                bus[path] = cell.value
+
+    def _update_cells(self):
+        with self._publishPlan as bus:
+            self._publish_cells(bus)
+
+    # ##########################################################
+    # ################ Periodic logging ########################
+    # ##########################################################
+
+    def _periodic_logging(self):
+        if self._aggregated is None:
+            return
+        MaxChargeVoltage = self._aggregated["MaxChargeVoltage"]
+        MaxChargeCurrent = self._aggregated["MaxChargeCurrent"]
+        MaxDischargeCurrent = self._aggregated["MaxDischargeCurrent"]
+        Voltage = self._aggregated["Voltage"]
+        Current = self._aggregated["Current"]
+        Soc = self._aggregated["Soc"]
+        MinVoltageCellId = self._aggregated["MinVoltageCellId"]
+        MinCellVoltage = self._aggregated["MinCellVoltage"]
+        MaxVoltageCellId = self._aggregated["MaxVoltageCellId"]
+        MaxCellVoltage = self._aggregated["MaxCellVoltage"]
+        logging.info(f"Repetitive logging (every {settings.LOG_PERIOD}s)")
+        logging.info("|- CVL: %.1fV, CCL: %.0fA, DCL: %.0fA" % (MaxChargeVoltage, MaxChargeCurrent, MaxDischargeCurrent))
+        logging.info("|- Bat. voltage: %.1fV, Bat. current: %.0fA, SoC: %.1f%%, Balancing state: %d" % (Voltage, Current, Soc, self._balancing))
+        logging.info(
+            "|- Min. cell voltage: %s: %.3fV, Max. cell voltage: %s: %.3fV, difference: %.3fV"
+            % (
+                MinVoltageCellId,
+                MinCellVoltage,
+                MaxVoltageCellId,
+                MaxCellVoltage,
+                MaxCellVoltage - MinCellVoltage,
             )
-
-        return True
+        )
 
 
 # ################
@@ -1752,6 +2206,7 @@ def main():
     logging.info("|- NR_OF_CELLS_PER_BATTERY: %d" % settings.NR_OF_CELLS_PER_BATTERY)
     logging.info("|- UPDATE_INTERVAL_FIND_DEVICES: %d s" % settings.UPDATE_INTERVAL_FIND_DEVICES)
     logging.info("|- UPDATE_INTERVAL_DATA: %d s" % settings.UPDATE_INTERVAL_DATA)
+    logging.info("|- UPDATE_INTERVAL_MS: %d ms, ESS_INTERVAL_MS: %d ms" % (settings.UPDATE_INTERVAL_MS, settings.ESS_INTERVAL_MS))
 
     from dbus.mainloop.glib import DBusGMainLoop
 
@@ -1772,11 +2227,15 @@ def main():
 
     DBusGMainLoop(set_as_default=True)
 
-    DbusAggBatService()
+    service = DbusAggBatService()
 
     logging.info("Connected to DBus, and switching over to GLib.MainLoop()")
     mainloop = GLib.MainLoop()
+    # the handlers run in the main loop, not in between of an update
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        GLib.unix_signal_add(GLib.PRIORITY_HIGH, signum, service.shutdown, mainloop)
     mainloop.run()
+    logging.info("dbus-aggregate-batteries stopped")
 
 
 if __name__ == "__main__":
@@ -10,163 +10,205 @@ sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python"
 # optionally from victron
 # sys.path.insert(1, "/opt/victronenergy/dbus-systemcalc-py/ext/velib_python")
 
-from dbusmonitor import DbusMonitor  # noqa: E402
+from dbusmonitor import AsyncDbusMonitor, DbusMonitor  # noqa: E402
 from dbus.mainloop.glib import DBusGMainLoop  # noqa: E402
 
 # from gi.repository import GLib  # not accessed
+import settings  # noqa: E402
+
+DEVICE_PATHS = [
+    "/Connected",
+    "/ProductName",
+    "/CustomName",
+    "/Serial",
+    "/Mgmt/Connection",
+    "/DeviceInstance",
+]
+
+BATTERY_PATHS = DEVICE_PATHS + [
+    "/Dc/0/Voltage",
+    "/Dc/0/Current",
+    "/Dc/0/Power",
+    "/InstalledCapacity",
+    "/ConsumedAmphours",
+    "/Capacity",
+    "/Soc",
+    "/Dc/0/Temperature",
+    "/System/MaxCellTemperature",
+    "/System/MinCellTemperature",
+    "/System/MaxVoltageCellId",
+    "/System/MaxCellVoltage",
+    "/System/MinVoltageCellId",
+    "/System/MinCellVoltage",
+    "/System/NrOfCellsPerBattery",
+    "/System/NrOfModulesOnline",
+    "/System/NrOfModulesOffline",
+    "/System/NrOfModulesBlockingCharge",
+    "/System/NrOfModulesBlockingDischarge",
+    "/TimeToGo",
+    "/Alarms/LowVoltage",
+    "/Alarms/HighVoltage",
+    "/Alarms/LowCellVoltage",
+    "/Alarms/HighCellVoltage",
+    "/Alarms/LowSoc",
+    "/Alarms/HighChargeCurrent",
+    "/Alarms/HighDischargeCurrent",
+    "/Alarms/CellImbalance",
+    "/Alarms/InternalFailure_alarm",
+    "/Alarms/HighChargeTemperature",
+    "/Alarms/LowChargeTemperature",
+    "/Alarms/HighTemperature",
+    "/Alarms/LowTemperature",
+    "/Alarms/BmsCable",
+    "/Io/AllowToCharge",
+    "/Io/AllowToDischarge",
+    "/Io/AllowToBalance",
+    "/Voltages/Diff",
+    "/Voltages/Sum",
+    "/Info/MaxChargeCurrent",
+    "/Info/MaxDischargeCurrent",
+    "/Info/MaxChargeVoltage",
+    "/Info/ChargeMode",
+]
+
+DCLOAD_PATHS = DEVICE_PATHS + [
+    "/Dc/0/Voltage",
+    "/Dc/0/Current",
+    "/Dc/0/Power",
+    "/Dc/0/Temperature",
+    "/Alarms/HighVoltage",
+    "/Alarms/HighStarterVoltage",
+    "/Alarms/LowVoltage",
+    "/Alarms/LowStarterVoltage",
+    "/Alarms/HighTemperature",
+    "/Alarms/LowTemperature",
+]
+
+VEBUS_PATHS = [
+    "/Connected",
+    "/Dc/0/Current",
+    "/ProductName",
+]
+
+VEBUS_ESS_PATHS = [
+    "/Devices/0/Ac/In/P",
+    "/Devices/0/Ac/Out/P",
+    "/Devices/0/Ac/Inverter/P",
+    "/Hub4/L1/AcPowerSetpoint",
+    "/Hub4/DisableCharge",
+    "/Hub4/DisableFeedIn",
+]
+
+SOLARCHARGER_PATHS = [
+    "/Dc/0/Current",
+    "/ProductName",
+]
+
+SETTINGS_ESS_PATHS = [
+    "/Settings/CGwacs/Hub4Mode",
+    "/Settings/CGwacs/AcPowerSetPoint",
+    "/Settings/CGwacs/BatteryLife/MinimumSocLimit",
+    "/Settings/MyEss/Active",
+    "/Settings/MyEss/CorrectionI",
+    "/Settings/MyEss/MinSocLimit",
+    "/Settings/MyEss/SmoothFilter",
+    "/Settings/CGwacs/MaxDischargePower",
+]
+
+SYSTEM_ESS_PATHS = [
+    "/Ac/ConsumptionOnInput/L1/Power",
+    "/Ac/ConsumptionOnInput/L2/Power",
+    "/Ac/ConsumptionOnInput/L3/Power",
+    "/Ac/PvOnGrid/L1/Power",
+    "/Ac/PvOnGrid/L2/Power",
+    "/Ac/PvOnGrid/L3/Power",
+]
+
+GRID_PATHS = [
+    "/Ac/Power",
+    "/Ac/L1/Power",
+    "/Ac/L2/Power",
+    "/Ac/L3/Power",
+    "/ProductName",
+]
+
+
+def monitor_tree():
+    """
+    Build the services and paths to monitor from the settings.
+
+    The DbusMonitor allocates a MonitoredValue and handles the signals of every path in the tree for every
+    matching service, therefore only the paths read by the enabled features are included:
+    NR_OF_CELLS_PER_BATTERY cell voltages (no upper limit), the Victron devices, grid meter and ESS paths
+    only if the current is measured by the Victron devices, the SmartShunts on DC loads only if used.
+
+    :return: dictionary with service class as key and dictionary of paths as value
+    """
+    dummy = {"code": None, "whenToLog": "configChange", "accessLevel": None}
+
+    battery = list(BATTERY_PATHS)
+    battery += ["/Voltages/Cell%d" % (cellId + 1) for cellId in range(settings.NR_OF_CELLS_PER_BATTERY)]
+    # configurable paths to identify the batteries, usually already in the list
+    battery += [settings.BATTERY_PRODUCT_NAME_PATH, settings.BATTERY_INSTANCE_NAME_PATH, settings.SMARTSHUNT_INSTANCE_NAME_PATH]
+    tree = {"com.victronenergy.battery": battery}
+
+    if settings.USE_SMARTSHUNTS:
+        tree["com.victronenergy.dcload"] = DCLOAD_PATHS + [settings.SMARTSHUNT_INSTANCE_NAME_PATH]
+
+    # the feed-in is disabled while the dynamic CVL reduction is active
+    tree["com.victronenergy.settings"] = ["/Settings/CGwacs/OvervoltageFeedIn"]
+    # needed for TimeToGo of the own SoC calculation
+    tree["com.victronenergy.system"] = ["/SystemState/LowSoc", "/SystemState/BatteryLife"]
+
+    if settings.CURRENT_FROM_VICTRON:
+        tree["com.victronenergy.vebus"] = VEBUS_PATHS + VEBUS_ESS_PATHS
+        if settings.NR_OF_MPPTS > 0:
+            tree["com.victronenergy.solarcharger"] = SOLARCHARGER_PATHS
+        tree["com.victronenergy.settings"] += SETTINGS_ESS_PATHS
+        tree["com.victronenergy.system"] += SYSTEM_ESS_PATHS
+        tree["com.victronenergy.grid"] = GRID_PATHS
+
+    return {service: dict.fromkeys(paths, dummy) for service, paths in tree.items()}
 
 
 class DbusMon:
-    def __init__(self):
-        dummy = {"code": None, "whenToLog": "configChange", "accessLevel": None}
-        self.monitorlist = {
-            "com.victronenergy.battery": {
-                "/Connected": dummy,
-                "/ProductName": dummy,
-                "/CustomName": dummy,
-                "/Serial": dummy,
-                "/Mgmt/Connection": dummy,
-                "/DeviceInstance": dummy,
-                "/Dc/0/Voltage": dummy,
-                "/Dc/0/Current": dummy,
-                "/Dc/0/Power": dummy,
-                "/InstalledCapacity": dummy,
-                "/ConsumedAmphours": dummy,
-                "/Capacity": dummy,
-                "/Soc": dummy,
-                "/Dc/0/Temperature": dummy,
-                "/System/MaxCellTemperature": dummy,
-                "/System/MinCellTemperature": dummy,
-                "/System/MaxVoltageCellId": dummy,
-                "/System/MaxCellVoltage": dummy,
-                "/System/MinVoltageCellId": dummy,
-                "/System/MinCellVoltage": dummy,
-                "/System/NrOfCellsPerBattery": dummy,
-                "/System/NrOfModulesOnline": dummy,
-                "/System/NrOfModulesOffline": dummy,
-                "/System/NrOfModulesBlockingCharge": dummy,
-                "/System/NrOfModulesBlockingDischarge": dummy,
-                "/TimeToGo": dummy,
-                "/Alarms/LowVoltage": dummy,
-                "/Alarms/HighVoltage": dummy,
-                "/Alarms/LowCellVoltage": dummy,
-                "/Alarms/HighCellVoltage": dummy,
-                "/Alarms/LowSoc": dummy,
-                "/Alarms/HighChargeCurrent": dummy,
-                "/Alarms/HighDischargeCurrent": dummy,
-                "/Alarms/CellImbalance": dummy,
-                "/Alarms/InternalFailure_alarm": dummy,
-                "/Alarms/HighChargeTemperature": dummy,
-                "/Alarms/LowChargeTemperature": dummy,
-                "/Alarms/HighTemperature": dummy,
-                "/Alarms/LowTemperature": dummy,
-                "/Alarms/BmsCable": dummy,
-                "/Io/AllowToCharge": dummy,
-                "/Io/AllowToDischarge": dummy,
-                "/Io/AllowToBalance": dummy,
-                "/Voltages/Cell1": dummy,
-                "/Voltages/Cell2": dummy,
-                "/Voltages/Cell3": dummy,
-                "/Voltages/Cell4": dummy,
-                "/Voltages/Cell5": dummy,
-                "/Voltages/Cell6": dummy,
-                "/Voltages/Cell7": dummy,
-                "/Voltages/Cell8": dummy,
-                "/Voltages/Cell9": dummy,
-                "/Voltages/Cell10": dummy,
-                "/Voltages/Cell11": dummy,
-                "/Voltages/Cell12": dummy,
-                "/Voltages/Cell13": dummy,
-                "/Voltages/Cell14": dummy,
-                "/Voltages/Cell15": dummy,
-                "/Voltages/Cell16": dummy,
-                "/Voltages/Cell17": dummy,
-                "/Voltages/Cell18": dummy,
-                "/Voltages/Cell19": dummy,
-                "/Voltages/Cell20": dummy,
-                "/Voltages/Cell21": dummy,
-                "/Voltages/Cell22": dummy,
-                "/Voltages/Cell23": dummy,
-                "/Voltages/Cell24": dummy,
-                "/Voltages/Cell25": dummy,
-                "/Voltages/Cell26": dummy,
-                "/Voltages/Cell27": dummy,
-                "/Voltages/Cell28": dummy,
-                "/Voltages/Cell29": dummy,
-                "/Voltages/Cell30": dummy,
-                "/Voltages/Cell31": dummy,
-                "/Voltages/Cell32": dummy,
-                "/Voltages/Diff": dummy,
-                "/Voltages/Sum": dummy,
-                "/Info/MaxChargeCurrent": dummy,
-                "/Info/MaxDischargeCurrent": dummy,
-                "/Info/MaxChargeVoltage": dummy,
-                "/Info/ChargeMode": dummy,
-            },
-            "com.victronenergy.dcload": {
-                "/Connected": dummy,
-                "/ProductName": dummy,
-                "/CustomName": dummy,
-                "/Serial": dummy,
-                "/Mgmt/Connection": dummy,
-                "/DeviceInstance": dummy,
-                "/Dc/0/Voltage": dummy,
-                "/Dc/0/Current": dummy,
-                "/Dc/0/Power": dummy,
-                "/Dc/0/Temperature": dummy,
-                "/Alarms/HighVoltage": dummy,
-                "/Alarms/HighStarterVoltage": dummy,
-                "/Alarms/LowVoltage": dummy,
-                "/Alarms/LowStarterVoltage": dummy,
-                "/Alarms/HighTemperature": dummy,
-                "/Alarms/LowTemperature": dummy,
-            },
-            "com.victronenergy.vebus": {
-                "/Connected": dummy,
-                "/Dc/0/Current": dummy,
-                "/ProductName": dummy,
-                "/Devices/0/Ac/In/P": dummy,
-                "/Devices/0/Ac/Out/P": dummy, 
-                "/Devices/0/Ac/Inverter/P": dummy,
-                '/Hub4/L1/AcPowerSetpoint': dummy,
-                '/Hub4/DisableCharge': dummy,
-                '/Hub4/DisableFeedIn': dummy,
-            },
-            "com.victronenergy.solarcharger": {
-                "/Dc/0/Current": dummy,
-                "/ProductName": dummy,
-            },
-            "com.victronenergy.settings": {
-                "/Settings/CGwacs/OvervoltageFeedIn": dummy,
-                '/Settings/CGwacs/Hub4Mode': dummy,
-                '/Settings/CGwacs/AcPowerSetPoint': dummy,
-                '/Settings/CGwacs/BatteryLife/MinimumSocLimit': dummy,
-                '/Settings/MyEss/Active': dummy,
-                '/Settings/MyEss/CorrectionI': dummy,
-                '/Settings/MyEss/MinSocLimit': dummy,
-                '/Settings/MyEss/SmoothFilter': dummy,
-                '/Settings/CGwacs/MaxDischargePower': dummy,
-            },
-            "com.victronenergy.system": {
-                "/SystemState/LowSoc": dummy,
-                "/SystemState/BatteryLife": dummy,
-                '/Ac/ConsumptionOnInput/L1/Power': dummy,
-                '/Ac/ConsumptionOnInput/L2/Power': dummy,
-                '/Ac/ConsumptionOnInput/L3/Power': dummy,
-                '/Ac/PvOnGrid/L1/Power': dummy,
-                '/Ac/PvOnGrid/L2/Power': dummy,
-                '/Ac/PvOnGrid/L3/Power': dummy,
-            },
-            'com.victronenergy.grid': {
-                '/Ac/Power': dummy,
-                '/Ac/L1/Power': dummy,
-                '/Ac/L2/Power': dummy,
-                '/Ac/L3/Power': dummy,
-                '/ProductName': dummy,
-            },
-        }
-
-        self.dbusmon = DbusMonitor(self.monitorlist, ignoreServices=["com.victronenergy.battery.aggregate"])
+    def __init__(self, valueChangedCallback=None, deviceAddedCallback=None, deviceRemovedCallback=None, scanCompleteCallback=None, valueStoredCallback=None):
+        """
+        :param scanCompleteCallback: if set, the services are scanned asynchronously in the main loop
+            and scanCompleteCallback(dbusmonitor) is called when the scan is complete
+        :param valueStoredCallback: function(service, path) called as soon as a changed value is stored
+        """
+        self.monitorlist = monitor_tree()
+
+        kwargs = {}
+        if scanCompleteCallback is not None:
+            kwargs["scanCompleteCallback"] = scanCompleteCallback
+        self.dbusmon = (AsyncDbusMonitor if scanCompleteCallback is not None else DbusMonitor)(
+            self.monitorlist,
+            valueChangedCallback=valueChangedCallback,
+            deviceAddedCallback=deviceAddedCallback,
+            deviceRemovedCallback=deviceRemovedCallback,
+            ignoreServices=["com.victronenergy.battery.aggregate"],
+            senderScoped=settings.SENDER_SCOPED_SIGNALS,
+            valueStoredCallback=valueStoredCallback,
+            **kwargs,
+        )
+
+    def service_names(self):
+        """
+        :return: names of all monitored services found on the DBus
+        """
+        return list(self.dbusmon.servicesByName)
+
+    def read_plan(self, service, nr_of_cells=0):
+        """
+        Build a read plan for a monitored service.
+
+        :param service: DBus service name, e.g. com.victronenergy.battery.ttyUSB0
+        :param nr_of_cells: Number of /Voltages/Cell<ID> paths to resolve
+        :return: ServiceReadPlan
+        """
+        return ServiceReadPlan(self.dbusmon, service, nr_of_cells)
 
     def print_values(self, service, mon_list):
         for path in self.monitorlist[mon_list]:
@@ -175,6 +217,46 @@ class DbusMon:
         return True
 
 
+class ServiceReadPlan:
+    """
+    Pre-resolved MonitoredValue objects of one service monitored by the DbusMonitor.
+
+    DbusMonitor.get_value() looks up the service and then the path on every call. The read plan
+    resolves the service once and keeps a direct reference to its table of MonitoredValue objects,
+    so reading a value is one dictionary lookup and an attribute access. The cell voltages are
+    additionally resolved into a tuple in cell order.
+
+    The DbusMonitor creates new MonitoredValue objects if a service is removed or re-scanned,
+    therefore refresh() has to be called before reading from the plan.
+    """
+
+    def __init__(self, dbusmon, service, nr_of_cells=0):
+        self._dbusmon = dbusmon
+        self.service = service
+        self.nr_of_cells = nr_of_cells
+        self._resolve()
+
+    def _resolve(self):
+        # raises KeyError if the service is not (or not anymore) on the DBus
+        self._service = self._dbusmon.servicesByName[self.service]
+        self.values = self._service.paths
+        self.cells = tuple(self.values["/Voltages/Cell%d" % (cellId + 1)] for cellId in range(self.nr_of_cells))
+
+    def refresh(self):
+        """
+        Re-resolve the plan if the service was removed or re-scanned by the DbusMonitor.
+
+        :return: True if the plan was re-resolved
+        """
+        if self._dbusmon.servicesByName.get(self.service) is self._service:
+            return False
+        self._resolve()
+        return True
+
+    def get_value(self, path):
+        return self.values[path].value
+
+
 ################
 # test program #
 ################
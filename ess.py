@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+"""
+ESS control: AC power setpoint of the MultiPlus/Quattro calculated from the aggregated battery values,
+the MPPTs and the grid meter.
+"""
+
+import logging
+from time import monotonic
+
+# pauses longer than this are not integrated, e.g. while the grid meter was silent
+MAX_INTEGRATION_STEP = 5
+# time in s of one step of the SmoothFilter setting (the update interval it was tuned for), the smoothing
+# uses the measured time between two controls, so it does not depend on how often the control runs
+SMOOTH_FILTER_STEP = 0.25
+
+
+class PiController:
+    """
+    PI controller with anti-windup.
+
+    The output and the integral are limited to +-limit. The integral is only advanced by integrate(), which is called
+    for the controller whose setpoint was selected, and not further into the saturation, so it does not wind up
+    while its output has no effect.
+    """
+
+    def __init__(self, kp, ki, limit):
+        """
+        :param kp: proportional gain
+        :param ki: integral gain in 1/s
+        :param limit: max. absolute value of the output
+        """
+        self.kp = kp
+        self.ki = ki
+        self.limit = limit
+        self.integral = 0.0
+
+    def _clamp(self, value):
+        return max(-self.limit, min(self.limit, value))
+
+    def output(self, error):
+        """
+        :return: correction for the error, without changing the integral
+        """
+        return self._clamp(self.kp * error + self.integral)
+
+    def integrate(self, error, dt):
+        """
+        :param dt: time since the last integration in s
+        """
+        integral = self.integral + self.ki * error * dt
+        proportional = self.kp * error
+        # conditional integration: into the saturation only as far as the limit
+        if abs(proportional + integral) <= self.limit or abs(proportional + integral) < abs(proportional + self.integral):
+            self.integral = self._clamp(integral)
+
+    def reset(self):
+        self.integral = 0.0
+
+
+class EssController:
+    """
+    Calculates the AC power setpoint of the MultiPlus/Quattro and writes it in the ESS modes (/Settings/MyEss/Active):
+    0: normal control by the Victron ESS, 1: charge the battery with max. charge power from grid and MPPTs,
+    2: keep the grid setpoint with PvOnGrid and battery, 3: min. of 1 and 2, 4: min. of 1 and keeping the grid
+    setpoint while charging with PvOnGrid and MPPTs (winter), 5: min. of charging with the MPPTs only and
+    keeping the grid setpoint (summer).
+
+    Each setpoint is a feed-forward of the measured powers, corrected by one of two PI controllers:
+    the battery controller holds the battery power at the charge power the mode aims at, the grid controller
+    holds the grid power at the grid setpoint. The modes combining two setpoints by min()/max() only integrate
+    the controller of the selected setpoint.
+
+    The control runs on every change of the grid power or the AC out power, if track() was called, and
+    in addition periodically by the scheduler.
+    """
+
+    def __init__(self, dbusmonitor, writeQueue, nrOfCells, kp, ki, limit, clock=monotonic):
+        """
+        :param dbusmonitor: DbusMonitor of the MultiPlus/Quattro, MPPTs, grid meter and settings
+        :param writeQueue: WriteQueue for the AC power setpoint
+        :param nrOfCells: number of cells per battery
+        :param kp: proportional gain of the PI controllers
+        :param ki: integral gain of the PI controllers in 1/s
+        :param limit: max. correction of the PI controllers in W
+        :param clock: function returning the time in s
+        """
+        self._dbusmonitor = dbusmonitor
+        self._writeQueue = writeQueue
+        self._nrOfCells = nrOfCells
+        self._clock = clock
+        self.multi = None
+        self.grid = None
+        # settings, loaded from com.victronenergy.settings
+        self.active = 0
+        self.minSocLimit = 0
+        self.smoothFilter = 250
+        self.batteryPi = PiController(kp, ki, limit)
+        self.gridPi = PiController(kp, ki, limit)
+        self.maxChargeCurrentSm = 0
+        self._lastControl = None
+        # callback of the grid and AC out watches, None if the control is not triggered by them
+        self._trackCallback = None
+        # AcPowerSetpoint, GridPower, AcLoad and PvOnGrid of the last control, recorded in the history
+        self.values = (None, None, None, None)
+
+    def track(self, callback):
+        """
+        Watch the grid power and the AC out power. The DbusMonitor drops the watches of a service leaving
+        the DBus, track_service adds them again when it is back.
+
+        :param callback: function(changes) called on every change of the grid power and the AC out power
+        """
+        self._trackCallback = callback
+        self.track_service(self.grid)
+        self.track_service(self.multi)
+
+    def track_service(self, service):
+        """
+        Add the watch of the grid meter or the MultiPlus/Quattro, if tracked. Other services are ignored.
+
+        :param service: DBus service name
+        """
+        if self._trackCallback is None:
+            return
+        if service == self.grid:
+            self._dbusmonitor.track_value(service, "/Ac/Power", self._trackCallback)
+        elif service == self.multi:
+            self._dbusmonitor.track_value(service, "/Devices/0/Ac/Out/P", self._trackCallback)
+
+    def _smooth(self, maxChargeCurrent, dt):
+        # rises with the time constant of SmoothFilter steps of SMOOTH_FILTER_STEP, falls immediately
+        if maxChargeCurrent > self.maxChargeCurrentSm:
+            keep = (self.smoothFilter / (self.smoothFilter + 1)) ** (dt / SMOOTH_FILTER_STEP)
+            self.maxChargeCurrentSm = keep * self.maxChargeCurrentSm + (1 - keep) * maxChargeCurrent
+        else:
+            self.maxChargeCurrentSm = maxChargeCurrent
+
+    def control(self, aggregated, bus):
+        """
+        :param aggregated: dictionary with the aggregated values of the last update
+        :param bus: VeDbusService, its context or the PublishPlan for the /Ess paths
+        """
+        # nothing to control without MultiPlus/Quattro and grid meter
+        if self.multi is None or self.grid is None:
+            return
+        now = self._clock()
+        dt = 0 if self._lastControl is None else min(now - self._lastControl, MAX_INTEGRATION_STEP)
+        self._lastControl = now
+        get_value = self._dbusmonitor.get_value
+
+        Voltage = aggregated["Voltage"]
+        Current = aggregated["Current"]
+        Power = aggregated["Power"]
+        Soc = aggregated["Soc"]
+        MpptCurrent = aggregated["MpptCurrent"]
+        MpptPower = aggregated["MpptPower"]
+        MaxChargeVoltage = aggregated["MaxChargeVoltage"]
+        MaxChargeCurrent = aggregated["MaxChargeCurrent"]
+
+        AcInPower = get_value(self.multi, "/Devices/0/Ac/In/P")
+        AcInCurrent = AcInPower / 230 if AcInPower is not None else 0
+
+        AcOutPower = get_value(self.multi, "/Devices/0/Ac/Out/P")
+        AcOutCurrent = AcOutPower / 230 if AcOutPower is not None else 0
+
+        InverterPower = get_value(self.multi, "/Devices/0/Ac/Inverter/P")
+        InverterCurrent = InverterPower / Voltage if InverterPower is not None else 0
+
+        GridSetpoint = get_value("com.victronenergy.settings", "/Settings/CGwacs/AcPowerSetPoint")
+        MinimumSocLimit = self.minSocLimit
+
+        GridPower = get_value(self.grid, "/Ac/Power")
+        GridL1 = get_value(self.grid, "/Ac/L1/Power")
+        GridL2 = get_value(self.grid, "/Ac/L2/Power")
+        GridL3 = get_value(self.grid, "/Ac/L3/Power")
+
+        ConsumptionInputL1 = get_value("com.victronenergy.system", "/Ac/ConsumptionOnInput/L1/Power")
+        ConsumptionInputL2 = get_value("com.victronenergy.system", "/Ac/ConsumptionOnInput/L2/Power")
+        ConsumptionInputL3 = get_value("com.victronenergy.system", "/Ac/ConsumptionOnInput/L3/Power")
+        ConsumptionInput = ConsumptionInputL1 + ConsumptionInputL2 + ConsumptionInputL3
+
+        PvOnGridL1 = get_value("com.victronenergy.system", "/Ac/PvOnGrid/L1/Power")
+        PvOnGridL2 = get_value("com.victronenergy.system", "/Ac/PvOnGrid/L2/Power")
+        PvOnGridL3 = get_value("com.victronenergy.system", "/Ac/PvOnGrid/L3/Power")
+        PvOnGrid = PvOnGridL1 + PvOnGridL2 + PvOnGridL3
+
+        AcLoadL1 = GridL1 + PvOnGridL1 - AcInPower
+        AcLoadL2 = GridL2 + PvOnGridL2
+        AcLoadL3 = GridL3 + PvOnGridL3
+        AcLoad = AcLoadL1 + AcLoadL2 + AcLoadL3
+
+        BatteryPower = Power
+        BatteryCurrent = Current
+        BatteryCurrentCalc = MpptCurrent + InverterCurrent
+        MaxChargePower = MaxChargeCurrent * Voltage
+        MaxChrgCellVoltage = MaxChargeVoltage / self._nrOfCells
+        self._smooth(MaxChargeCurrent, dt)
+        MaxChargePowerSmooth = self.maxChargeCurrentSm * Voltage
+
+        ###############################################################################
+        # ESS magic
+        #
+        # Calculation of AcPowerSetpoint
+        # positive AcPowerSetpoint means MP2 is consuming power from the AC input side
+        # negative AcPowerSetpoint means MP2 is sourcing power to the AC input side
+        ###############################################################################
+
+        # battery charge power aimed at: max. charge power, in mode 5 with the MPPTs only
+        if self.active == 5:
+            BatteryTarget = min(MpptPower, MaxChargePowerSmooth)
+        else:
+            BatteryTarget = MaxChargePowerSmooth
+        BatteryError = BatteryTarget - BatteryPower
+        GridError = GridSetpoint - GridPower
+        # replace the open-loop correction by the measured losses
+        CorrectionPower = self.batteryPi.output(BatteryError)
+        GridCorrectionPower = self.gridPi.output(GridError)
+
+        # APSp1: compensate AC out power and charge battery with grid and MPPTs using maximum charge power
+        APSp1 = AcOutPower + (MaxChargePowerSmooth - MpptPower) + CorrectionPower
+
+        # APSp2: maintain gridsetpoint using PvOnGrid and battery (?)
+        APSp2 = GridSetpoint + PvOnGrid - ConsumptionInput + GridCorrectionPower
+
+        # APSp4: maintain gridsepoint and charge battery using PvOnGrid and MPPTs
+        APSp4 = GridSetpoint + PvOnGrid - AcLoad + GridCorrectionPower
+
+        # APSp5: maintain gridsepoint and charge battery using MPPTs only
+        APSp5 = AcOutPower - MpptPower + BatteryTarget + CorrectionPower
+
+        # APSp_noDischarge: prohibit battery discharge
+        APSp_noDischarge = AcOutPower
+
+        if Soc < MinimumSocLimit:
+            SocOffset = 5
+        else:
+            SocOffset = 0
+
+        if self.active > 0:
+            # setpoint and the controller correcting it
+            battery = (APSp1, self.batteryPi, BatteryError)
+            grid = (APSp2, self.gridPi, GridError)
+            if self.active == 1:
+                selected = battery
+            elif self.active == 2:
+                selected = grid
+            elif self.active == 3:
+                selected = min(battery, grid, key=lambda candidate: candidate[0])
+            elif self.active == 4:  # winter?!
+                selected = min(battery, (APSp4, self.gridPi, GridError), key=lambda candidate: candidate[0])
+            elif self.active == 5:  # summer
+                selected = min((APSp5, self.batteryPi, BatteryError), (APSp4, self.gridPi, GridError), key=lambda candidate: candidate[0])
+            if self.active >= 4 and Soc < (MinimumSocLimit + SocOffset) and APSp_noDischarge > selected[0]:
+                selected = (APSp_noDischarge, None, 0)
+            AcPowerSetpoint, controller, error = selected
+
+            # anti-windup: only the controller of the selected setpoint integrates
+            if controller is not None:
+                controller.integrate(error, dt)
+            self._writeQueue.set_value(self.multi, "/Hub4/L1/AcPowerSetpoint", AcPowerSetpoint)
+        else:
+            AcPowerSetpoint = get_value(self.multi, "/Hub4/L1/AcPowerSetpoint")
+            self.batteryPi.reset()
+            self.gridPi.reset()
+
+        self.values = (AcPowerSetpoint, GridPower, AcLoad, PvOnGrid)
+
+        # ess stuff ##########################################################
+        bus["/Ess/BatteryP"] = round(BatteryPower, 0)
+        bus["/Ess/BatteryI"] = round(BatteryCurrent, 0)
+        bus["/Ess/BatteryCalcI"] = round(BatteryCurrentCalc, 2)
+        bus["/Ess/MpptP"] = round(MpptPower, 0)
+        bus["/Ess/MpptI"] = round(MpptCurrent, 2)
+        bus["/Ess/AcInP"] = round(AcInPower, 0) if AcInPower is not None else 0
+        bus["/Ess/AcInI"] = round(AcInCurrent, 2)
+        bus["/Ess/AcOutP"] = round(AcOutPower, 0) if AcOutPower is not None else 0
+        bus["/Ess/AcOutI"] = round(AcOutCurrent, 2)
+        bus["/Ess/InverterP"] = round(InverterPower, 0) if InverterPower is not None else 0
+        bus["/Ess/InverterI"] = round(InverterCurrent, 2)
+        bus["/Ess/MaxChargeP"] = round(MaxChargePower, 0)
+        bus["/Ess/MaxChargeI"] = round(MaxChargeCurrent, 2)
+        bus["/Ess/MaxChargeIsm"] = round(self.maxChargeCurrentSm, 2)
+        bus["/Ess/GridSetpoint"] = round(GridSetpoint, 0) if GridSetpoint is not None else -1
+        bus["/Ess/GridP"] = round(GridPower, 0)
+        bus["/Ess/AcPowerSetpoint"] = round(AcPowerSetpoint, 0) if AcPowerSetpoint is not None else -1
+        bus["/Ess/MaxChrgCellVoltage"] = round(MaxChrgCellVoltage, 3)
+        bus["/Ess/ConsumptionInputL1"] = round(ConsumptionInputL1, 1) if ConsumptionInputL1 is not None else -1
+        bus["/Ess/ConsumptionInputL2"] = round(ConsumptionInputL2, 1) if ConsumptionInputL2 is not None else -1
+        bus["/Ess/ConsumptionInputL3"] = round(ConsumptionInputL3, 1) if ConsumptionInputL3 is not None else -1
+        bus["/Ess/ConsumptionInput"] = round(ConsumptionInput, 1)
+        bus["/Ess/PvOnGridL1"] = round(PvOnGridL1, 1) if PvOnGridL1 is not None else -1
+        bus["/Ess/PvOnGridL2"] = round(PvOnGridL2, 1) if PvOnGridL2 is not None else -1
+        bus["/Ess/PvOnGridL3"] = round(PvOnGridL3, 1) if PvOnGridL3 is not None else -1
+        bus["/Ess/PvOnGrid"] = round(PvOnGrid, 1)
+        bus["/Ess/AcLoadL1"] = round(AcLoadL1, 1) if AcLoadL1 is not None else -1
+        bus["/Ess/AcLoadL2"] = round(AcLoadL2, 1) if AcLoadL2 is not None else -1
+        bus["/Ess/AcLoadL3"] = round(AcLoadL3, 1) if AcLoadL3 is not None else -1
+        bus["/Ess/AcLoad"] = round(AcLoad, 1)
+        bus["/Ess/CorrectionI"] = round(CorrectionPower / Voltage, 3)
+        bus["/Ess/GridCorrectionP"] = round(GridCorrectionPower, 0)
+        bus["/Ess/MinimumSocLimit"] = self.minSocLimit
+        bus["/Ess/Active"] = self.active
+        bus["/Ess/SmoothFilter"] = self.smoothFilter
+        # ess stuff ##########################################################
+
+        logging.debug("ESS: setpoint %s W, battery error %.0f W, grid error %.0f W" % (AcPowerSetpoint, BatteryError, GridError))
@@ -103,15 +103,25 @@ class DbusMonitor(object):
 	## Constructor
 	def __init__(self, dbusTree, valueChangedCallback=None,
 			deviceAddedCallback=None, deviceRemovedCallback=None,
-			namespace="com.victronenergy", ignoreServices=[]):
+			namespace="com.victronenergy", ignoreServices=[], senderScoped=False,
+			valueStoredCallback=None):
 		# valueChangedCallback is the callback that we call when something has changed.
 		# def value_changed_on_dbus(dbusServiceName, dbusPath, options, changes, deviceInstance):
 		# in which changes is a tuple with GetText() and GetValue()
+		# senderScoped: subscribe to the signals of the wanted services only, instead of
+		# receiving (and unmarshalling) the signals of all services on the bus.
+		# valueStoredCallback(dbusServiceName, dbusPath) is called right after a changed value
+		# is stored, not deferred to the mainloop like valueChangedCallback. Keep it cheap.
 		self.valueChangedCallback = valueChangedCallback
+		self.valueStoredCallback = valueStoredCallback
 		self.deviceAddedCallback = deviceAddedCallback
 		self.deviceRemovedCallback = deviceRemovedCallback
 		self.dbusTree = dbusTree
 		self.ignoreServices = ignoreServices
+		self.senderScoped = senderScoped
+
+		# Signal matches per service name, if senderScoped
+		self._senderMatches = {}
 
 		# Lists all tracked services. Stores name, id, device instance, value per path, and whenToLog info
 		# indexed by service name (eg. com.victronenergy.settings).
@@ -137,17 +147,18 @@ class DbusMonitor(object):
 
 		add_name_owner_changed_receiver(standardBus, self.dbus_name_owner_changed)
 
-		# Subscribe to PropertiesChanged for all services
-		self.dbusConn.add_signal_receiver(self.handler_value_changes,
-			dbus_interface='com.victronenergy.BusItem',
-			signal_name='PropertiesChanged', path_keyword='path',
-			sender_keyword='senderId')
+		if not self.senderScoped:
+			# Subscribe to PropertiesChanged for all services
+			self.dbusConn.add_signal_receiver(self.handler_value_changes,
+				dbus_interface='com.victronenergy.BusItem',
+				signal_name='PropertiesChanged', path_keyword='path',
+				sender_keyword='senderId')
 
-		# Subscribe to ItemsChanged for all services
-		self.dbusConn.add_signal_receiver(self.handler_item_changes,
-			dbus_interface='com.victronenergy.BusItem',
-			signal_name='ItemsChanged', path='/',
-			sender_keyword='senderId')
+			# Subscribe to ItemsChanged for all services
+			self.dbusConn.add_signal_receiver(self.handler_item_changes,
+				dbus_interface='com.victronenergy.BusItem',
+				signal_name='ItemsChanged', path='/',
+				sender_keyword='senderId')
 
 		logger.info('===== Scanning dbus... =====')
 		self._scan_dbus()
@@ -168,6 +179,29 @@ class DbusMonitor(object):
 		""" Override this to do more things with monitoring. """
 		return MonitoredValue(unwrap_dbus_value(value), unwrap_dbus_value(text), options)
 
+	def add_sender_matches(self, serviceName):
+		""" Subscribe to PropertiesChanged and ItemsChanged of one service, if
+		    senderScoped. Called before the service is scanned, so no change is
+		    lost between the scan and the subscription. The bus daemon resolves
+		    the well-known name to the current owner. """
+		if not self.senderScoped or serviceName in self._senderMatches:
+			return
+
+		self._senderMatches[serviceName] = (
+			self.dbusConn.add_signal_receiver(self.handler_value_changes,
+				dbus_interface='com.victronenergy.BusItem',
+				signal_name='PropertiesChanged', path_keyword='path',
+				sender_keyword='senderId', bus_name=serviceName),
+			self.dbusConn.add_signal_receiver(self.handler_item_changes,
+				dbus_interface='com.victronenergy.BusItem',
+				signal_name='ItemsChanged', path='/',
+				sender_keyword='senderId', bus_name=serviceName),
+		)
+
+	def remove_sender_matches(self, serviceName):
+		for match in self._senderMatches.pop(serviceName, ()):
+			match.remove()
+
 	def dbus_name_owner_changed(self, name, oldowner, newowner):
 		if not self.service_wanted(name):
 			return
@@ -184,8 +218,10 @@ class DbusMonitor(object):
 		if newowner != '':
 			# so we found some new service. Check if we can do something with it.
 			self._process_newowner(name)
+			return
 
-		elif name in self.servicesByName:
+		self.remove_sender_matches(name)
+		if name in self.servicesByName:
 			# it disappeared, we need to remove it.
 			logger.info("%s disappeared from the dbus. Removing it from our lists" % name)
 			service = self.servicesByName[name]
@@ -210,13 +246,16 @@ class DbusMonitor(object):
 	def scan_dbus_service(self, serviceName):
 		# make it a normal string instead of dbus string
 		serviceName = str(serviceName)
+		self.add_sender_matches(serviceName)
 		try:
-			return self.scan_dbus_service_inner(serviceName)
+			if self.scan_dbus_service_inner(serviceName):
+				return True
 		except:
 			logger.error("Ignoring %s because of error while scanning:" % (serviceName))
 			import traceback
 			traceback.print_exc()
-			return False
+		self.remove_sender_matches(serviceName)
+		return False
 
 			# Errors 'org.freedesktop.DBus.Error.ServiceUnknown' and
 			# 'org.freedesktop.DBus.Error.Disconnected' seem to happen when the service
@@ -401,6 +440,9 @@ class DbusMonitor(object):
 		a.value = value
 		a.text = text
 
+		if self.valueStoredCallback is not None:
+			self.valueStoredCallback(service.name, path)
+
 		# And do the rest of the processing in on the mainloop
 		if self.valueChangedCallback is not None:
 			GLib.idle_add(exit_on_error, self._execute_value_changes, service.name, path, {
@@ -564,8 +606,9 @@ class AsyncDbusMonitor(DbusMonitor):
 		# Do a legacy scan on services that could not be scanned with GetItems
 		for name in errors:
 			logging.info(f"Doing legacy scan on {name}")
-			if self.scan_dbus_service_legacy(name) and \
-						  self.deviceAddedCallback is not None:
+			if not self.scan_dbus_service_legacy(name):
+				self.remove_sender_matches(name)
+			elif self.deviceAddedCallback is not None:
 				self.deviceAddedCallback(name, self.get_device_instance(name))
 
 		if startup:
@@ -577,13 +620,16 @@ class AsyncDbusMonitor(DbusMonitor):
 	def scan_dbus_services_async(self, services=None, callback=None):
 		progress = ScanProgress(callback)
 		for serviceName in services if services else self.wanted_service_names():
+			serviceName = str(serviceName)
+			self.add_sender_matches(serviceName)
 			# Start by getting nameowner
 			progress.add(serviceName)
 			self.get_name_owner_async(progress, serviceName)
 
-	def scan_async_error(error, progress, serviceName, exc):
+	def scan_async_error(self, progress, serviceName, exc):
 		logger.error("Ignoring %s because of error while scanning:" % (serviceName))
 		logger.error(str(exc))
+		self.remove_sender_matches(serviceName)
 		# if GetNameOwner fails, there is no point in adding it to error list.
 		# So simply complete() it.
 		progress.complete(serviceName)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from dbus.mainloop.glib import DBusGMainLoop
+import dbus
+import sys
+import os
+
+# our own packages
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../'))
+from gi.repository import GLib
+from vedbus import VeDbusService
+
+# Exports a VeDbusService for test_vedbus.py, in virtual mode if started with the argument 'virtual'.
+# Writing to /Control changes the service locally, so the test cases can check how local changes show
+# up on the dbus:
+#	'change'	sets /Int to 20
+#	'delete'	deletes /Deletable
+#	'add'		adds /Added with value 7
+
+service = None
+textcalls = 0
+
+# the text shows how often it was calculated, to check the caching of the lazy text
+def countedtext(path, value):
+	global textcalls
+	textcalls += 1
+	return '%s #%d' % (value, textcalls)
+
+def changerequest(path, newvalue):
+	return newvalue < 100
+
+def control(path, action):
+	if action == 'change':
+		service['/Int'] = 20
+	elif action == 'delete':
+		del service['/Deletable']
+	elif action == 'add':
+		service.add_path('/Added', 7)
+	else:
+		return False
+	return True
+
+def main(argv):
+		global service
+
+		# Have a mainloop, so we can send/receive asynchronous calls to and from dbus
+		DBusGMainLoop(set_as_default=True)
+
+		# Connect to session bus whenever present, else use the system bus
+		dbusConn = dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus()
+
+		service = VeDbusService('com.victronenergy.vedbusservicetest', dbusConn, register=False, virtual='virtual' in argv)
+		service.add_path('/Int', 10, writeable=True)
+		service.add_path('/Group/Float', 1.5, gettextcallback=lambda p, v: '%.2f V' % v)
+		service.add_path('/Group/String', 'a string')
+		service.add_path('/NotWriteable', 'original')
+		service.add_path('/WriteableUpTo100', 50, writeable=True, onchangecallback=changerequest)
+		service.add_path('/Deletable', 5)
+		service.add_path('/LazyText', 1, writeable=True, gettextcallback=countedtext, lazytext=True)
+		service.add_path('/Control', '', writeable=True, onchangecallback=control)
+		service.register()
+
+		mainloop = GLib.MainLoop()
+		print("up and running")
+		sys.stdout.flush()
+
+		mainloop.run()
+
+main(sys.argv[1:])
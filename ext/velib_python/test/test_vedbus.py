@@ -16,6 +16,7 @@ from dbus.mainloop.glib import DBusGMainLoop
 # Local
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../'))
 from vedbus import VeDbusService, VeDbusItemImport
+from mock_dbus_service import MockDbusService
 
 logger = logging.getLogger(__file__)
 """
@@ -162,6 +163,115 @@ class VeDbusItemExportTests(unittest.TestCase):
 
 		thread.join()
 
+class VeDbusServiceTests(unittest.TestCase):
+	# VeDbusService is tested against the service exported by fixture_vedbusservice.py, which is ran as a
+	# subprocess. Local changes of the service are triggered by writing to /Control, see the fixture.
+	servicename = 'com.victronenergy.vedbusservicetest'
+	fixture_args = []
+
+	def setUp(self):
+		self.sp = subprocess.Popen([sys.executable, "fixture_vedbusservice.py"] + self.fixture_args, stdout=subprocess.PIPE)
+		self.dbusConn = dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus()
+
+		while (self.sp.stdout.readline().rstrip() != b'up and running'):
+			pass
+
+	def tearDown(self):
+		self.sp.kill()
+		self.sp.wait()
+		self.sp.stdout.close()
+
+	def object(self, path):
+		return self.dbusConn.get_object(self.servicename, path, introspect=False)
+
+	def control(self, action):
+		self.assertEqual(0, self.object('/Control').SetValue(action))
+
+	def test_get_value_leaf(self):
+		v = self.object('/Int').GetValue()
+		self.assertEqual(10, v)
+		self.assertIs(type(v), dbus.Int32)
+		self.assertEqual('10', self.object('/Int').GetText())
+		self.assertEqual('1.50 V', self.object('/Group/Float').GetText())
+
+	def test_get_value_node(self):
+		self.assertEqual({'Float': 1.5, 'String': 'a string'}, self.object('/Group').GetValue())
+		self.assertEqual({'Float': '1.50 V', 'String': 'a string'}, self.object('/Group').GetText())
+
+	def test_get_value_root(self):
+		v = self.object('/').GetValue()
+		self.assertEqual(10, v['Int'])
+		self.assertEqual(1.5, v['Group/Float'])
+		self.assertEqual('1.50 V', self.object('/').GetText()['Group/Float'])
+
+	def test_set_value(self):
+		self.assertEqual(0, self.object('/Int').SetValue(12))
+		self.assertEqual(12, self.object('/Int').GetValue())
+
+		self.assertNotEqual(0, self.object('/NotWriteable').SetValue(12))
+		self.assertEqual('original', self.object('/NotWriteable').GetValue())
+
+		self.assertNotEqual(0, self.object('/WriteableUpTo100').SetValue(102))
+		self.assertEqual(50, self.object('/WriteableUpTo100').GetValue())
+
+	def test_get_items(self):
+		items = self.object('/').GetItems()
+		self.assertEqual({'Value': 10, 'Text': '10'}, items['/Int'])
+		self.assertEqual({'Value': 1.5, 'Text': '1.50 V'}, items['/Group/Float'])
+		self.assertEqual({'Value': 5, 'Text': '5'}, items['/Deletable'])
+
+	def test_get_items_after_change(self):
+		self.object('/').GetItems()
+		self.assertEqual(0, self.object('/Int').SetValue(12))
+		self.assertEqual({'Value': 12, 'Text': '12'}, self.object('/').GetItems()['/Int'])
+		self.control('change')
+		self.assertEqual({'Value': 20, 'Text': '20'}, self.object('/').GetItems()['/Int'])
+
+	def test_get_items_after_add_and_delete(self):
+		self.object('/').GetItems()
+		self.control('add')
+		self.assertEqual({'Value': 7, 'Text': '7'}, self.object('/').GetItems()['/Added'])
+		self.control('delete')
+		self.assertNotIn('/Deletable', self.object('/').GetItems())
+
+	def test_lazy_text(self):
+		# calculated on the first request and then cached until the value changes
+		self.assertEqual('1 #1', self.object('/LazyText').GetText())
+		self.assertEqual('1 #1', self.object('/LazyText').GetText())
+		self.assertEqual('1 #1', self.object('/').GetItems()['/LazyText']['Text'])
+		self.assertEqual(0, self.object('/LazyText').SetValue(2))
+		self.assertEqual({'Value': 2, 'Text': '2 #2'}, self.object('/').GetItems()['/LazyText'])
+		self.assertEqual('2 #2', self.object('/LazyText').GetText())
+
+	def test_unknown_path(self):
+		for path in ('/Missing', '/Group/Missing', '/Deletable'):
+			if path == '/Deletable':
+				self.control('delete')
+			with self.assertRaises(dbus.exceptions.DBusException) as cm:
+				self.object(path).GetValue()
+			self.assertEqual('org.freedesktop.DBus.Error.UnknownObject', cm.exception.get_dbus_name())
+			with self.assertRaises(dbus.exceptions.DBusException):
+				self.object(path).SetValue(1)
+
+class VeDbusServiceVirtualTests(VeDbusServiceTests):
+	# same tests with all paths handled by the fallback object on /
+	fixture_args = ['virtual']
+
+	def test_get_text_signature(self):
+		# a string for a value and a variant with the texts for a node, like the objects of the normal mode
+		self.assertIs(type(self.object('/Group/String').GetText()), dbus.String)
+		self.assertIs(type(self.object('/Group').GetText()), dbus.Dictionary)
+
+class MockDbusServiceTests(unittest.TestCase):
+	def test_add_path_lazytext(self):
+		# MockDbusService accepts the arguments of VeDbusService.add_path, the Text is not simulated
+		service = MockDbusService('com.victronenergy.mocktest')
+		service.add_path('/Lazy', 1, gettextcallback=lambda p, v: '%d V' % v, lazytext=True)
+		service.add_path('/NotLazy', 2, lazytext=False)
+		service['/Lazy'] = 3
+		self.assertEqual(3, service['/Lazy'])
+		self.assertEqual(2, service['/NotLazy'])
+
 """
 MVA 2014-08-30: this test of VEDbusItemImport doesn't work, since there is no gobject-mainloop.
 Probably making some automated functional test, using bash and some scripts, will work much
@@ -200,6 +200,8 @@ def read_file(path):
 	return content
 
 
+# The isinstance chain is kept for wrapping: the common float and int values are found by the
+# first checks, a lookup in a dispatch table plus an extra call is slower.
 def wrap_dbus_value(value):
 	if value is None:
 		return VEDBUS_INVALID
@@ -234,9 +236,9 @@ def wrap_dbus_value(value):
 dbus_int_types = (dbus.Int32, dbus.UInt32, dbus.Byte, dbus.Int16, dbus.UInt16, dbus.UInt32, dbus.Int64, dbus.UInt64)
 
 
-def unwrap_dbus_value(val):
-	"""Converts D-Bus values back to the original type. For example if val is of type DBus.Double,
-	a float will be returned."""
+def _unwrap_dbus_value_isinstance(val):
+	"""Reference implementation of unwrap_dbus_value, used for all types without an entry in
+	the dispatch table."""
 	if isinstance(val, dbus_int_types):
 		return int(val)
 	if isinstance(val, dbus.Double):
@@ -260,6 +262,51 @@ def unwrap_dbus_value(val):
 		return bool(val)
 	return val
 
+
+def _unwrap_array(val):
+	v = [unwrap_dbus_value(x) for x in val]
+	return None if len(v) == 0 else v
+
+
+def _unwrap_dict(val):
+	# Do not unwrap the keys, see comment in wrap_dbus_value
+	return {x: unwrap_dbus_value(y) for x, y in val.items()}
+
+
+def _unwrap_identity(val):
+	return val
+
+
+# Converter per exact type of the D-Bus value. Looking up the type is one dictionary access, while
+# the isinstance chain tests up to ten types. The plain Python types are returned unchanged, like
+# the isinstance chain does.
+_unwrap_dispatch = dict.fromkeys(dbus_int_types, int)
+_unwrap_dispatch.update({
+	dbus.Double: float,
+	dbus.Array: _unwrap_array,
+	dbus.Signature: str,
+	dbus.String: str,
+	list: lambda val: [unwrap_dbus_value(x) for x in val],
+	tuple: lambda val: [unwrap_dbus_value(x) for x in val],
+	dbus.Dictionary: _unwrap_dict,
+	dict: _unwrap_dict,
+	dbus.Boolean: bool,
+	type(None): _unwrap_identity,
+	int: _unwrap_identity,
+	float: _unwrap_identity,
+	str: _unwrap_identity,
+	bool: _unwrap_identity,
+})
+
+
+def unwrap_dbus_value(val):
+	"""Converts D-Bus values back to the original type. For example if val is of type DBus.Double,
+	a float will be returned."""
+	unwrap = _unwrap_dispatch.get(type(val))
+	if unwrap is None:
+		return _unwrap_dbus_value_isinstance(val)
+	return unwrap(val)
+
 # When supported, only name owner changes for the the given namespace are reported. This
 # prevents spending cpu time at irrelevant changes, like scripts accessing the bus temporarily.
 def add_name_owner_changed_receiver(dbus, name_owner_changed, namespace="com.victronenergy"):
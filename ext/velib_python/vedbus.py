@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import dbus.lowlevel
 import dbus.service
 import logging
 import os
@@ -58,14 +59,36 @@ notset = object()
 #   The signature of a variant is 'v'.
 
 # Export ourselves as a D-Bus service.
+#
+# lazytext: when True, the Text of a value is not calculated when the value changes, but only when
+# it is requested with GetText or GetItems, and it is not sent with the ItemsChanged and
+# PropertiesChanged signals. Receivers then fall back to str(value) (see VeDbusRootTracker and
+# dbusmonitor), so only enable it if no subscriber shows the Text of the signals. The Text of single
+# paths is still sent if they are added with lazytext=False.
+#
+# GetItems returns a snapshot of all paths, which is updated by the items whenever their value is
+# set locally, instead of being rebuilt on every call. Only the Text of the values changed since the
+# previous GetItems is calculated then.
+#
+# virtual: when True, the paths are not exported as separate dbus objects. A single fallback object
+# on / (VeDbusRootFallbackExport) handles the BusItem methods of all paths and dispatches them to
+# lightweight VeDbusVirtualItem objects, for services with hundreds of paths. Introspection then
+# doesn't list the paths.
 class VeDbusService(object):
-	def __init__(self, servicename, bus=None, register=None):
+	def __init__(self, servicename, bus=None, register=None, lazytext=False, virtual=False):
 		# dict containing the VeDbusItemExport objects, with their path as the key.
 		self._dbusobjects = {}
 		self._dbusnodes = {}
 		self._ratelimiters = []
 		self._dbusname = None
 		self.name = servicename
+		self.lazytext = lazytext
+		self.virtual = virtual
+
+		# GetItems snapshot, dict with the path as key and {'Value': ..., 'Text': ...} as value
+		self._items = {}
+		# items with an outdated Text in the snapshot
+		self._staletext = set()
 
 		# dict containing the onchange callbacks, for each object. Object path is the key
 		self._onchangecallbacks = {}
@@ -76,8 +99,11 @@ class VeDbusService(object):
 		# make the dbus connection available to outside, could make this a true property instead, but ach..
 		self.dbusconn = self._dbusconn
 
-		# Add the root item that will return all items as a tree
-		self._dbusnodes['/'] = self.root = VeDbusRootExport(self._dbusconn, '/', self)
+		# Add the root item that will return all items as a tree, which also handles all paths in virtual mode
+		if virtual:
+			self._dbusnodes['/'] = self.root = VeDbusRootFallbackExport(self._dbusconn, self)
+		else:
+			self._dbusnodes['/'] = self.root = VeDbusRootExport(self._dbusconn, '/', self)
 
 		# Immediately register the service unless requested not to
 		if register is None:
@@ -103,6 +129,8 @@ class VeDbusService(object):
 		for item in list(self._dbusobjects.values()):
 			item.__del__()
 		self._dbusobjects.clear()
+		self._items.clear()
+		self._staletext.clear()
 		if self._dbusname:
 			self._dbusname.__del__()  # Forces call to self._bus.release_name(self._name), see source code
 		self._dbusname = None
@@ -113,21 +141,34 @@ class VeDbusService(object):
 	# @param callbackonchange	function that will be called when this value is changed. First parameter will
 	#							be the path of the object, second the new value. This callback should return
 	#							True to accept the change, False to reject it.
+	# @param lazytext			overrides the lazytext setting of the service for this path, None to use it.
 	def add_path(self, path, value, description="", writeable=False,
-					onchangecallback=None, gettextcallback=None, valuetype=None, itemtype=None):
+					onchangecallback=None, gettextcallback=None, valuetype=None, itemtype=None,
+					lazytext=None):
 
 		if onchangecallback is not None:
 			self._onchangecallbacks[path] = onchangecallback
 
-		itemtype = itemtype or VeDbusItemExport
-		item = itemtype(self._dbusconn, path, value, description, writeable,
+		# virtual items are exported by the root
+		if self.virtual:
+			itemtype = itemtype or VeDbusVirtualItem
+			bus = self.root
+		else:
+			itemtype = itemtype or VeDbusItemExport
+			bus = self._dbusconn
+		item = itemtype(bus, path, value, description, writeable,
 				self._value_changed, gettextcallback, deletecallback=self._item_deleted, valuetype=valuetype)
-
-		spl = path.split('/')
-		for i in range(2, len(spl)):
-			subPath = '/'.join(spl[:i])
-			if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
-				self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
+		item._lazytext = self.lazytext if lazytext is None else lazytext
+		item._snapshot = self._items[path] = {'Value': wrap_dbus_value(value)}
+		item._staletext = self._staletext
+		self._staletext.add(item)
+
+		if not self.virtual:
+			spl = path.split('/')
+			for i in range(2, len(spl)):
+				subPath = '/'.join(spl[:i])
+				if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
+					self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
 		self._dbusobjects[path] = item
 		logging.debug('added %s with start value %s. Writeable is %s' % (path, value, writeable))
 		return item
@@ -156,7 +197,11 @@ class VeDbusService(object):
 		return self._onchangecallbacks[path](path, newvalue)
 
 	def _item_deleted(self, path):
-		self._dbusobjects.pop(path)
+		item = self._dbusobjects.pop(path)
+		self._items.pop(path, None)
+		self._staletext.discard(item)
+		if self.virtual:
+			return
 		for np in list(self._dbusnodes.keys()):
 			if np != '/':
 				for ip in self._dbusobjects:
@@ -166,6 +211,14 @@ class VeDbusService(object):
 					self._dbusnodes[np].__del__()
 					self._dbusnodes.pop(np)
 
+	# Returns the GetItems snapshot, after calculating the outdated Texts. The dict is kept up to
+	# date by the items, so it must not be modified by the caller.
+	def get_items(self):
+		for item in self._staletext:
+			item._snapshot['Text'] = item.GetText()
+		self._staletext.clear()
+		return self._items
+
 	def __getitem__(self, path):
 		return self._dbusobjects[path].local_get_value()
 
@@ -217,11 +270,10 @@ class ServiceContext(object):
 			self.changes.clear()
 
 	def add_path(self, path, value, *args, **kwargs):
-		self.parent.add_path(path, value, *args, **kwargs)
-		self.changes[path] = {
-			'Value': wrap_dbus_value(value),
-			'Text': self.parent._dbusobjects[path].GetText()
-		}
+		item = self.parent.add_path(path, value, *args, **kwargs)
+		self.changes[path] = {'Value': wrap_dbus_value(value)}
+		if not item._lazytext:
+			self.changes[path]['Text'] = item.GetText()
 
 	def del_tree(self, root):
 		root = root.rstrip('/')
@@ -482,12 +534,85 @@ class VeDbusRootExport(VeDbusTreeExport):
 
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='a{sa{sv}}')
 	def GetItems(self):
-		return {
-			path: {
-				'Value': wrap_dbus_value(item.local_get_value()),
-				'Text': item.GetText() }
-			for path, item in self._service._dbusobjects.items()
-		}
+		return self._service.get_items()
+
+## Root of a VeDbusService in virtual mode.
+# Registered as fallback on /, so it receives the method calls on all object paths of the service.
+# Calls on a path are dispatched to its VeDbusVirtualItem, calls on a node of the tree return the
+# values below it, like VeDbusTreeExport does.
+class VeDbusRootFallbackExport(dbus.service.FallbackObject):
+	def __init__(self, bus, service):
+		dbus.service.FallbackObject.__init__(self, bus, '/')
+		self._bus = bus
+		self._path = '/'
+		self._service = service
+		logging.debug("VeDbusRootFallbackExport has been created")
+
+	def __del__(self):
+		if self._path is None: return
+		self.remove_from_connection()
+		logging.debug("VeDbusRootFallbackExport has been removed")
+		self._path = None
+
+	def _item(self, path):
+		try:
+			return self._service._dbusobjects[path]
+		except KeyError:
+			raise dbus.exceptions.DBusException("Unknown object path %s" % path,
+				name='org.freedesktop.DBus.Error.UnknownObject')
+
+	def _get_value_handler(self, path, get_text=False):
+		r = {}
+		px = path
+		if not px.endswith('/'):
+			px += '/'
+		for p, item in self._service._dbusobjects.items():
+			if p.startswith(px):
+				r[p[len(px):]] = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
+		if not r and path != '/':
+			self._item(path)
+		return r
+
+	# PropertiesChanged of a path, the signal decorator can't be used as it doesn't support emitting
+	# on a path below a fallback on /
+	def _properties_changed(self, path, changes):
+		message = dbus.lowlevel.SignalMessage(path, 'com.victronenergy.BusItem', 'PropertiesChanged')
+		message.append(changes, signature='a{sv}')
+		self._bus.send_message(message)
+
+	@dbus.service.signal('com.victronenergy.BusItem', signature='a{sa{sv}}')
+	def ItemsChanged(self, changes):
+		pass
+
+	@dbus.service.method('com.victronenergy.BusItem', out_signature='a{sa{sv}}', rel_path_keyword='path')
+	def GetItems(self, path):
+		if path != '/':
+			raise dbus.exceptions.UnknownMethodException('GetItems is not supported on %s' % path)
+		return self._service.get_items()
+
+	@dbus.service.method('com.victronenergy.BusItem', out_signature='v', rel_path_keyword='path')
+	def GetValue(self, path):
+		if path in self._service._dbusobjects:
+			return self._service._dbusobjects[path].GetValue()
+		value = self._get_value_handler(path)
+		return dbus.Dictionary(value, signature=dbus.Signature('sv'), variant_level=1)
+
+	# The signature depends on the path: s for a value, like VeDbusItemExport, and a variant with the
+	# texts below it for a node, like VeDbusTreeExport.
+	@dbus.service.method('com.victronenergy.BusItem', out_signature=None, rel_path_keyword='path')
+	def GetText(self, path):
+		if path in self._service._dbusobjects:
+			return dbus.String(self._service._dbusobjects[path].GetText())
+		text = self._get_value_handler(path, True)
+		return dbus.Dictionary(text, signature=dbus.Signature('ss'), variant_level=1)
+
+	@dbus.service.method('com.victronenergy.BusItem', in_signature='v', out_signature='i', rel_path_keyword='path')
+	def SetValue(self, newvalue, path):
+		return self._item(path).SetValue(newvalue)
+
+	@dbus.service.method('com.victronenergy.BusItem', in_signature='si', out_signature='s', rel_path_keyword='path')
+	def GetDescription(self, language, length, path):
+		return self._item(path).GetDescription(language, length)
 
 
 class VeDbusItemExport(dbus.service.Object):
@@ -515,6 +640,14 @@ class VeDbusItemExport(dbus.service.Object):
 		self._writeable = writeable
 		self._deletecallback = deletecallback
 		self._type = valuetype
+		# Text is only calculated when requested and then cached until the value changes
+		self._text = notset
+		# Don't send the Text with the change signals, see VeDbusService
+		self._lazytext = False
+		# entry in the GetItems snapshot of the VeDbusService and the set of the items with outdated Text,
+		# None if the item is not added by a VeDbusService
+		self._snapshot = None
+		self._staletext = None
 
 	# To force immediate deregistering of this dbus object, explicitly call __del__().
 	def __del__(self):
@@ -539,10 +672,15 @@ class VeDbusItemExport(dbus.service.Object):
 			return None
 
 		self._value = newvalue
-		return {
-			'Value': wrap_dbus_value(newvalue),
-			'Text': self.GetText()
-		}
+		self._text = notset
+		changes = {'Value': wrap_dbus_value(newvalue)}
+		if not self._lazytext:
+			changes['Text'] = self.GetText()
+		if self._snapshot is not None:
+			self._snapshot.update(changes)
+			if self._lazytext:
+				self._staletext.add(self)
+		return changes
 
 	def local_get_value(self):
 		return self._value
@@ -605,6 +743,11 @@ class VeDbusItemExport(dbus.service.Object):
 	# @return text A text-value. '---' when local value is invalid
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='s')
 	def GetText(self):
+		if self._text is notset:
+			self._text = self._get_text()
+		return self._text
+
+	def _get_text(self):
 		if self._value is None:
 			return '---'
 
@@ -629,6 +772,96 @@ class VeDbusItemExport(dbus.service.Object):
 	def PropertiesChanged(self, changes):
 		pass
 
+## Value of a VeDbusService in virtual mode.
+#
+# Same interface as VeDbusItemExport, but not a dbus object: the methods are called by the
+# VeDbusRootFallbackExport given as bus. With the slots an item takes about a hundred bytes, instead
+# of a dbus.service.Object with its own registration on the connection.
+class VeDbusVirtualItem(object):
+	__slots__ = ('_root', '_path', '_onchangecallback', '_gettextcallback', '_value', '_description',
+		'_writeable', '_deletecallback', '_type', '_text', '_lazytext', '_snapshot', '_staletext')
+
+	def __init__(self, root, objectPath, value=None, description=None, writeable=False,
+					onchangecallback=None, gettextcallback=None, deletecallback=None,
+					valuetype=None):
+		self._root = root
+		self._path = objectPath
+		self._onchangecallback = onchangecallback
+		self._gettextcallback = gettextcallback
+		self._value = value
+		self._description = description
+		self._writeable = writeable
+		self._deletecallback = deletecallback
+		self._type = valuetype
+		self._text = notset
+		self._lazytext = False
+		self._snapshot = None
+		self._staletext = None
+
+	def __del__(self):
+		if self._path is None: return
+		if self._deletecallback is not None:
+			self._deletecallback(self._path)
+		logging.debug("VeDbusVirtualItem %s has been removed" % self._path)
+		self._path = None
+
+	def local_set_value(self, newvalue):
+		changes = self._local_set_value(newvalue)
+		if changes is not None:
+			self._root._properties_changed(self._path, changes)
+
+	_local_set_value = VeDbusItemExport._local_set_value
+
+	def local_get_value(self):
+		return self._value
+
+	def SetValue(self, newvalue):
+		if not self._writeable:
+			return 1  # NOT OK
+
+		newvalue = unwrap_dbus_value(newvalue)
+
+		if self._type is not None and newvalue is not None:
+			try:
+				newvalue = self._type(newvalue)
+			except (ValueError, TypeError):
+				return 1 # NOT OK
+
+		if newvalue == self._value:
+			return 0  # OK
+
+		if self._onchangecallback is None or self._onchangecallback(self._path, newvalue):
+			self.local_set_value(newvalue)
+			return 0  # OK
+
+		return 2  # NOT OK
+
+	def GetDescription(self, language, length):
+		return self._description if self._description is not None else 'No description given'
+
+	def GetValue(self):
+		return wrap_dbus_value(self._value)
+
+	def GetText(self):
+		if self._text is notset:
+			self._text = self._get_text()
+		return self._text
+
+	def _get_text(self):
+		if self._value is None:
+			return '---'
+
+		if self._gettextcallback is None and type(self._value) == dbus.Byte:
+			return str(int(self._value))
+
+		if self._gettextcallback is None and self._path == '/ProductId':
+			return "0x%X" % self._value
+
+		if self._gettextcallback is None:
+			return str(self._value)
+
+		return self._gettextcallback(self._path, self._value)
+
 ## This class behaves like a regular reference to a class method (eg. self.foo), but keeps a weak reference
 ## to the object which method is to be called.
 ## Use this object to break circular references.
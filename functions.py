@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
-import sys
-import logging
+from array import array
+from bisect import bisect_right
 
 
 class Functions:
@@ -21,23 +21,6 @@ class Functions:
         except Exception:
             return None
 
-    # Interpolate f(x) if given lists Y = f(X)
-
-    def _interpolate(self, X, Y, x):
-        if len(X) == len(Y):
-            _len = len(X)
-            if x <= X[0]:
-                return Y[0]
-            elif x >= X[_len - 1]:
-                return Y[_len - 1]
-            else:
-                for i in range(_len - 1):
-                    if x <= X[i + 1]:
-                        return Y[i] + (Y[i + 1] - Y[i]) / (X[i + 1] - X[i]) * (x - X[i])
-        else:
-            logging.error("Both lists must have the same length. Exiting.")
-            sys.exit()
-
     def get_venus_os_version() -> str:
         """
         Get the Venus OS version.
@@ -66,6 +49,85 @@ class Functions:
             return f.readline().strip()
 
 
+class LimitCurve:
+    """
+    Piecewise linear curve Y = f(X), or Z = f(X, Y) with bilinear interpolation if Z is given.
+    Outside of the given points the first/last value is kept.
+
+    The points are validated once on creation, evaluation is done by bisection in O(log n).
+    With a resolution (1-D only), the curve is additionally sampled into a lookup table
+    with this step from X[0] to X[-1] and evaluated in O(1).
+
+    :param X: points on the x axis in ascending order
+    :param Y: values for X (1-D) or points on the y axis in ascending order (2-D)
+    :param Z: list with one row of values for X for each point of Y (2-D only)
+    :param resolution: step of the lookup table, e.g. 0.001 for mV
+    """
+
+    def __init__(self, X, Y, Z=None, resolution=None):
+        self._X = self._axis(X, "X")
+        if Z is None:
+            if len(Y) != len(X):
+                raise ValueError("X and Y must have the same length")
+            self._Y = tuple(float(y) for y in Y)
+            self._Z = None
+        else:
+            self._Y = self._axis(Y, "Y")
+            if len(Z) != len(Y) or any(len(row) != len(X) for row in Z):
+                raise ValueError("Z must have one row with a value for each X for each Y")
+            self._Z = tuple(tuple(float(z) for z in row) for row in Z)
+
+        self.dimensions = 1 if Z is None else 2
+        self._table = None
+        if resolution and Z is None:
+            self._resolution = resolution
+            steps = int(round((self._X[-1] - self._X[0]) / resolution))
+            self._table = array("d", (self._linear(self._X[0] + step * resolution) for step in range(steps + 1)))
+
+    @staticmethod
+    def _axis(points, name):
+        points = tuple(float(point) for point in points)
+        if len(points) < 2:
+            raise ValueError("%s must have at least 2 values" % name)
+        if any(a > b for a, b in zip(points, points[1:])):
+            raise ValueError("%s must be in ascending order" % name)
+        return points
+
+    @staticmethod
+    def _segment(axis, v):
+        """
+        :return: (index of the lower point, index of the upper point, position between them from 0 to 1)
+        """
+        i = bisect_right(axis, v)
+        if i == 0:
+            return 0, 0, 0.0
+        if i == len(axis):
+            return i - 1, i - 1, 0.0
+        return i - 1, i, (v - axis[i - 1]) / (axis[i] - axis[i - 1])
+
+    def _linear(self, x):
+        i0, i1, t = self._segment(self._X, x)
+        return self._Y[i0] + (self._Y[i1] - self._Y[i0]) * t
+
+    def __call__(self, x, y=None):
+        if self._Z is not None:
+            i0, i1, t = self._segment(self._X, x)
+            j0, j1, u = self._segment(self._Y, y)
+            z0 = self._Z[j0][i0] + (self._Z[j0][i1] - self._Z[j0][i0]) * t
+            z1 = self._Z[j1][i0] + (self._Z[j1][i1] - self._Z[j1][i0]) * t
+            return z0 + (z1 - z0) * u
+
+        if self._table is None:
+            return self._linear(x)
+
+        index = round((x - self._X[0]) / self._resolution)
+        if index <= 0:
+            return self._table[0]
+        if index >= len(self._table):
+            return self._table[-1]
+        return self._table[index]
+
+
 ################
 # test program #
 ################
@@ -74,18 +136,12 @@ class Functions:
 def main():
     import settings as s
 
-    fn = Functions()
     for x in range(0, 251):
         print(
             "%.2f %.0f"
             % (
                 x / 100.0,
-                s.MAX_CHARGE_CURRENT
-                * fn._interpolate(
-                    s.CELL_CHARGE_LIMITING_VOLTAGE,
-                    s.CELL_CHARGE_LIMITED_CURRENT,
-                    x / 100.0,
-                ),
+                s.MAX_CHARGE_CURRENT * s.CELL_CHARGE_LIMITING_CURVE(x / 100.0),
             )
         )
 
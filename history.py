@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+"""
+In-memory history of the aggregated values, queried by GetHistory on DBus.
+"""
+
+from array import array
+from math import floor, isnan, nan
+import time
+
+import dbus.exceptions
+import dbus.service
+
+CHANNELS = (
+    "Voltage",
+    "Current",
+    "Power",
+    "Soc",
+    "Temperature",
+    "MaxCellVoltage",
+    "MinCellVoltage",
+    "MaxCellTemperature",
+    "MinCellTemperature",
+    "MaxChargeVoltage",
+    "MaxChargeCurrent",
+    "MaxDischargeCurrent",
+    "OwnCharge",
+    "Balancing",
+    "DynamicCvl",
+    "AcPowerSetpoint",
+    "GridPower",
+    "AcLoad",
+    "MpptPower",
+    "PvOnGrid",
+)
+
+HISTORY_INTERFACE = "com.victronenergy.AggregateBatteries.History"
+
+
+class History:
+    """
+    Ring buffer with one sample per period for each channel.
+
+    All samples are preallocated on creation in one float64 column per channel and one for the time stamps,
+    so the memory does not grow. A sample is written by set() for each channel, directly into the columns,
+    and completed by record(). Channels not set and invalid (None) values are stored as NaN and skipped
+    when reading.
+    """
+
+    def __init__(self, length, period=1, channels=CHANNELS):
+        """
+        :param length: number of samples per channel
+        :param period: min. time between two samples in s
+        :param channels: names of the channels
+        """
+        self.length = length
+        self.period = period
+        self.channels = channels
+        # one more row for the sample being set, it is not read by get() until it is recorded
+        self._size = length + 1
+        self._columns = {name: array("d", [nan]) * self._size for name in channels}
+        self._times = array("d", [nan]) * self._size
+        # position of the next sample and number of recorded samples
+        self._next = 0
+        self._count = 0
+        self._nextTime = 0
+
+    @property
+    def footprint(self):
+        """
+        :return: memory of the sample buffers in bytes
+        """
+        return self._times.itemsize * self._size + sum(column.itemsize * self._size for column in self._columns.values())
+
+    def due(self, now):
+        """
+        :return: True if the next sample is to be recorded at time now
+        """
+        return now >= self._nextTime
+
+    def set(self, channel, value):
+        """
+        Set the value of a channel of the next sample.
+
+        :param channel: name of the channel
+        :param value: value, None if invalid
+        """
+        self._columns[channel][self._next] = nan if value is None else value
+
+    def record(self, now):
+        """
+        Complete the next sample with the values set since the last record().
+
+        :param now: time stamp in s of a monotonic clock, the binary search in get() relies on increasing time stamps
+        """
+        self._times[self._next] = now
+        position = self._next = (self._next + 1) % self._size
+        self._count = min(self._count + 1, self.length)
+        # clear the oldest sample for the next one
+        self._times[position] = nan
+        for column in self._columns.values():
+            column[position] = nan
+        # keep the raster, but don't catch up after a pause
+        if now - self._nextTime < self.period:
+            self._nextTime += self.period
+        else:
+            self._nextTime = now + self.period
+
+    def _position(self, index):
+        # position of the index-th oldest sample
+        return (self._next - self._count + index) % self._size
+
+    def _first_since(self, since):
+        # binary search in the ring, the time stamps increase from the oldest sample
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._times[self._position(middle)] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, channel, since, step):
+        """
+        Samples of one channel, averaged over intervals of step seconds.
+
+        :param channel: name of the channel
+        :param since: time stamp of the first sample
+        :param step: length of the intervals in s, <= period returns the samples as recorded
+        :return: (list of time stamps of the intervals, list of average values), intervals without a valid sample are skipped
+        """
+        values = self._columns[channel]
+        times = []
+        averages = []
+        bucket = None
+        total = 0
+        count = 0
+        step = max(step, self.period)
+        for index in range(self._first_since(since), self._count):
+            position = self._position(index)
+            value = values[position]
+            if isnan(value):
+                continue
+            current = floor((self._times[position] - since) / step)
+            if current != bucket:
+                if count:
+                    times.append(since + bucket * step)
+                    averages.append(total / count)
+                bucket = current
+                total = 0
+                count = 0
+            total += value
+            count += 1
+        if count:
+            times.append(since + bucket * step)
+            averages.append(total / count)
+        return times, averages
+
+
+class HistoryExport(dbus.service.Object):
+    """
+    DBus object /History of the aggregate battery service.
+
+    The history is recorded with the monotonic clock, so a step of the system time (NTP, GPS) does not break
+    the order of the samples. The time stamps on DBus are in the system time of the moment of the call.
+
+    dbus-send --system --print-reply --dest=com.victronenergy.battery.aggregate /History \\
+        com.victronenergy.AggregateBatteries.History.GetHistory string:MaxChargeVoltage double:-3600 double:60
+    """
+
+    def __init__(self, bus, history, clock=time.monotonic, wallClock=time.time, objectPath="/History"):
+        """
+        :param clock: function returning the time of the time stamps of the history
+        :param wallClock: function returning the system time, which is used on DBus
+        """
+        dbus.service.Object.__init__(self, bus, objectPath)
+        self._history = history
+        self._clock = clock
+        self._wallClock = wallClock
+
+    @dbus.service.method(HISTORY_INTERFACE, out_signature="as")
+    def GetChannels(self):
+        return list(self._history.channels)
+
+    @dbus.service.method(HISTORY_INTERFACE, in_signature="sdd", out_signature="adad")
+    def GetHistory(self, channel, since, step):
+        """
+        :param since: system time of the first sample, if negative seconds before now
+        :param step: length of the averaging intervals in s
+        :return: system time stamps and averaged values
+        """
+        now = self._clock()
+        offset = self._wallClock() - now
+        if since < 0:
+            since += now
+        else:
+            since -= offset
+        try:
+            times, values = self._history.get(str(channel), since, step)
+        except KeyError:
+            raise dbus.exceptions.DBusException("Unknown channel %s" % channel, name=HISTORY_INTERFACE + ".UnknownChannel")
+        return dbus.Array([stamp + offset for stamp in times], signature="d"), dbus.Array(values, signature="d")
@@ -47,6 +47,12 @@ function backup_config {
         mv /data/dbus-aggregate-batteries/last_balancing /data/dbus-aggregate-batteries_last_balancing.backup
         echo "last_balancing backed up to /data/dbus-aggregate-batteries_last_balancing.backup"
     fi
+
+    # backup state.journal
+    if [ -f "/data/apps/dbus-aggregate-batteries/state.journal" ]; then
+        mv /data/apps/dbus-aggregate-batteries/state.journal /data/apps/dbus-aggregate-batteries_state.journal.backup
+        echo "state.journal backed up to /data/apps/dbus-aggregate-batteries_state.journal.backup"
+    fi
 }
 
 function restore_config {
@@ -135,6 +141,12 @@ function restore_config {
             echo "last_balancing restored to /data/dbus-aggregate-batteries/last_balancing"
         fi
     fi
+
+    # restore state.journal
+    if [ -f "/data/apps/dbus-aggregate-batteries_state.journal.backup" ] && [ -d "/data/apps/dbus-aggregate-batteries" ]; then
+        mv /data/apps/dbus-aggregate-batteries_state.journal.backup /data/apps/dbus-aggregate-batteries/state.journal
+        echo "state.journal restored to /data/apps/dbus-aggregate-batteries/state.journal"
+    fi
 }
 
 
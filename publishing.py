@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""
+Precompiled publish plan for the aggregate battery service.
+"""
+
+notset = object()
+
+
+class PublishPlan:
+    """
+    Direct references to the VeDbusItemExport objects of all published paths.
+
+    Used like the ServiceContext of VeDbusService (with plan as bus: bus[path] = value), but values that
+    did not change, or changed less than the deadband of the path since they were published last, are
+    skipped before they are wrapped into D-Bus types. All accepted changes are sent in one ItemsChanged
+    signal when the with block is left.
+    """
+
+    def __init__(self, dbusservice):
+        self._dbusservice = dbusservice
+        # path: [VeDbusItemExport, deadband, last published value]
+        self._entries = {}
+        self._changes = {}
+
+    def add(self, path, deadband=0):
+        """
+        Add a path, which was already added to the VeDbusService.
+
+        :param path: DBus path
+        :param deadband: min. difference to the last published value to publish a numeric value again
+        """
+        self._entries[path] = [self._dbusservice._dbusobjects[path], deadband, notset]
+
+    def add_all(self, deadbands={}):
+        """
+        Add all paths of the VeDbusService.
+
+        :param deadbands: dictionary with path as key and deadband as value, 0 for paths not in it
+        """
+        for path in self._dbusservice._dbusobjects:
+            self.add(path, deadbands.get(path, 0))
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __setitem__(self, path, value):
+        entry = self._entries[path]
+        last = entry[2]
+        if value == last:
+            return
+        if entry[1] and value is not None and last is not notset and last is not None and abs(value - last) < entry[1]:
+            return
+        entry[2] = value
+        changes = entry[0]._local_set_value(value)
+        if changes is not None:
+            self._changes[path] = changes
+
+    def __getitem__(self, path):
+        return self._entries[path][0].local_get_value()
+
+    def flush(self):
+        if self._changes:
+            self._dbusservice.root.ItemsChanged(self._changes)
+            self._changes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+Multi-rate scheduler of the periodic tasks, published on /Debug/Scheduler/*.
+"""
+
+from math import ceil
+from time import monotonic
+
+
+class Task:
+    """
+    Periodic task of the Scheduler and its statistics.
+    """
+
+    def __init__(self, name, period, callback):
+        """
+        :param name: name of the task, used in the DBus paths
+        :param period: period in ms
+        :param callback: function without arguments, the return value is ignored
+        """
+        self.name = name
+        self.period = period / 1000
+        self.callback = callback
+        self.deadline = None
+        self.runs = 0
+        # runs taking longer than the period
+        self.overruns = 0
+        # deadlines dropped, because the task was more than one period late
+        self.skipped = 0
+        # time between deadline and start of the run in ms
+        self.lateness = None
+        self.maxLateness = None
+
+
+class Scheduler:
+    """
+    Runs tasks with independent periods from one GLib timer.
+
+    Each task has a deadline on the monotonic clock, which is advanced by its period after each run.
+    The deadlines therefore don't drift like chained GLib timers do. A task started more than one period
+    late is run once and the deadlines missed in the meantime are skipped, it does not catch up with a
+    burst of runs. Tasks due at the same time run in the order they were added.
+    The timer is re-armed after each tick for the nearest deadline, so the main loop sleeps between the runs.
+    """
+
+    def __init__(self, timeout_add, clock=monotonic):
+        """
+        :param timeout_add: function(ms, callback) arming a one-shot timer, e.g. GLib.timeout_add
+        :param clock: function returning the time in s
+        """
+        self._timeout_add = timeout_add
+        self._clock = clock
+        # name: Task, in order of priority
+        self.tasks = {}
+        self.started = False
+
+    def add(self, name, period, callback):
+        """
+        :param name: name of the task
+        :param period: period in ms
+        :param callback: function without arguments
+        """
+        task = Task(name, period, callback)
+        if self.started:
+            task.deadline = self._clock()
+        self.tasks[name] = task
+        return task
+
+    def start(self):
+        """
+        Run all tasks in the next main loop iteration, then every period.
+        """
+        now = self._clock()
+        for task in self.tasks.values():
+            task.deadline = now
+        self.started = True
+        self._timeout_add(0, self._tick)
+
+    def stop(self):
+        """
+        Don't run any task anymore, e.g. on shutdown.
+        """
+        self.started = False
+
+    def _tick(self):
+        if not self.started:
+            return False
+        try:
+            for task in self.tasks.values():
+                now = self._clock()
+                if now < task.deadline:
+                    continue
+                late = now - task.deadline
+                missed = int(late / task.period)
+                task.skipped += missed
+                task.deadline += (missed + 1) * task.period
+                task.lateness = late * 1000
+                task.maxLateness = task.lateness if task.maxLateness is None else max(task.maxLateness, task.lateness)
+                task.runs += 1
+                task.callback()
+                if self._clock() - now > task.period:
+                    task.overruns += 1
+        finally:
+            # re-arm even if a task raised, the other tasks keep running
+            if self.tasks and self.started:
+                delay = min(task.deadline for task in self.tasks.values()) - self._clock()
+                self._timeout_add(max(0, ceil(delay * 1000)), self._tick)
+        # one-shot
+        return False
+
+    def add_paths(self, dbusservice):
+        for name in self.tasks:
+            path = "/Debug/Scheduler/%s/" % name
+            dbusservice.add_path(path + "Runs", 0, writeable=False)
+            dbusservice.add_path(path + "Overruns", 0, writeable=False)
+            dbusservice.add_path(path + "Skipped", 0, writeable=False)
+            for value in ("Lateness", "MaxLateness"):
+                dbusservice.add_path(path + value, None, writeable=False, gettextcallback=lambda a, x: "{:.2f}ms".format(x))
+
+    def publish(self, bus):
+        """
+        :param bus: VeDbusService, its context or the PublishPlan
+        """
+        for name, task in self.tasks.items():
+            if task.lateness is None:
+                continue
+            path = "/Debug/Scheduler/%s/" % name
+            bus[path + "Runs"] = task.runs
+            bus[path + "Overruns"] = task.overruns
+            bus[path + "Skipped"] = task.skipped
+            bus[path + "Lateness"] = round(task.lateness, 2)
+            bus[path + "MaxLateness"] = round(task.maxLateness, 2)
@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
-# Standard library importsimport bisect
+# Standard library imports
 import configparser
 import logging
 import sys
 from pathlib import Path
 from time import sleep
-from typing import List, Any, Callable
+from typing import List, Any, Callable, Optional, Tuple
 
+from functions import LimitCurve
 
 PATH_CONFIG_DEFAULT: str = "config.default.ini"
 PATH_CONFIG_USER: str = "config.ini"
@@ -159,6 +160,32 @@ def get_list_from_config(group: str, option: str, mapper: Callable[[Any], Any] =
         return []
 
 
+def get_limit_curves(
+    option: str, voltages: List[float], currents: List[float], temperatures: List[float], factors: List[float]
+) -> Tuple[Optional[LimitCurve], Optional[LimitCurve]]:
+    """
+    Compile the current limiting curves once, so they don't need to be checked on every update.
+
+    :param option: Option in the config file with the voltages, used for error messages
+    :param voltages: Cell voltages in ascending order
+    :param currents: Current factors for the cell voltages
+    :param temperatures: Cell temperatures in ascending order, empty for no temperature derating
+    :param factors: Current factors for the cell temperatures
+    :return: Curve by cell voltage with mV lookup table, curve by cell voltage and temperature or None
+    """
+    if len(temperatures) != len(factors):
+        errors_in_config.append(f"The temperature derating of {option} must have the same number of temperatures and factors.")
+        return None, None
+    try:
+        curve = LimitCurve(voltages, currents, resolution=0.001)
+        if not temperatures:
+            return curve, None
+        return curve, LimitCurve(voltages, temperatures, [[current * factor for current in currents] for factor in factors])
+    except ValueError as error:
+        errors_in_config.append(f"Invalid curve for {option}: {error}")
+        return None, None
+
+
 def check_config_issue(condition: bool, message: str):
     """
     Check a condition and append a message to the errors_in_config list if the condition is True.
@@ -196,10 +223,30 @@ GRID_SERVICE_NAME: str = config["DEFAULT"]["GRID_SERVICE_NAME"]
 SMARTSHUNT_NAME_KEYWORD: str = config["DEFAULT"]["SMARTSHUNT_NAME_KEYWORD"]
 SMARTSHUNT_INSTANCE_NAME_PATH: str = config["DEFAULT"]["SMARTSHUNT_INSTANCE_NAME_PATH"]
 SEARCH_TRIALS: int = get_int_from_config("DEFAULT", "SEARCH_TRIALS")
+TOPOLOGY_CACHE: bool = get_bool_from_config("DEFAULT", "TOPOLOGY_CACHE")
 READ_TRIALS: int = get_int_from_config("DEFAULT", "READ_TRIALS")
 UPDATE_INTERVAL_FIND_DEVICES: int = get_int_from_config("DEFAULT", "UPDATE_INTERVAL_FIND_DEVICES")
 UPDATE_INTERVAL_DATA: int = get_int_from_config("DEFAULT", "UPDATE_INTERVAL_DATA")
 UPDATE_INTERVAL_MS: int = get_int_from_config("DEFAULT", "UPDATE_INTERVAL_MS")
+ESS_INTERVAL_MS: int = get_int_from_config("DEFAULT", "ESS_INTERVAL_MS")
+CELL_VOLTAGES_INTERVAL_MS: int = get_int_from_config("DEFAULT", "CELL_VOLTAGES_INTERVAL_MS")
+if ESS_INTERVAL_MS < 1:
+    errors_in_config.append("ESS_INTERVAL_MS must be at least 1. Currently set to %d." % ESS_INTERVAL_MS)
+if CELL_VOLTAGES_INTERVAL_MS < 1:
+    errors_in_config.append("CELL_VOLTAGES_INTERVAL_MS must be at least 1. Currently set to %d." % CELL_VOLTAGES_INTERVAL_MS)
+EVENT_DRIVEN_UPDATE: bool = get_bool_from_config("DEFAULT", "EVENT_DRIVEN_UPDATE")
+ESS_ON_GRID_CHANGE: bool = get_bool_from_config("DEFAULT", "ESS_ON_GRID_CHANGE")
+ESS_KP: float = get_float_from_config("DEFAULT", "ESS_KP")
+ESS_KI: float = get_float_from_config("DEFAULT", "ESS_KI")
+ESS_MAX_CORRECTION: float = get_float_from_config("DEFAULT", "ESS_MAX_CORRECTION")
+if ESS_MAX_CORRECTION < 0:
+    errors_in_config.append("ESS_MAX_CORRECTION must be at least 0. Currently set to %g." % ESS_MAX_CORRECTION)
+DIRTY_TRACKING: bool = get_bool_from_config("DEFAULT", "DIRTY_TRACKING")
+SENDER_SCOPED_SIGNALS: bool = get_bool_from_config("DEFAULT", "SENDER_SCOPED_SIGNALS")
+WRITE_MAX_IN_FLIGHT: int = get_int_from_config("DEFAULT", "WRITE_MAX_IN_FLIGHT")
+if WRITE_MAX_IN_FLIGHT < 1:
+    errors_in_config.append("WRITE_MAX_IN_FLIGHT must be at least 1. Currently set to %d." % WRITE_MAX_IN_FLIGHT)
+WRITE_REFRESH_INTERVAL: int = get_int_from_config("DEFAULT", "WRITE_REFRESH_INTERVAL")
 TIME_BEFORE_RESTART: int = get_int_from_config("DEFAULT", "TIME_BEFORE_RESTART")
 
 
@@ -213,6 +260,9 @@ ZERO_SOC: bool = get_bool_from_config("DEFAULT", "ZERO_SOC")
 MAX_CELL_VOLTAGE_SOC_FULL: float = get_float_from_config("DEFAULT", "MAX_CELL_VOLTAGE_SOC_FULL")
 MIN_CELL_VOLTAGE_SOC_EMPTY: float = get_float_from_config("DEFAULT", "MIN_CELL_VOLTAGE_SOC_EMPTY")
 CHARGE_SAVE_PRECISION: float = get_float_from_config("DEFAULT", "CHARGE_SAVE_PRECISION")
+STATE_SAVE_INTERVAL: int = get_int_from_config("DEFAULT", "STATE_SAVE_INTERVAL")
+SHUTDOWN_TIMEOUT: float = get_float_from_config("DEFAULT", "SHUTDOWN_TIMEOUT")
+RESTORE_FEED_IN_ON_EXIT: bool = get_bool_from_config("DEFAULT", "RESTORE_FEED_IN_ON_EXIT")
 
 
 # ----- Charge/Discharge parameters -----
@@ -264,11 +314,40 @@ if not CELL_DISCHARGE_LIMITED_CURRENT or len(CELL_DISCHARGE_LIMITED_CURRENT) < 2
         errors_in_config.append("CELL_DISCHARGE_LIMITED_CURRENT is not set or has less than 2 values. Using default values.")
     CELL_DISCHARGE_LIMITED_CURRENT = [0, 0.05, 1]
 
+CELL_CHARGE_LIMITING_TEMPERATURE: List[float] = get_list_from_config("DEFAULT", "CELL_CHARGE_LIMITING_TEMPERATURE", float)
+CELL_CHARGE_LIMITED_CURRENT_TEMPERATURE: List[float] = get_list_from_config("DEFAULT", "CELL_CHARGE_LIMITED_CURRENT_TEMPERATURE", float)
+CELL_DISCHARGE_LIMITING_TEMPERATURE: List[float] = get_list_from_config("DEFAULT", "CELL_DISCHARGE_LIMITING_TEMPERATURE", float)
+CELL_DISCHARGE_LIMITED_CURRENT_TEMPERATURE: List[float] = get_list_from_config("DEFAULT", "CELL_DISCHARGE_LIMITED_CURRENT_TEMPERATURE", float)
+
+CELL_CHARGE_LIMITING_CURVE, CELL_CHARGE_LIMITING_TEMPERATURE_CURVE = get_limit_curves(
+    "CELL_CHARGE_LIMITING_VOLTAGE",
+    CELL_CHARGE_LIMITING_VOLTAGE,
+    CELL_CHARGE_LIMITED_CURRENT,
+    CELL_CHARGE_LIMITING_TEMPERATURE,
+    CELL_CHARGE_LIMITED_CURRENT_TEMPERATURE,
+)
+CELL_DISCHARGE_LIMITING_CURVE, CELL_DISCHARGE_LIMITING_TEMPERATURE_CURVE = get_limit_curves(
+    "CELL_DISCHARGE_LIMITING_VOLTAGE",
+    CELL_DISCHARGE_LIMITING_VOLTAGE,
+    CELL_DISCHARGE_LIMITED_CURRENT,
+    CELL_DISCHARGE_LIMITING_TEMPERATURE,
+    CELL_DISCHARGE_LIMITED_CURRENT_TEMPERATURE,
+)
+
 
 # --------- if OWN_CHARGE_PARAMETERS = False ---------
 KEEP_MAX_CVL: bool = get_bool_from_config("DEFAULT", "KEEP_MAX_CVL")
 SEND_CELL_VOLTAGES: int = get_int_from_config("DEFAULT", "SEND_CELL_VOLTAGES")
+PUBLISH_DEADBAND_CELL_VOLTAGE: float = get_float_from_config("DEFAULT", "PUBLISH_DEADBAND_CELL_VOLTAGE")
+PUBLISH_DEADBAND_CURRENT: float = get_float_from_config("DEFAULT", "PUBLISH_DEADBAND_CURRENT")
+PUBLISH_LAZY_TEXT: bool = get_bool_from_config("DEFAULT", "PUBLISH_LAZY_TEXT")
+PUBLISH_VIRTUAL_OBJECTS: bool = get_bool_from_config("DEFAULT", "PUBLISH_VIRTUAL_OBJECTS")
 LOG_PERIOD: int = get_int_from_config("DEFAULT", "LOG_PERIOD")
+TICK_TIMING: bool = get_bool_from_config("DEFAULT", "TICK_TIMING")
+HISTORY_LENGTH: int = get_int_from_config("DEFAULT", "HISTORY_LENGTH")
+HISTORY_PERIOD: int = get_int_from_config("DEFAULT", "HISTORY_PERIOD")
+if HISTORY_PERIOD < 1:
+    errors_in_config.append("HISTORY_PERIOD must be at least 1. Currently set to %d." % HISTORY_PERIOD)
 
 
 # print errors and exit if there are any
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+
+"""
+Simulation of the service over days or months on a virtual clock.
+
+DbusAggBatService runs like in the benchmark against a MockDbusMonitor and a VeDbusService which is not connected
+to the DBus, but all timers of the main loop fire on the virtual time of a MockTimerManager. tt.time, tt.monotonic,
+dt.now and the clocks of the scheduler, the ESS controller and the write queue return the virtual time.
+The batteries, the MultiPlus and the MPPTs are replaced by a plant model: LFP cells with an open circuit voltage
+curve, internal resistance and passive balancers, BMS coulomb counters with a gain error, a MultiPlus following
+the AC power setpoint with a first-order response and MPPTs with a daily and seasonal PV profile. The charge and
+discharge of the cells are limited by the CVL, CCL and DCL published by the service, so the charge voltage of the
+month (CHARGE_VOLTAGE_LIST), the balancing cycles (BALANCING_REPETITION) and the own charge counter can be watched
+over simulated months within minutes.
+
+The settings of config.ini are used, except of the hardware and the intervals, which are overridden by the options.
+One line per simulated day is printed, the days are saved as JSON with --output.
+
+Usage:
+    python3 simulation.py --days 30
+    python3 simulation.py --batteries 2 --cells 16 --start 2024-03-01 --days 180 --step 60 --output simulation.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+from datetime import datetime
+from functools import partial
+from types import SimpleNamespace
+from unittest import mock
+
+# also puts velib_python and its test mocks on the path
+from benchmark import (
+    GRID_SERVICE,
+    MULTI_SERVICE,
+    Fleet,
+    FleetDbusMonitor,
+    StubSettingsDevice,
+    StubVeDbusService,
+    load_service_module,
+)
+import settings
+import dbusmon
+import writequeue
+from ess import EssController
+from scheduler import Scheduler
+from statestore import StateStore
+from mock_gobject import MockTimerManager
+
+# open circuit voltage of a LFP cell over the state of charge
+OCV_CURVE = (
+    (0.00, 2.50),
+    (0.05, 3.10),
+    (0.10, 3.20),
+    (0.20, 3.25),
+    (0.30, 3.28),
+    (0.50, 3.30),
+    (0.70, 3.32),
+    (0.90, 3.34),
+    (0.95, 3.37),
+    (0.98, 3.42),
+    (1.00, 3.55),
+)
+
+
+def ocv(soc):
+    """
+    :param soc: state of charge, 0...1
+    :return: open circuit voltage of a LFP cell, steeply rising above full
+    """
+    if soc >= 1:
+        return OCV_CURVE[-1][1] + (soc - 1) * 20
+    if soc <= 0:
+        return OCV_CURVE[0][1] + soc * 20
+    for (soc1, volt1), (soc2, volt2) in zip(OCV_CURVE, OCV_CURVE[1:]):
+        if soc <= soc2:
+            return volt1 + (volt2 - volt1) * (soc - soc1) / (soc2 - soc1)
+
+
+class VirtualClock:
+    """
+    Time functions of the service (tt, dt and the scheduler clock) on the virtual time of a MockTimerManager.
+    """
+
+    def __init__(self, timers, start):
+        """
+        :param start: datetime at virtual time 0
+        """
+        self._timers = timers
+        self._start = start.timestamp()
+
+    def monotonic(self):
+        return self._timers.time / 1000
+
+    def time(self):
+        return self._start + self._timers.time / 1000
+
+    def sleep(self, seconds):
+        # only used before exiting
+        pass
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+    @staticmethod
+    def strptime(*args, **kwargs):
+        return datetime.strptime(*args, **kwargs)
+
+
+class Cell:
+    def __init__(self, capacity, charge, resistance):
+        """
+        :param capacity: capacity in Ah
+        :param charge: charge in Ah
+        :param resistance: internal resistance in Ohm
+        """
+        self.capacity = capacity
+        self.charge = charge
+        self.resistance = resistance
+
+    @property
+    def soc(self):
+        return self.charge / self.capacity
+
+    def voltage(self, current):
+        return ocv(self.soc) + current * self.resistance
+
+
+class Plant(Fleet):
+    """
+    Batteries, MultiPlus and MPPTs of the simulated system.
+
+    The batteries are connected in parallel and share the current equally. The AC loads are all on AC out, so the
+    grid power equals the AC input power of the MultiPlus.
+    """
+
+    def __init__(
+        self,
+        nr_of_batteries,
+        nr_of_cells,
+        nr_of_mppts,
+        seed=1,
+        capacity=280.0,
+        soc=0.5,
+        pv_peak=4000.0,
+        load_base=300.0,
+        load_evening=1200.0,
+        inverter_power=5000.0,
+        inverter_efficiency=0.93,
+        inverter_time_constant=1.0,
+        counter_drift=0.01,
+    ):
+        """
+        :param capacity: nominal capacity of a battery in Ah, the cells differ by up to 2%
+        :param soc: initial state of charge, 0...1
+        :param pv_peak: power of all MPPTs at noon on midsummer in W
+        :param load_base: AC load in W
+        :param load_evening: additional AC load from 18:00 to 22:00 in W
+        :param inverter_power: max. AC power of the MultiPlus in W
+        :param inverter_time_constant: time constant of the MultiPlus following the AC power setpoint in s
+        :param counter_drift: gain error of the coulomb counters of the BMS, differs per battery up to this value
+        """
+        super().__init__(nr_of_batteries, nr_of_cells, nr_of_mppts, seed=seed)
+        uniform = self._random.uniform
+        self.capacity = capacity
+        self.cells = [
+            [Cell(capacity * uniform(0.98, 1.02), capacity * soc * uniform(0.99, 1.01), uniform(0.0002, 0.0003)) for _ in range(nr_of_cells)]
+            for _ in range(nr_of_batteries)
+        ]
+        self.counters = [capacity * soc for _ in range(nr_of_batteries)]
+        self.counterGains = [1 + uniform(-counter_drift, counter_drift) for _ in range(nr_of_batteries)]
+        self.pvPeak = pv_peak
+        self.loadBase = load_base
+        self.loadEvening = load_evening
+        self.inverterPower = inverter_power
+        self.inverterEfficiency = inverter_efficiency
+        self.inverterTimeConstant = inverter_time_constant
+        self.acIn = 0.0
+        self.current = 0.0
+        # energy in Wh since the last take_energy()
+        self.energy = {"GridImport": 0.0, "GridExport": 0.0, "Pv": 0.0, "PvCurtailed": 0.0, "Load": 0.0}
+
+    @property
+    def soc(self):
+        """
+        :return: true state of charge of all batteries in %
+        """
+        return 100 * sum(cell.charge for battery in self.cells for cell in battery) / sum(cell.capacity for battery in self.cells for cell in battery)
+
+    @property
+    def charge(self):
+        """
+        :return: true charge of all batteries in Ah, limited by the weakest cell of each battery
+        """
+        return sum(min(cell.charge for cell in battery) for battery in self.cells)
+
+    def take_energy(self):
+        energy = self.energy
+        self.energy = dict.fromkeys(energy, 0.0)
+        return energy
+
+    def pv_power(self, now):
+        """
+        :return: PV power in W, sine over the day, longer and higher days in summer, random clouds
+        """
+        season = math.cos(2 * math.pi * (now.timetuple().tm_yday - 172) / 365)
+        daylight = 12 + 4 * season
+        hour = now.hour + now.minute / 60 - (12 - daylight / 2)
+        if not 0 < hour < daylight:
+            return 0.0
+        return self.pvPeak * (0.6 + 0.4 * season) * math.sin(math.pi * hour / daylight) * self._random.uniform(0.5, 1.0)
+
+    def load_power(self, now):
+        load = self.loadBase * self._random.uniform(0.8, 1.2)
+        if 18 <= now.hour < 22:
+            load += self.loadEvening
+        return load
+
+    def populate(self, monitor):
+        super().populate(monitor)
+        for index, service in enumerate(self.batteries):
+            self._publish_battery(monitor, index, service, 0.0)
+
+    def _publish_battery(self, monitor, index, service, current):
+        cells = self.cells[index]
+        voltages = [round(cell.voltage(current), 3) for cell in cells]
+        voltage = round(sum(voltages), 2)
+        for cellId, cellVoltage in enumerate(voltages, 1):
+            monitor.set_value(service, "/Voltages/Cell%d" % cellId, cellVoltage)
+        maxCell = max(range(len(voltages)), key=voltages.__getitem__)
+        minCell = min(range(len(voltages)), key=voltages.__getitem__)
+        counter = self.counters[index]
+        monitor.set_value(service, "/Dc/0/Voltage", voltage)
+        monitor.set_value(service, "/Dc/0/Current", round(current, 2))
+        monitor.set_value(service, "/Dc/0/Power", round(voltage * current, 0))
+        monitor.set_value(service, "/Soc", round(100 * counter / self.capacity, 1))
+        monitor.set_value(service, "/Capacity", round(counter, 1))
+        monitor.set_value(service, "/ConsumedAmphours", round(self.capacity - counter, 1))
+        monitor.set_value(service, "/InstalledCapacity", self.capacity)
+        monitor.set_value(service, "/Voltages/Sum", voltage)
+        monitor.set_value(service, "/Voltages/Diff", round(voltages[maxCell] - voltages[minCell], 3))
+        monitor.set_value(service, "/System/MaxCellVoltage", voltages[maxCell])
+        monitor.set_value(service, "/System/MaxVoltageCellId", "C%d" % (maxCell + 1))
+        monitor.set_value(service, "/System/MinCellVoltage", voltages[minCell])
+        monitor.set_value(service, "/System/MinVoltageCellId", "C%d" % (minCell + 1))
+
+    def step(self, monitor, service, now, dt):
+        """
+        Advance the plant by dt seconds and write its values to the monitor.
+
+        :param service: DbusAggBatService, the charge limits are read from its DBus paths
+        """
+        batteries = len(self.cells)
+        voltage = sum(sum(cell.voltage(self.current / batteries) for cell in battery) for battery in self.cells) / batteries
+
+        # MultiPlus follows the AC power setpoint written by the ESS control
+        acOut = self.load_power(now)
+        setpoint = monitor.get_value(MULTI_SERVICE, "/Hub4/L1/AcPowerSetpoint") or 0
+        setpoint = max(acOut - self.inverterPower, min(acOut + self.inverterPower, setpoint))
+        self.acIn += (setpoint - self.acIn) * (1 - math.exp(-dt / self.inverterTimeConstant))
+
+        pv = self.pv_power(now)
+        pvAvailable = pv
+        dcMulti = self._dc_power(self.acIn - acOut)
+        current = (dcMulti + pv) / voltage
+
+        # limits of the BMS as published by the aggregate battery
+        cvl = service._dbusservice["/Info/MaxChargeVoltage"]
+        ccl = service._dbusservice["/Info/MaxChargeCurrent"]
+        dcl = service._dbusservice["/Info/MaxDischargeCurrent"]
+        maxCurrent = math.inf if ccl is None else ccl
+        if cvl is not None:
+            for battery in self.cells:
+                headroom = (cvl - sum(ocv(cell.soc) for cell in battery)) / sum(cell.resistance for cell in battery)
+                maxCurrent = min(maxCurrent, max(0.0, headroom) * batteries)
+        minCurrent = -math.inf if dcl is None else -dcl
+        if any(cell.charge <= 0 for battery in self.cells for cell in battery):
+            minCurrent = 0.0
+        if current > maxCurrent:
+            # the MPPTs curtail first, then the MultiPlus charges less
+            excess = (current - maxCurrent) * voltage
+            pv -= min(pv, excess)
+            excess -= pvAvailable - pv
+            if excess > 0:
+                self.acIn = self._ac_power(dcMulti - excess) + acOut
+        elif current < minCurrent:
+            # the grid covers what the battery can't deliver
+            self.acIn = self._ac_power(minCurrent * voltage - pv) + acOut
+        dcMulti = self._dc_power(self.acIn - acOut)
+        self.current = current = (dcMulti + pv) / voltage
+
+        # coulomb flow, the passive balancers bleed the high cells at the top
+        share = current / batteries
+        balance = monitor.get_value(self.batteries[0], "/Io/AllowToBalance")
+        for index, battery in enumerate(self.cells):
+            for cell in battery:
+                cell.charge = max(0.0, cell.charge + share * dt / 3600)
+            minVoltage = min(cell.voltage(share) for cell in battery)
+            for cell in battery:
+                if balance and cell.voltage(share) > 3.4 and cell.voltage(share) - minVoltage > 0.01:
+                    cell.charge -= 0.1 * dt / 3600
+            # the BMS counts with a gain error and is set to full at the top of the charge
+            self.counters[index] = min(self.capacity, max(0.0, self.counters[index] + share * self.counterGains[index] * dt / 3600))
+            if max(cell.voltage(share) for cell in battery) >= 3.45 and abs(share) < 0.05 * self.capacity:
+                self.counters[index] = self.capacity
+
+        hours = dt / 3600
+        self.energy["GridImport"] += max(0.0, self.acIn) * hours
+        self.energy["GridExport"] += max(0.0, -self.acIn) * hours
+        self.energy["Pv"] += pv * hours
+        self.energy["PvCurtailed"] += (pvAvailable - pv) * hours
+        self.energy["Load"] += acOut * hours
+
+        for index, battery in enumerate(self.batteries):
+            self._publish_battery(monitor, index, battery, share)
+        monitor.set_value(MULTI_SERVICE, "/Dc/0/Current", round(dcMulti / voltage, 2))
+        monitor.set_value(MULTI_SERVICE, "/Devices/0/Ac/In/P", round(self.acIn, 0))
+        monitor.set_value(MULTI_SERVICE, "/Devices/0/Ac/Out/P", round(acOut, 0))
+        monitor.set_value(MULTI_SERVICE, "/Devices/0/Ac/Inverter/P", round(dcMulti, 0))
+        for mppt in self.mppts:
+            monitor.set_value(mppt, "/Dc/0/Current", round(pv / voltage / len(self.mppts), 2))
+        monitor.set_value(GRID_SERVICE, "/Ac/Power", round(self.acIn, 0))
+        monitor.set_value(GRID_SERVICE, "/Ac/L1/Power", round(self.acIn, 0))
+
+    def _dc_power(self, ac):
+        # DC power of the MultiPlus for an AC power, positive when charging
+        return ac * self.inverterEfficiency if ac > 0 else ac / self.inverterEfficiency
+
+    def _ac_power(self, dc):
+        return dc / self.inverterEfficiency if dc > 0 else dc * self.inverterEfficiency
+
+
+def run_simulation(module, plant, start, days, step, report=None):
+    """
+    :param start: datetime of the start of the simulation
+    :param step: interval of the plant and the update tasks in s
+    :param report: function(day) called after each simulated day
+    :return: list of the days
+    """
+    stepMs = int(step * 1000)
+    overrides = {
+        "NR_OF_BATTERIES": plant.nr_of_batteries,
+        "NR_OF_CELLS_PER_BATTERY": plant.nr_of_cells,
+        "NR_OF_MPPTS": plant.nr_of_mppts,
+        "CURRENT_FROM_VICTRON": True,
+        "USE_SMARTSHUNTS": False,
+        "SEND_CELL_VOLTAGES": 0,
+        "EVENT_DRIVEN_UPDATE": False,
+        "UPDATE_INTERVAL_FIND_DEVICES": 1,
+        "UPDATE_INTERVAL_MS": stepMs,
+        "ESS_INTERVAL_MS": stepMs,
+        "CELL_VOLTAGES_INTERVAL_MS": stepMs,
+        "LOG_PERIOD": 0,
+        "HISTORY_LENGTH": 0,
+    }
+    timers = MockTimerManager(start_time=start.timestamp())
+    clock = VirtualClock(timers, start)
+    glib = SimpleNamespace(
+        timeout_add=timers.add_timer,
+        timeout_add_seconds=lambda timeout, callback, *args, **kwargs: timers.add_timer(timeout * 1000, callback, *args, **kwargs),
+        # MockTimerManager.add_idle fires at twice the current time
+        idle_add=partial(timers.add_timer, 0),
+        source_remove=timers.remove_resouce,
+    )
+    bus = mock.Mock()
+    results = []
+
+    with tempfile.TemporaryDirectory() as data:
+        state = StateStore(os.path.join(data, "state.journal"), {})
+        state.update(Charge=plant.charge, LastBalancing=clock.now().timetuple().tm_yday)
+        state.flush()
+
+        with mock.patch.multiple(settings, **overrides), mock.patch.multiple(
+            module,
+            GLib=glib,
+            VeDbusService=StubVeDbusService,
+            SettingsDevice=StubSettingsDevice,
+            get_bus=lambda: bus,
+            DATA_PATH=data + os.sep,
+            HistoryExport=mock.Mock(),
+            tt=clock,
+            dt=clock,
+            Scheduler=partial(Scheduler, clock=clock.monotonic),
+            EssController=partial(EssController, clock=clock.monotonic),
+        ), mock.patch.object(writequeue, "monotonic", clock.monotonic), mock.patch.object(dbusmon, "DbusMonitor", FleetDbusMonitor), mock.patch.object(
+            dbusmon, "AsyncDbusMonitor", FleetDbusMonitor
+        ), mock.patch(
+            "dbus.SystemBus"
+        ), mock.patch(
+            "dbus.SessionBus"
+        ):
+            service = module.DbusAggBatService()
+            monitor = service._dbusMon.dbusmon
+            plant.populate(monitor)
+            if monitor.scanCompleteCallback is not None:
+                monitor.scanCompleteCallback(monitor)
+            for _ in range(600):
+                if service._started:
+                    break
+                timers.run(1000)
+            if not service._started:
+                raise RuntimeError("Discovery of the simulated devices did not finish")
+
+            def plant_step():
+                plant.step(monitor, service, clock.now(), step)
+                return True
+
+            timers.add_timer(stepMs, plant_step)
+            plant.take_energy()
+            for _ in range(days):
+                timers.run(86400 * 1000)
+                energy = plant.take_energy()
+                cells = [cell.voltage(0) for battery in plant.cells for cell in battery]
+                day = {
+                    "date": clock.now().strftime("%Y-%m-%d %H:%M"),
+                    "soc_true": round(plant.soc, 2),
+                    "soc_aggregate": service._dbusservice["/Soc"],
+                    "soc_bms": round(sum(100 * counter / plant.capacity for counter in plant.counters) / plant.nr_of_batteries, 2),
+                    "own_charge": round(service._ownCharge, 2),
+                    "charge_true": round(plant.charge, 2),
+                    "cvl": service._dbusservice["/Info/MaxChargeVoltage"],
+                    "balancing": service._balancing,
+                    "last_balancing": service._lastBalancing,
+                    "cell_diff": round(max(cells) - min(cells), 4),
+                    "energy_wh": {name: round(value, 0) for name, value in energy.items()},
+                }
+                results.append(day)
+                if report is not None:
+                    report(day)
+            service._scheduler.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulation of the service over days or months on a virtual clock")
+    parser.add_argument("--batteries", type=int, default=2, help="number of batteries, default: %(default)s")
+    parser.add_argument("--cells", type=int, default=16, help="cells per battery, default: %(default)s")
+    parser.add_argument("--mppts", type=int, default=1, help="number of MPPTs, default: %(default)s")
+    parser.add_argument("--capacity", type=float, default=280.0, help="capacity of a battery in Ah, default: %(default)s")
+    parser.add_argument("--soc", type=float, default=50.0, help="initial state of charge in %%, default: %(default)s")
+    parser.add_argument("--pv-peak", type=float, default=4000.0, help="peak PV power in W, default: %(default)s")
+    parser.add_argument("--start", default="2024-01-01", help="start date YYYY-MM-DD, default: %(default)s")
+    parser.add_argument("--days", type=int, default=30, help="simulated days, default: %(default)s")
+    parser.add_argument("--step", type=float, default=60.0, help="interval of the plant and the update tasks in s, default: %(default)s")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the plant, default: %(default)s")
+    parser.add_argument("--output", help="save the days as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the log of the service")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    module = load_service_module()
+    plant = Plant(args.batteries, args.cells, args.mppts, seed=args.seed, capacity=args.capacity, soc=args.soc / 100, pv_peak=args.pv_peak)
+
+    def report(day):
+        # the aggregate SoC is None while the service publishes none
+        socAggregate = "  ---" if day["soc_aggregate"] is None else "%5.1f" % day["soc_aggregate"]
+        print(
+            "%s  SoC true %5.1f%%  aggregate %s%%  BMS %5.1f%%  CVL %5.2fV  balancing %d (last day %3d)  cell diff %5.1fmV  import %5.0fWh  export %5.0fWh"
+            % (
+                day["date"],
+                day["soc_true"],
+                socAggregate,
+                day["soc_bms"],
+                day["cvl"] or 0,
+                day["balancing"],
+                day["last_balancing"],
+                day["cell_diff"] * 1000,
+                day["energy_wh"]["GridImport"],
+                day["energy_wh"]["GridExport"],
+            ),
+            file=sys.stderr,
+        )
+
+    days = run_simulation(module, plant, datetime.strptime(args.start, "%Y-%m-%d"), args.days, args.step, report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "days": days}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
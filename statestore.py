@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""
+Crash-safe store of the state kept across restarts (own charge, balancing, dynamic CVL).
+"""
+
+import json
+import logging
+import os
+from zlib import crc32
+
+
+class StateStore:
+    """
+    Journal of the state in an append-only file.
+
+    Each record is one line "<CRC32 of the JSON> <JSON of the complete state>". A record cut by a power
+    failure or a corrupted sector fails the CRC check and is skipped, the newest valid record wins.
+    Records are only appended by flush() and only if the state changed, which bounds the writes to the
+    SD card/eMMC to one per flush interval. After max_records records the journal is compacted into a new
+    file with one record, which replaces the old one atomically.
+    """
+
+    def __init__(self, path, defaults, max_records=256):
+        """
+        :param path: path of the journal file
+        :param defaults: dictionary with the initial state, used for the keys not found in the journal
+        :param max_records: number of records after which the journal is compacted
+        """
+        self.path = path
+        self.values = dict(defaults)
+        self.max_records = max_records
+        self._records = 0
+        self._dirty = False
+        # the file has invalid records, append after rewriting it only
+        self._compact = False
+
+    def load(self):
+        """
+        Read the newest valid record of the journal.
+
+        :return: True if a valid record was found
+        """
+        newest = None
+        self._records = 0
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        except OSError as err:
+            logging.error("State journal %s read error: %s" % (self.path, err))
+            self._compact = True
+            return False
+
+        for line in data.split(b"\n"):
+            if not line:
+                continue
+            try:
+                crc, payload = line.split(b" ", 1)
+                if int(crc, 16) != crc32(payload):
+                    raise ValueError("CRC mismatch")
+                values = json.loads(payload.decode())
+                if not isinstance(values, dict):
+                    raise ValueError("Record is not a dictionary")
+            except ValueError:
+                self._compact = True
+                continue
+            newest = values
+            self._records += 1
+
+        if data and not data.endswith(b"\n"):
+            self._compact = True
+        if self._compact:
+            logging.warning("State journal %s contains invalid records, they are dropped at the next save" % self.path)
+        if newest is None:
+            return False
+        self.values.update(newest)
+        self._dirty = False
+        return True
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def update(self, **values):
+        """
+        Change the state in memory, it is written by the next flush().
+        """
+        for key, value in values.items():
+            if self.values.get(key) != value:
+                self.values[key] = value
+                self._dirty = True
+
+    def _record(self):
+        payload = json.dumps(self.values, sort_keys=True, separators=(",", ":")).encode()
+        return b"%08x %s\n" % (crc32(payload), payload)
+
+    def flush(self):
+        """
+        Append the state to the journal, if it changed since the last flush.
+
+        :return: False if the journal could not be written
+        """
+        if not self._dirty and not self._compact:
+            return True
+        try:
+            if self._compact or self._records >= self.max_records:
+                self._rewrite()
+            else:
+                with open(self.path, "ab") as f:
+                    f.write(self._record())
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._records += 1
+        except OSError as err:
+            logging.error("State journal %s write error: %s" % (self.path, err))
+            return False
+        self._dirty = False
+        return True
+
+    def _rewrite(self):
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(self._record())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)
+        # make the rename durable
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self._records = 1
+        self._compact = False
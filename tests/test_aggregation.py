@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import sys
+import unittest
+from math import nan
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), ".."))
+import aggregation  # noqa: E402
+from aggregation import (  # noqa: E402
+    ALL_GROUPS,
+    BATTERY_TOTALS,
+    GROUP_ALARMS,
+    GROUP_CELLS,
+    GROUP_DC,
+    GROUP_LIMITS,
+    CellVoltageMatrix,
+    DirtyBatteries,
+    IncrementalAggregator,
+)
+
+
+def value(v):
+    # MonitoredValue of the DbusMonitor
+    return SimpleNamespace(value=v)
+
+
+def plan(service):
+    """
+    :return: read plan of a battery with all paths of BATTERY_TOTALS
+    """
+    paths = {path for paths, _ in BATTERY_TOTALS.values() for path in paths}
+    return SimpleNamespace(service=service, values={path: value(1.0) for path in paths})
+
+
+class IncrementalAggregatorTests(unittest.TestCase):
+    def setUp(self):
+        self.plans = {"Battery%d" % i: plan("com.victronenergy.battery.ttyUSB%d" % i) for i in range(4)}
+        for index, battery in enumerate(self.plans.values()):
+            battery.values["/Dc/0/Current"].value = 10.0 * index
+            battery.values["/InstalledCapacity"].value = 100.0 + index
+            battery.values["/Soc"].value = 50.0 + index
+        self.aggregator = IncrementalAggregator(self.plans)
+
+    def assertMatchesRebuild(self):
+        rebuilt = IncrementalAggregator(self.plans)
+        for name in BATTERY_TOTALS:
+            self.assertAlmostEqual(rebuilt.get(name), self.aggregator.get(name), msg=name)
+
+    def test_totals(self):
+        self.assertEqual(60.0, self.aggregator["Current"])
+        self.assertEqual(406.0, self.aggregator["InstalledCapacity"])
+        self.assertEqual(sum((50.0 + i) * (100.0 + i) for i in range(4)), self.aggregator["Soc"])
+
+    def test_update_matches_rebuild(self):
+        rng = random.Random(1)
+        paths = sorted({path for paths, _ in BATTERY_TOTALS.values() for path in paths})
+        for _ in range(500):
+            battery = rng.choice(list(self.plans.values()))
+            path = rng.choice(paths)
+            battery.values[path].value = round(rng.uniform(-100, 100), 2)
+            self.assertTrue(self.aggregator.update(battery.service, path))
+        self.assertMatchesRebuild()
+
+    def test_other_services_ignored(self):
+        self.assertFalse(self.aggregator.update("com.victronenergy.grid.cgwacs_ttyUSB0_mb1", "/Dc/0/Current"))
+        # paths of a battery not in a total still belong to an aggregated battery
+        self.assertTrue(self.aggregator.update("com.victronenergy.battery.ttyUSB0", "/Voltages/Cell1"))
+        self.assertEqual(60.0, self.aggregator["Current"])
+
+    def test_invalid_values(self):
+        battery = self.plans["Battery1"]
+        battery.values["/TimeToGo"].value = None
+        self.aggregator.update(battery.service, "/TimeToGo")
+        self.assertIsNone(self.aggregator.get("TimeToGo"))
+        with self.assertRaises(TypeError):
+            self.aggregator["TimeToGo"]
+        # the other terms are not affected
+        self.assertEqual(60.0, self.aggregator["Current"])
+
+        battery.values["/TimeToGo"].value = 3600
+        self.aggregator.update(battery.service, "/TimeToGo")
+        self.assertMatchesRebuild()
+        self.assertIsNotNone(self.aggregator.get("TimeToGo"))
+
+    def test_invalid_capacity_invalidates_weighted_terms(self):
+        battery = self.plans["Battery2"]
+        battery.values["/InstalledCapacity"].value = None
+        self.aggregator.update(battery.service, "/InstalledCapacity")
+        self.assertIsNone(self.aggregator.get("Soc"))
+        self.assertIsNone(self.aggregator.get("InstalledCapacity"))
+        battery.values["/InstalledCapacity"].value = 200.0
+        self.aggregator.update(battery.service, "/InstalledCapacity")
+        self.assertMatchesRebuild()
+
+    def test_missing_path(self):
+        del self.plans["Battery3"].values["/Capacity"]
+        self.aggregator.rebuild(self.plans)
+        self.assertIsNone(self.aggregator.get("Capacity"))
+        self.assertEqual(60.0, self.aggregator["Current"])
+
+    def test_rebuild_with_removed_battery(self):
+        removed = self.plans.pop("Battery3")
+        self.aggregator.rebuild(self.plans)
+        self.assertEqual(30.0, self.aggregator["Current"])
+        self.assertFalse(self.aggregator.update(removed.service, "/Dc/0/Current"))
+
+
+class DirtyBatteriesTests(unittest.TestCase):
+    def setUp(self):
+        self.dirty = DirtyBatteries()
+        self.dirty.track(["a", "b"])
+
+    def test_new_batteries_dirty(self):
+        self.assertEqual({"a": ALL_GROUPS, "b": ALL_GROUPS}, self.dirty.take())
+
+    def test_take_clears(self):
+        self.dirty.take()
+        self.dirty.mark("a", "/Voltages/Cell3")
+        self.dirty.mark("a", "/Alarms/LowSoc")
+        self.dirty.mark("b", "/Io/AllowToCharge")
+        self.dirty.mark("b", "/Soc")
+        self.assertEqual({"a": GROUP_CELLS | GROUP_ALARMS, "b": GROUP_LIMITS | GROUP_DC}, self.dirty.take())
+        self.assertEqual({"a": 0, "b": 0}, self.dirty.take())
+
+    def test_untracked_ignored(self):
+        self.dirty.take()
+        self.dirty.mark("c", "/Soc")
+        self.assertEqual({"a": 0, "b": 0}, self.dirty.take())
+
+    def test_track_keeps_masks(self):
+        self.dirty.take()
+        self.dirty.mark("a", "/Soc")
+        self.dirty.track(["a", "c"])
+        self.assertEqual({"a": GROUP_DC, "c": ALL_GROUPS}, self.dirty.take())
+
+    def test_mark_all(self):
+        self.dirty.take()
+        self.dirty.mark_all()
+        self.assertEqual({"a": ALL_GROUPS, "b": ALL_GROUPS}, self.dirty.take())
+
+
+class CellVoltageMatrixCases:
+    """
+    Test cases of the CellVoltageMatrix, run with and without NumPy.
+    """
+
+    numpy = None
+
+    def setUp(self):
+        patcher = mock.patch.object(aggregation, "numpy", self.numpy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.matrix = CellVoltageMatrix(["A", "B", "C"], 4)
+
+    def fill(self, row, *voltages):
+        self.matrix.fill(row, [value(v) for v in voltages])
+
+    def test_extremes(self):
+        self.fill(0, 3.30, 3.31, 3.29, 3.30)
+        self.fill(1, 3.35, 3.30, 3.30, 3.30)
+        self.fill(2, 3.30, 3.30, 3.30, 3.25)
+        self.assertEqual((1, 0, 3.35), self.matrix.max())
+        self.assertEqual((2, 3, 3.25), self.matrix.min())
+
+    def test_refill(self):
+        self.fill(0, 3.30, 3.31, 3.29, 3.30)
+        self.fill(1, 3.35, 3.30, 3.30, 3.30)
+        self.fill(2, 3.30, 3.30, 3.30, 3.25)
+        self.fill(1, 3.30, 3.30, 3.30, 3.30)
+        self.assertEqual((0, 1, 3.31), self.matrix.max())
+
+    def test_invalid_cells_ignored(self):
+        self.fill(0, None, 3.31, None, 3.30)
+        self.fill(1, None, None, None, None)
+        self.fill(2, 3.20, None, 3.40, None)
+        self.assertEqual((2, 2, 3.40), self.matrix.max())
+        self.assertEqual((2, 0, 3.20), self.matrix.min())
+        self.assertEqual([0, 0, 0], [round(v, 6) for v in self.matrix.overvoltage(3.45)])
+
+    def test_no_valid_cell(self):
+        # not filled yet
+        with self.assertRaises(TypeError):
+            self.matrix.max()
+        for row in range(3):
+            self.fill(row, None, None, None, None)
+        with self.assertRaises(TypeError):
+            self.matrix.min()
+
+    def test_overvoltage(self):
+        self.fill(0, 3.50, 3.40, 3.47, 3.45)
+        self.fill(1, 3.30, 3.30, 3.30, 3.30)
+        self.fill(2, nan, 3.46, None, 3.30)
+        self.assertEqual([0.07, 0.0, 0.01], [round(v, 6) for v in self.matrix.overvoltage(3.45)])
+
+    def test_no_batteries(self):
+        matrix = CellVoltageMatrix([], 4)
+        self.assertEqual([], matrix.overvoltage(3.45))
+        with self.assertRaises(TypeError):
+            matrix.max()
+
+
+@unittest.skipIf(aggregation.numpy is None, "NumPy is not installed")
+class CellVoltageMatrixNumpyTests(CellVoltageMatrixCases, unittest.TestCase):
+    numpy = aggregation.numpy
+
+
+class CellVoltageMatrixArrayTests(CellVoltageMatrixCases, unittest.TestCase):
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), ".."))
+from benchmark_ess import GRID_SERVICE, MULTI_SERVICE, SYSTEM_SERVICE, Site  # noqa: E402
+from ess import MAX_INTEGRATION_STEP, SMOOTH_FILTER_STEP, EssController, PiController  # noqa: E402
+
+
+class PiControllerTests(unittest.TestCase):
+    def setUp(self):
+        self.pi = PiController(0.5, 0.1, 100)
+
+    def test_output(self):
+        self.assertEqual(10, self.pi.output(20))
+        self.pi.integrate(20, 1)
+        self.assertAlmostEqual(12, self.pi.output(20))
+        # output() does not integrate
+        self.assertAlmostEqual(12, self.pi.output(20))
+
+    def test_output_clamped(self):
+        self.assertEqual(100, self.pi.output(1000))
+        self.assertEqual(-100, self.pi.output(-1000))
+
+    def test_no_windup_in_saturation(self):
+        # the proportional part alone saturates: the integral does not grow
+        for _ in range(100):
+            self.pi.integrate(1000, 1)
+        self.assertEqual(0, self.pi.integral)
+        self.assertEqual(100, self.pi.output(1000))
+
+    def test_integral_stops_at_limit(self):
+        for _ in range(1000):
+            self.pi.integrate(50, 1)
+        # integrates up to the saturation of the output, not further
+        self.assertAlmostEqual(75, self.pi.integral)
+        self.assertEqual(100, self.pi.output(50))
+        for _ in range(1000):
+            self.pi.integrate(150, 1)
+        self.assertAlmostEqual(75, self.pi.integral)
+
+    def test_unwinding_allowed(self):
+        self.pi.integral = 90
+        # deeper into the saturation: unchanged
+        self.pi.integrate(1000, 1)
+        self.assertEqual(90, self.pi.integral)
+        # back out of the saturation
+        self.pi.integrate(-300, 1)
+        self.assertAlmostEqual(60, self.pi.integral)
+
+    def test_reset(self):
+        self.pi.integrate(20, 10)
+        self.assertNotEqual(0, self.pi.integral)
+        self.pi.reset()
+        self.assertEqual(0, self.pi.integral)
+        self.assertEqual(10, self.pi.output(20))
+
+
+class EssControllerTests(unittest.TestCase):
+    aggregated = {
+        "Voltage": 53.0,
+        "Current": 10.0,
+        "Power": 530.0,
+        "Soc": 60.0,
+        "MpptCurrent": 5.0,
+        "MpptPower": 265.0,
+        "MaxChargeVoltage": 55.2,
+        "MaxChargeCurrent": 100.0,
+    }
+
+    def setUp(self):
+        self.now = 0.0
+        self.site = Site(50)
+        for path in ("/Devices/0/Ac/In/P", "/Devices/0/Ac/Out/P", "/Devices/0/Ac/Inverter/P"):
+            self.site.set_value(MULTI_SERVICE, path, 300.0)
+        for path in ("/Ac/Power", "/Ac/L1/Power", "/Ac/L2/Power", "/Ac/L3/Power"):
+            self.site.set_value(GRID_SERVICE, path, 100.0)
+        for phase in ("L1", "L2", "L3"):
+            self.site.set_value(SYSTEM_SERVICE, "/Ac/ConsumptionOnInput/%s/Power" % phase, 100.0)
+            self.site.set_value(SYSTEM_SERVICE, "/Ac/PvOnGrid/%s/Power" % phase, 0.0)
+        self.writeQueue = mock.Mock()
+        self.controller = EssController(self.site, self.writeQueue, 16, 0.3, 0.1, 1000, clock=lambda: self.now)
+        self.controller.active = 1
+        self.controller.multi = MULTI_SERVICE
+        self.controller.grid = GRID_SERVICE
+
+    def test_control_writes_setpoint(self):
+        bus = {}
+        self.controller.control(self.aggregated, bus)
+        self.writeQueue.set_value.assert_called_once_with(MULTI_SERVICE, "/Hub4/L1/AcPowerSetpoint", mock.ANY)
+        self.assertIn("/Ess/AcPowerSetpoint", bus)
+
+    def test_no_control_without_multi(self):
+        self.controller.multi = None
+        bus = {}
+        self.controller.control(self.aggregated, bus)
+        self.writeQueue.set_value.assert_not_called()
+        self.assertEqual({}, bus)
+
+    def test_no_control_without_grid_meter(self):
+        self.controller.grid = None
+        bus = {}
+        self.controller.control(self.aggregated, bus)
+        self.writeQueue.set_value.assert_not_called()
+        self.assertEqual({}, bus)
+        # the pause is not integrated when the grid meter is back
+        self.now += 3600
+        self.controller.grid = GRID_SERVICE
+        self.controller.control(self.aggregated, bus)
+        self.assertEqual(0, self.controller.batteryPi.integral)
+
+    def test_integration_step_limited(self):
+        self.controller.smoothFilter = 0
+        aggregated = dict(self.aggregated, MaxChargeCurrent=12.0)
+        self.controller.control(aggregated, {})
+        self.assertEqual(0, self.controller.batteryPi.integral)
+        self.now += 3600
+        self.controller.control(aggregated, {})
+        BatteryError = 12.0 * 53.0 - 530.0
+        self.assertAlmostEqual(0.1 * BatteryError * MAX_INTEGRATION_STEP, self.controller.batteryPi.integral)
+
+    def test_smoothing_independent_of_control_rate(self):
+        self.controller.smoothFilter = 250
+        results = []
+        for step in (SMOOTH_FILTER_STEP, 1.0, 0.05):
+            self.controller.maxChargeCurrentSm = 0
+            for _ in range(round(60 / step)):
+                self.controller._smooth(100.0, step)
+            results.append(self.controller.maxChargeCurrentSm)
+        # 240 steps of 0.25 s with a SmoothFilter of 250
+        self.assertAlmostEqual(100 * (1 - (250 / 251) ** 240), results[0])
+        for result in results[1:]:
+            self.assertAlmostEqual(results[0], result)
+
+    def test_smoothing_falls_immediately(self):
+        self.controller.maxChargeCurrentSm = 100
+        self.controller._smooth(20.0, SMOOTH_FILTER_STEP)
+        self.assertEqual(20, self.controller.maxChargeCurrentSm)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), ".."))
+import settings  # noqa: E402
+from functions import LimitCurve  # noqa: E402
+
+
+def interpolate(X, Y, x):
+    # Functions._interpolate before LimitCurve
+    if x <= X[0]:
+        return Y[0]
+    elif x >= X[len(X) - 1]:
+        return Y[len(X) - 1]
+    for i in range(len(X) - 1):
+        if x <= X[i + 1]:
+            return Y[i] + (Y[i + 1] - Y[i]) / (X[i + 1] - X[i]) * (x - X[i])
+
+
+# cell voltages from 2.5 V to 3.7 V in steps of 0.1 mV
+VOLTAGES = [2.5 + step * 0.0001 for step in range(12001)]
+
+CURVES = (
+    ("charge", settings.CELL_CHARGE_LIMITING_VOLTAGE, settings.CELL_CHARGE_LIMITED_CURRENT),
+    ("discharge", settings.CELL_DISCHARGE_LIMITING_VOLTAGE, settings.CELL_DISCHARGE_LIMITED_CURRENT),
+)
+
+
+class LimitCurveTests(unittest.TestCase):
+    def test_bisection(self):
+        for name, X, Y in CURVES:
+            curve = LimitCurve(X, Y)
+            for x in VOLTAGES:
+                self.assertAlmostEqual(interpolate(X, Y, x), curve(x), places=9, msg="%s curve at %.4f V" % (name, x))
+
+    def test_lookup_table(self):
+        for name, X, Y in CURVES:
+            curve = LimitCurve(X, Y, resolution=0.001)
+            # the table is exact on the mV raster, in between the value of the nearest mV is used
+            slope = max(abs(Y[i + 1] - Y[i]) / (X[i + 1] - X[i]) for i in range(len(X) - 1) if X[i + 1] > X[i])
+            for x in VOLTAGES:
+                self.assertAlmostEqual(interpolate(X, Y, x), curve(x), delta=slope * 0.0005 + 1e-9, msg="%s curve at %.4f V" % (name, x))
+            for millivolts in range(2500, 3701):
+                x = millivolts / 1000
+                self.assertAlmostEqual(interpolate(X, Y, x), curve(x), places=9, msg="%s curve at %.3f V" % (name, x))
+
+    def test_settings_curves(self):
+        charge = LimitCurve(*CURVES[0][1:], resolution=0.001)
+        discharge = LimitCurve(*CURVES[1][1:], resolution=0.001)
+        for x in VOLTAGES:
+            self.assertEqual(charge(x), settings.CELL_CHARGE_LIMITING_CURVE(x))
+            self.assertEqual(discharge(x), settings.CELL_DISCHARGE_LIMITING_CURVE(x))
+
+    def test_temperature_derating(self):
+        X, Y = CURVES[0][1:]
+        temperatures = [0, 5, 15, 40, 45]
+        factors = [0, 0.2, 1, 1, 0]
+        curve = LimitCurve(X, temperatures, [[current * factor for current in Y] for factor in factors])
+        # the bilinear interpolation of the product is the product of the interpolations
+        for x in VOLTAGES[::10]:
+            for temperature in range(-5, 51):
+                expected = interpolate(X, Y, x) * interpolate(temperatures, factors, temperature)
+                self.assertAlmostEqual(expected, curve(x, temperature), places=9)
+
+    def test_invalid_points(self):
+        with self.assertRaises(ValueError):
+            LimitCurve([3.0, 2.9], [1, 0])
+        with self.assertRaises(ValueError):
+            LimitCurve([2.9, 3.0, 3.1], [1, 0])
+        with self.assertRaises(ValueError):
+            LimitCurve([2.9], [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), ".."))
+
+try:
+    import dbus  # noqa: F401
+except ImportError:
+    dbus = None
+
+if dbus is not None:
+    from history import History, HistoryExport
+
+
+@unittest.skipIf(dbus is None, "needs dbus-python like the service")
+class HistoryTests(unittest.TestCase):
+    def setUp(self):
+        self.history = History(5, 1, channels=("Voltage", "Current"))
+
+    def record(self, now, voltage, current=0.0):
+        self.history.set("Voltage", voltage)
+        self.history.set("Current", current)
+        self.history.record(now)
+
+    def test_footprint(self):
+        # 6 rows: the samples and the one being set
+        self.assertEqual(3 * 6 * 8, self.history.footprint)
+
+    def test_empty(self):
+        self.assertEqual(([], []), self.history.get("Voltage", 0, 1))
+
+    def test_samples(self):
+        for now in range(3):
+            self.record(now, 50.0 + now, -now)
+        self.assertEqual(([0, 1, 2], [50.0, 51.0, 52.0]), self.history.get("Voltage", 0, 1))
+        self.assertEqual(([0, 1, 2], [0.0, -1.0, -2.0]), self.history.get("Current", 0, 1))
+
+    def test_wraparound(self):
+        for now in range(13):
+            self.record(now, float(now))
+        # the last 5 samples, oldest first
+        self.assertEqual(([8, 9, 10, 11, 12], [8.0, 9.0, 10.0, 11.0, 12.0]), self.history.get("Voltage", 0, 1))
+        self.assertEqual(([10, 11, 12], [10.0, 11.0, 12.0]), self.history.get("Voltage", 10, 1))
+        # the intervals start at since
+        self.assertEqual(([11.5], [12.0]), self.history.get("Voltage", 11.5, 1))
+        self.assertEqual(([], []), self.history.get("Voltage", 13, 1))
+
+    def test_averages(self):
+        for now in range(13):
+            self.record(now, float(now))
+        # intervals start at since: [8, 10), [10, 12), [12, 14)
+        self.assertEqual(([8, 10, 12], [8.5, 10.5, 12.0]), self.history.get("Voltage", 8, 2))
+        # a step below the period returns the samples
+        self.assertEqual(([11, 12], [11.0, 12.0]), self.history.get("Voltage", 11, 0.1))
+
+    def test_invalid_values_skipped(self):
+        self.record(0, 50.0)
+        self.record(1, None)
+        self.record(2, 52.0)
+        self.assertEqual(([0, 2], [50.0, 52.0]), self.history.get("Voltage", 0, 1))
+        self.assertEqual(([0], [51.0]), self.history.get("Voltage", 0, 3))
+
+    def test_channel_not_set(self):
+        self.record(0, 50.0, 1.0)
+        self.history.set("Voltage", 51.0)
+        self.history.record(1)
+        self.assertEqual(([0], [1.0]), self.history.get("Current", 0, 1))
+
+    def test_value_set_before_record_not_read(self):
+        for now in range(5):
+            self.record(now, float(now))
+        self.history.set("Voltage", 99.0)
+        self.assertEqual(([0, 1, 2, 3, 4], [0.0, 1.0, 2.0, 3.0, 4.0]), self.history.get("Voltage", 0, 1))
+
+    def test_unknown_channel(self):
+        with self.assertRaises(KeyError):
+            self.history.get("Soc", 0, 1)
+
+    def test_due(self):
+        self.history = History(5, 10, channels=("Voltage",))
+        self.assertTrue(self.history.due(100))
+        self.history.record(100)
+        self.assertFalse(self.history.due(109))
+        self.assertTrue(self.history.due(110))
+        # the raster is kept if a sample is late
+        self.history.record(112)
+        self.assertTrue(self.history.due(120))
+        # but not caught up after a pause
+        self.history.record(200)
+        self.assertFalse(self.history.due(209))
+
+
+@unittest.skipIf(dbus is None, "needs dbus-python like the service")
+class HistoryExportTests(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        # the system time is 1.7e9 s ahead of the monotonic clock
+        self.offset = 1.7e9
+        self.history = History(100, 1, channels=("Voltage",))
+        for now in range(900, 1000):
+            self.history.set("Voltage", float(now))
+            self.history.record(now)
+        self.export = HistoryExport(None, self.history, clock=lambda: self.now, wallClock=lambda: self.now + self.offset, objectPath=None)
+
+    def test_channels(self):
+        self.assertEqual(["Voltage"], self.export.GetChannels())
+
+    def test_relative_since(self):
+        times, values = self.export.GetHistory("Voltage", -10, 5)
+        self.assertEqual([990 + self.offset, 995 + self.offset], list(times))
+        self.assertEqual([992.0, 997.0], list(values))
+
+    def test_system_time_since(self):
+        times, values = self.export.GetHistory("Voltage", 997 + self.offset, 1)
+        self.assertEqual([997 + self.offset, 998 + self.offset, 999 + self.offset], list(times))
+        self.assertEqual([997.0, 998.0, 999.0], list(values))
+
+    def test_system_time_step(self):
+        # a step of the system time moves the stamps on DBus, not the order of the samples
+        self.offset += 3600
+        times, values = self.export.GetHistory("Voltage", -2, 1)
+        self.assertEqual([998 + self.offset, 999 + self.offset], list(times))
+        self.assertEqual([998.0, 999.0], list(values))
+
+    def test_unknown_channel(self):
+        with self.assertRaises(dbus.exceptions.DBusException):
+            self.export.GetHistory("Soc", -10, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), ".."))
+from scheduler import Scheduler  # noqa: E402
+
+
+class FakeMainLoop:
+    """
+    Clock and one-shot timers, the time only advances by advance() and the runs of the tasks.
+    """
+
+    def __init__(self):
+        self.now = 100.0
+        self.timers = []
+
+    def clock(self):
+        return self.now
+
+    def timeout_add(self, ms, callback):
+        self.timers.append((ms, callback))
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def fire(self):
+        # run the only armed timer after its delay
+        assert len(self.timers) == 1, self.timers
+        ms, callback = self.timers.pop()
+        self.now += ms / 1000
+        return callback()
+
+
+class SchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.loop = FakeMainLoop()
+        self.scheduler = Scheduler(self.loop.timeout_add, clock=self.loop.clock)
+        self.runs = []
+
+    def add(self, name, period, duration=0):
+        def run():
+            self.runs.append((name, round(self.loop.now, 3)))
+            self.loop.advance(duration)
+
+        return self.scheduler.add(name, period, run)
+
+    def test_periods(self):
+        self.add("Fast", 1000)
+        self.add("Slow", 3000)
+        self.scheduler.start()
+        self.assertEqual([(0, self.scheduler._tick)], self.loop.timers)
+        for _ in range(4):
+            self.assertFalse(self.loop.fire())
+        self.assertEqual([("Fast", 100), ("Slow", 100), ("Fast", 101), ("Fast", 102), ("Fast", 103), ("Slow", 103)], self.runs)
+        # armed for the next deadline, no drift
+        self.assertEqual([(1000, self.scheduler._tick)], self.loop.timers)
+
+    def test_skip_when_late(self):
+        task = self.add("Fast", 1000)
+        self.scheduler.start()
+        self.loop.fire()
+        # the main loop was blocked for 3.5 periods, the task runs once and skips the missed deadlines
+        self.loop.advance(3.5)
+        self.loop.fire()
+        self.assertEqual([("Fast", 100), ("Fast", 104.5)], self.runs)
+        self.assertEqual(3, task.skipped)
+        self.assertEqual(2, task.runs)
+        self.assertAlmostEqual(3500, task.lateness)
+        self.assertAlmostEqual(3500, task.maxLateness)
+        # back on the raster of the first deadline
+        self.assertEqual([(500, self.scheduler._tick)], self.loop.timers)
+        self.loop.fire()
+        self.assertEqual(("Fast", 105), self.runs[-1])
+        self.assertEqual(3, task.skipped)
+
+    def test_overrun(self):
+        task = self.add("Slow", 1000, duration=1.2)
+        self.scheduler.start()
+        self.loop.fire()
+        self.assertEqual(1, task.overruns)
+        # the next deadline has passed, the timer fires immediately
+        self.assertEqual([(0, self.scheduler._tick)], self.loop.timers)
+
+    def test_rearm_after_exception(self):
+        def fail():
+            raise RuntimeError("Task failed")
+
+        self.scheduler.add("Failing", 1000, fail)
+        self.add("Fast", 500)
+        self.scheduler.start()
+        with self.assertRaises(RuntimeError):
+            self.loop.fire()
+        # the timer is armed even though the tick raised, so the other tasks keep running
+        self.assertEqual([(0, self.scheduler._tick)], self.loop.timers)
+        self.loop.fire()
+        self.assertEqual([(500, self.scheduler._tick)], self.loop.timers)
+        self.loop.fire()
+        self.assertEqual([("Fast", 100), ("Fast", 100.5)], self.runs)
+
+    def test_stop(self):
+        self.add("Fast", 1000)
+        self.scheduler.start()
+        self.loop.fire()
+        self.scheduler.stop()
+        self.assertFalse(self.loop.fire())
+        self.assertEqual([], self.loop.timers)
+        self.assertEqual(1, len(self.runs))
+
+    def test_add_when_started(self):
+        self.add("Fast", 1000)
+        self.scheduler.start()
+        self.loop.fire()
+        # runs at the next tick
+        self.add("Late", 1000)
+        self.loop.fire()
+        self.assertEqual([("Fast", 100), ("Fast", 101), ("Late", 101)], self.runs)
+
+
+if __name__ == "__main__":
+    unittest.main()
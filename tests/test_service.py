@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+import contextlib
+import copy
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from functools import partial
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), ".."))
+import settings  # noqa: E402
+
+try:
+    import dbus  # noqa: F401
+except ImportError:
+    dbus = None
+
+if dbus is not None:
+    import dbusmon
+    import topology
+    from benchmark import GRID_SERVICE, MULTI_SERVICE, Fleet, FleetDbusMonitor, StubSettingsDevice, StubVeDbusService, load_service_module
+    from mock_gobject import MockTimerManager
+    from statestore import StateStore
+
+
+@unittest.skipIf(dbus is None, "needs dbus-python like the service")
+class ServiceTestCase(unittest.TestCase):
+    """
+    DbusAggBatService against a FleetDbusMonitor like in the benchmark, the timers run on a MockTimerManager.
+    """
+
+    overrides = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.module = load_service_module()
+        # the service logs with the level of config.ini
+        logging.getLogger().setLevel(logging.WARNING)
+
+    def start(self, fleet, charge=None, data=None, **overrides):
+        """
+        :param charge: own charge in the state journal, None to start from the SoC of the batteries
+        :param data: directory of the journals, e.g. of the previous start, None for a new one
+        :return: the service, after the discovery started the update loop
+        """
+        self.fleet = fleet
+        settingsOverrides = {
+            "NR_OF_BATTERIES": fleet.nr_of_batteries,
+            "NR_OF_CELLS_PER_BATTERY": fleet.nr_of_cells,
+            "NR_OF_MPPTS": fleet.nr_of_mppts,
+            "CURRENT_FROM_VICTRON": True,
+            "USE_SMARTSHUNTS": False,
+            "SEND_CELL_VOLTAGES": 0,
+            "EVENT_DRIVEN_UPDATE": False,
+            "UPDATE_INTERVAL_FIND_DEVICES": 1,
+            "SEARCH_TRIALS": 2,
+            "LOG_PERIOD": 0,
+            "HISTORY_LENGTH": 0,
+        }
+        settingsOverrides.update(self.overrides)
+        settingsOverrides.update(overrides)
+        self.timers = MockTimerManager()
+        glib = SimpleNamespace(
+            timeout_add=self.timers.add_timer,
+            timeout_add_seconds=lambda timeout, callback, *args, **kwargs: self.timers.add_timer(timeout * 1000, callback, *args, **kwargs),
+            # MockTimerManager.add_idle fires at twice the current time
+            idle_add=partial(self.timers.add_timer, 0),
+            source_remove=self.timers.remove_resouce,
+        )
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        self.data = data if data is not None else stack.enter_context(tempfile.TemporaryDirectory())
+        if charge is not None:
+            state = StateStore(os.path.join(self.data, "state.journal"), {})
+            state.update(Charge=charge, LastBalancing=1)
+            state.flush()
+        stack.enter_context(mock.patch.multiple(settings, **settingsOverrides))
+        stack.enter_context(
+            mock.patch.multiple(
+                self.module,
+                GLib=glib,
+                VeDbusService=StubVeDbusService,
+                SettingsDevice=StubSettingsDevice,
+                get_bus=mock.Mock,
+                DATA_PATH=self.data + os.sep,
+                HistoryExport=mock.Mock(),
+            )
+        )
+        stack.enter_context(mock.patch.object(dbusmon, "DbusMonitor", FleetDbusMonitor))
+        stack.enter_context(mock.patch.object(dbusmon, "AsyncDbusMonitor", FleetDbusMonitor))
+        stack.enter_context(mock.patch("dbus.SystemBus"))
+        stack.enter_context(mock.patch("dbus.SessionBus"))
+
+        self.service = self.module.DbusAggBatService()
+        stack.callback(self.service._scheduler.stop)
+        self.monitor = self.service._dbusMon.dbusmon
+        fleet.populate(self.monitor)
+        if self.monitor.scanCompleteCallback is not None:
+            self.monitor.scanCompleteCallback(self.monitor)
+        for _ in range(60):
+            if self.service._started:
+                break
+            self.timers.run(1000)
+        self.assertTrue(self.service._started, "Discovery did not finish")
+        return self.service
+
+    def published(self, path):
+        return self.service._dbusservice[path]
+
+    def set_cells(self, voltage):
+        for service in self.fleet.batteries:
+            if service in self.monitor.servicesByName:
+                for cellId in range(1, self.fleet.nr_of_cells + 1):
+                    self.monitor.set_value(service, "/Voltages/Cell%d" % cellId, voltage)
+
+    def aggregate(self):
+        """
+        Run the aggregation once, like the scheduler or a value change does.
+        """
+        self.service._update()
+
+
+class PartialFleetTests(ServiceTestCase):
+    overrides = {"OWN_CHARGE_PARAMETERS": True, "OWN_SOC": True, "ZERO_SOC": False, "MAX_CHARGE_CURRENT": 200, "MAX_DISCHARGE_CURRENT": 300}
+
+    def test_limits_scaled_to_present_batteries(self):
+        self.start(Fleet(2, 4, 1), charge=280.0)
+        self.set_cells(3.25)
+        self.aggregate()
+        self.assertAlmostEqual(200, self.published("/Info/MaxChargeCurrent"))
+        self.assertAlmostEqual(300, self.published("/Info/MaxDischargeCurrent"))
+
+        with self.assertLogs(level="WARNING"):
+            self.monitor.remove_service(self.fleet.batteries[1])
+        self.aggregate()
+        self.assertAlmostEqual(100, self.published("/Info/MaxChargeCurrent"))
+        self.assertAlmostEqual(150, self.published("/Info/MaxDischargeCurrent"))
+
+        self.monitor.add_service(self.fleet.batteries[1], self.fleet.battery_values(1))
+        self.set_cells(3.25)
+        self.aggregate()
+        self.assertAlmostEqual(200, self.published("/Info/MaxChargeCurrent"))
+
+    def test_own_charge_kept_while_battery_missing(self):
+        self.start(Fleet(2, 4, 1), charge=280.0)
+        self.set_cells(3.25)
+        self.aggregate()
+        charge = self.service._ownCharge
+        with self.assertLogs(level="WARNING"):
+            self.monitor.remove_service(self.fleet.batteries[1])
+        # the current into the present battery does not change the charge of the complete fleet
+        self.service._timeOld -= 3600
+        self.aggregate()
+        self.assertEqual(charge, self.service._ownCharge)
+        # the SoC relates to the capacity of the complete fleet, not to the present battery
+        self.assertAlmostEqual(50.0, self.published("/Soc"), places=3)
+
+        self.monitor.add_service(self.fleet.batteries[1], self.fleet.battery_values(1))
+        self.set_cells(3.25)
+        self.service._timeOld -= 3600
+        self.aggregate()
+        self.assertGreater(self.service._ownCharge, charge + 1)
+
+    def test_no_battery_beyond_configured_number(self):
+        self.start(Fleet(2, 4, 1), charge=280.0)
+        values = self.fleet.battery_values(2)
+        with self.assertLogs(level="WARNING") as logs:
+            self.monitor.add_service("com.victronenergy.battery.ttyUSB9", values)
+        self.assertIn("not added", logs.output[0])
+        self.assertEqual(2, len(self.service._battery_plans))
+
+
+class EventDrivenTests(ServiceTestCase):
+    overrides = {"EVENT_DRIVEN_UPDATE": True, "ESS_ON_GRID_CHANGE": True}
+
+    def scheduled(self, service, path, value):
+        """
+        :return: True if the value change scheduled an update
+        """
+        self.timers.run(0)
+        self.assertFalse(self.service._updateScheduled)
+        self.monitor.set_value(service, path, value)
+        return self.service._updateScheduled
+
+    def test_update_triggers(self):
+        self.start(Fleet(2, 4, 1))
+        battery = self.fleet.batteries[0]
+        self.assertTrue(self.scheduled(battery, "/Voltages/Cell1", 3.31))
+        self.assertTrue(self.scheduled(battery, "/Dc/0/Current", 12.0))
+        self.assertTrue(self.scheduled(MULTI_SERVICE, "/Dc/0/Current", 12.0))
+        self.assertTrue(self.scheduled(self.fleet.mppts[0], "/Dc/0/Current", 7.0))
+        # the grid meter and the AC paths are for the ESS control, the others are read by the heartbeat
+        self.assertFalse(self.scheduled(GRID_SERVICE, "/Ac/Power", 123.0))
+        self.assertFalse(self.scheduled(MULTI_SERVICE, "/Devices/0/Ac/Out/P", 400.0))
+        self.assertFalse(self.scheduled("com.victronenergy.system", "/Ac/PvOnGrid/L1/Power", 50.0))
+        self.assertFalse(self.scheduled("com.victronenergy.settings", "/Settings/CGwacs/AcPowerSetPoint", 10))
+
+    def test_grid_triggers_update_without_ess_signal(self):
+        self.start(Fleet(1, 4, 1), ESS_ON_GRID_CHANGE=False)
+        self.assertTrue(self.scheduled(GRID_SERVICE, "/Ac/Power", 123.0))
+        self.assertTrue(self.scheduled(MULTI_SERVICE, "/Devices/0/Ac/Out/P", 400.0))
+        self.assertFalse(self.scheduled("com.victronenergy.system", "/Ac/PvOnGrid/L1/Power", 50.0))
+
+
+class HistoryTests(ServiceTestCase):
+    overrides = {"HISTORY_LENGTH": 10, "HISTORY_PERIOD": 1}
+
+    def test_aggregated_values_recorded(self):
+        self.start(Fleet(2, 4, 1))
+        self.set_cells(3.25)
+        self.aggregate()
+        times, voltages = self.service._history.get("MaxCellVoltage", 0, 1)
+        self.assertEqual([3.25], voltages)
+        self.assertEqual(self.published("/Dc/0/Voltage"), self.service._history.get("Voltage", 0, 1)[1][-1])
+
+
+class TopologyCacheTests(ServiceTestCase):
+    overrides = {"TOPOLOGY_CACHE": True}
+
+    def restart(self, **overrides):
+        """
+        :return: log messages of the start with the journals of the previous start
+        """
+        with self.assertLogs(level="INFO") as logs:
+            self.start(Fleet(2, 4, 1), data=self.data, **overrides)
+        return "\n".join(logs.output)
+
+    def cache(self):
+        cache = topology.TopologyCache(os.path.join(self.data, "topology.journal"), self.service._topology_fingerprint())
+        cache.load()
+        return cache
+
+    def edit_cache(self, edit):
+        cache = self.cache()
+        # a new dictionary, the StateStore only writes changed values
+        cached = copy.deepcopy(cache.topology)
+        edit(cached)
+        cache.save(cached)
+
+    def assertFullScan(self, logs):
+        self.assertNotIn("Started with the cached topology", logs)
+        self.assertIn("Searching devices", logs)
+        self.assertEqual(self.fleet.batteries, sorted(self.service._batteries_dict.values()))
+        # replaced by the topology of the complete discovery
+        self.assertEqual(1, self.cache().topology["Batteries"][0]["Instance"])
+
+    def test_warm_start(self):
+        self.start(Fleet(2, 4, 1))
+        self.assertIsNotNone(self.cache().topology)
+        logs = self.restart()
+        self.assertIn("Started with the cached topology", logs)
+        self.assertNotIn("Searching devices", logs)
+        self.assertEqual(self.fleet.batteries, sorted(self.service._batteries_dict.values()))
+
+    def test_fingerprint_mismatch(self):
+        self.start(Fleet(2, 4, 1))
+        logs = self.restart(SMARTSHUNT_NAME_KEYWORD="Shunt")
+        self.assertFullScan(logs)
+
+    def test_device_instance_mismatch(self):
+        self.start(Fleet(2, 4, 1))
+        self.edit_cache(lambda cached: cached["Batteries"][0].update(Instance=9))
+        logs = self.restart()
+        self.assertIn("Cached topology does not match", logs)
+        self.assertFullScan(logs)
+
+    def test_missing_device(self):
+        self.start(Fleet(2, 4, 1))
+        self.edit_cache(lambda cached: cached["Mppts"].append({"Service": "com.victronenergy.solarcharger.ttyUSB7", "Instance": None}))
+        logs = self.restart()
+        self.assertIn("Device(s) of the cached topology not found", logs)
+        self.assertFullScan(logs)
+
+    def test_corrupt_cache(self):
+        self.start(Fleet(2, 4, 1))
+        with open(os.path.join(self.data, "topology.journal"), "wb") as f:
+            f.write(b"0badc0de {}\n\x00\x00\x00")
+        logs = self.restart()
+        self.assertFullScan(logs)
+
+    def test_partial_cache(self):
+        self.start(Fleet(2, 4, 1))
+        self.edit_cache(lambda cached: cached.pop("Mppts"))
+        logs = self.restart()
+        self.assertIn("incomplete", logs)
+        self.assertFullScan(logs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from zlib import crc32
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), ".."))
+from statestore import StateStore  # noqa: E402
+
+
+class StateStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "state.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def store(self, max_records=256):
+        return StateStore(self.path, {"Charge": 0, "Balancing": 0}, max_records=max_records)
+
+    def lines(self):
+        with open(self.path, "rb") as f:
+            return f.read().splitlines(keepends=True)
+
+    def write_records(self, *charges):
+        store = self.store()
+        store.load()
+        for charge in charges:
+            store.update(Charge=charge)
+            store.flush()
+
+    def test_missing_journal(self):
+        store = self.store()
+        self.assertFalse(store.load())
+        self.assertEqual({"Charge": 0, "Balancing": 0}, store.values)
+
+    def test_newest_record_wins(self):
+        self.write_records(10, 20, 30)
+        self.assertEqual(3, len(self.lines()))
+        store = self.store()
+        self.assertTrue(store.load())
+        self.assertEqual(30, store["Charge"])
+        self.assertEqual(0, store["Balancing"])
+
+    def test_flush_only_when_changed(self):
+        self.write_records(10, 10, 10)
+        self.assertEqual(1, len(self.lines()))
+
+    def test_truncated_last_record(self):
+        self.write_records(10, 20, 30)
+        with open(self.path, "rb+") as f:
+            f.truncate(os.path.getsize(self.path) - 5)
+        store = self.store()
+        self.assertTrue(store.load())
+        self.assertEqual(20, store["Charge"])
+
+    def test_corrupted_last_record(self):
+        self.write_records(10, 20, 30)
+        lines = self.lines()
+        lines[-1] = lines[-1].replace(b":30", b":31")
+        with open(self.path, "wb") as f:
+            f.write(b"".join(lines))
+        store = self.store()
+        self.assertTrue(store.load())
+        self.assertEqual(20, store["Charge"])
+
+    def test_record_not_a_dictionary(self):
+        self.write_records(10)
+        with open(self.path, "ab") as f:
+            f.write(b"%08x %s\n" % (crc32(b"[1,2]"), b"[1,2]"))
+        store = self.store()
+        self.assertTrue(store.load())
+        self.assertEqual(10, store["Charge"])
+
+    def test_invalid_records_rewritten(self):
+        self.write_records(10, 20)
+        with open(self.path, "ab") as f:
+            f.write(b"garbage\n0000")
+        store = self.store()
+        self.assertTrue(store.load())
+        # nothing changed, but the invalid records are dropped at the next flush
+        self.assertTrue(store.flush())
+        self.assertEqual(1, len(self.lines()))
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        store = self.store()
+        self.assertTrue(store.load())
+        self.assertEqual(20, store["Charge"])
+
+    def test_compaction(self):
+        store = self.store(max_records=3)
+        store.load()
+        for charge in range(1, 4):
+            store.update(Charge=charge)
+            store.flush()
+        self.assertEqual(3, len(self.lines()))
+        store.update(Charge=4)
+        store.flush()
+        self.assertEqual(1, len(self.lines()))
+        store.update(Charge=5)
+        store.flush()
+        self.assertEqual(2, len(self.lines()))
+        store = self.store(max_records=3)
+        self.assertTrue(store.load())
+        self.assertEqual(5, store["Charge"])
+
+    def test_write_error(self):
+        store = StateStore(os.path.join(self.directory, "missing", "state.journal"), {"Charge": 0})
+        store.update(Charge=1)
+        with self.assertLogs(level="ERROR"):
+            self.assertFalse(store.flush())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from zlib import crc32
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), ".."))
+from topology import TopologyCache, device  # noqa: E402
+
+BATTERIES = ["com.victronenergy.battery.ttyUSB0", "com.victronenergy.battery.ttyUSB1"]
+SHUNT = "com.victronenergy.battery.ttyS5"
+MULTI = "com.victronenergy.vebus.ttyS4"
+MPPT = "com.victronenergy.solarcharger.ttyUSB2"
+SETTINGS = "com.victronenergy.settings"
+
+
+class FakeDbusMonitor:
+    """
+    Device instances of the scanned services, like the servicesByName table of the DbusMonitor.
+    """
+
+    def __init__(self, instances):
+        self.servicesByName = {service: SimpleNamespace(deviceInstance=instance) for service, instance in instances.items()}
+
+    def get_device_instance(self, serviceName):
+        return self.servicesByName[serviceName].deviceInstance
+
+
+def checks(service):
+    # product and custom name of a battery or SmartShunt
+    return ["SerialBattery", service[-4:]]
+
+
+class TopologyCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "topology.journal")
+        self.monitor = FakeDbusMonitor({SETTINGS: 0, BATTERIES[0]: 1, BATTERIES[1]: 2, SHUNT: 277, MULTI: 276, MPPT: 278})
+        self.topology = {
+            "Settings": device(self.monitor, SETTINGS),
+            "Batteries": [dict(device(self.monitor, service), Name="Battery%d" % index, Checks=checks(service)) for index, service in enumerate(BATTERIES)],
+            "SmartShunts": [dict(device(self.monitor, SHUNT), Checks=checks(SHUNT))],
+            "NumBatteryShunts": 0,
+            "Multi": device(self.monitor, MULTI),
+            "Mppts": [device(self.monitor, MPPT)],
+            "Grid": None,
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def cache(self, fingerprint="A"):
+        return TopologyCache(self.path, fingerprint)
+
+    def write_record(self, values):
+        payload = json.dumps(values).encode()
+        with open(self.path, "ab") as f:
+            f.write(b"%08x %s\n" % (crc32(payload), payload))
+
+    def test_no_file(self):
+        self.assertIsNone(self.cache().load())
+
+    def test_save_load(self):
+        self.cache().save(self.topology)
+        cache = self.cache()
+        self.assertEqual(self.topology, cache.load())
+        self.assertEqual(self.topology, cache.topology)
+
+    def test_newest_topology(self):
+        self.cache().save(self.topology)
+        self.topology["Mppts"] = []
+        self.cache().save(self.topology)
+        self.assertEqual([], self.cache().load()["Mppts"])
+
+    def test_fingerprint_mismatch(self):
+        self.cache("A").save(self.topology)
+        cache = self.cache("B")
+        self.assertIsNone(cache.load())
+        self.assertIsNone(cache.topology)
+        # the next complete discovery replaces it
+        cache.save(self.topology)
+        self.assertEqual(self.topology, self.cache("B").load())
+        self.assertIsNone(self.cache("A").load())
+
+    def test_corrupt_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\x00\xff garbage\n{not json}\n")
+        with self.assertLogs(level="WARNING"):
+            self.assertIsNone(self.cache().load())
+
+    def test_truncated_record(self):
+        self.cache().save(self.topology)
+        self.topology["Mppts"] = []
+        self.cache().save(self.topology)
+        with open(self.path, "rb+") as f:
+            f.truncate(os.path.getsize(self.path) - 20)
+        with self.assertLogs(level="WARNING"):
+            topology = self.cache().load()
+        # the record before the cut one
+        self.assertEqual([device(self.monitor, MPPT)], topology["Mppts"])
+
+    def test_partial_topology(self):
+        del self.topology["Mppts"]
+        self.write_record({"Fingerprint": "A", "Topology": self.topology})
+        with self.assertLogs(level="WARNING") as logs:
+            self.assertIsNone(self.cache().load())
+        self.assertIn("incomplete", logs.output[0])
+
+    def test_invalid_entries(self):
+        for topology in (
+            None,
+            ["Settings"],
+            dict(self.topology, Batteries={"Battery0": BATTERIES[0]}),
+            dict(self.topology, Batteries=[{"Service": BATTERIES[0], "Instance": 1}]),
+            dict(self.topology, Mppts=[MPPT]),
+            dict(self.topology, Multi={"Service": MULTI}),
+        ):
+            with self.subTest(topology=topology):
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                self.write_record({"Fingerprint": "A", "Topology": topology})
+                with self.assertLogs(level="WARNING"):
+                    self.assertIsNone(self.cache().load())
+
+    def test_pending(self):
+        self.cache().save(self.topology)
+        cache = self.cache()
+        cache.load()
+        self.assertFalse(cache.pending(self.monitor))
+        del self.monitor.servicesByName[MPPT]
+        self.assertTrue(cache.pending(self.monitor))
+
+    def test_match(self):
+        self.cache().save(self.topology)
+        cache = self.cache()
+        cache.load()
+        self.assertIsNone(cache.mismatch(self.monitor, checks))
+
+    def test_device_instance_mismatch(self):
+        self.cache().save(self.topology)
+        cache = self.cache()
+        cache.load()
+        self.monitor.servicesByName[BATTERIES[1]].deviceInstance = 5
+        self.assertIn("device instance 5 instead of 2", cache.mismatch(self.monitor, checks))
+
+    def test_checks_mismatch(self):
+        self.cache().save(self.topology)
+        cache = self.cache()
+        cache.load()
+        self.assertIn("not the same device", cache.mismatch(self.monitor, lambda service: ["Other", service[-4:]]))
+
+    def test_discard(self):
+        self.cache().save(self.topology)
+        cache = self.cache()
+        cache.load()
+        cache.discard()
+        self.assertIsNone(cache.topology)
+        # the file is kept until the next complete discovery
+        self.assertEqual(self.topology, self.cache().load())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), ".."))
+from writequeue import WriteQueue  # noqa: E402
+
+SERVICE = "com.victronenergy.vebus.ttyS3"
+
+
+class FakeDbusMonitor:
+    """
+    DbusMonitor with the replies of set_value_async held back until reply() or fail() is called.
+    """
+
+    def __init__(self, paths):
+        self.servicesByName = {SERVICE: SimpleNamespace(paths=dict.fromkeys(paths))}
+        self.values = {}
+        self.calls = []
+
+    def get_value(self, service, path):
+        return self.values.get((service, path))
+
+    def set_value_async(self, service, path, value, reply_handler, error_handler):
+        self.calls.append((path, value, reply_handler, error_handler))
+
+    def sent(self):
+        return [(path, value) for path, value, _, _ in self.calls]
+
+    def reply(self, index=0):
+        path, value, reply_handler, _ = self.calls.pop(index)
+        self.values[(SERVICE, path)] = value
+        reply_handler()
+
+    def fail(self, index=0):
+        _, _, _, error_handler = self.calls.pop(index)
+        error_handler(Exception("No reply"))
+
+
+class WriteQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.monitor = FakeDbusMonitor(("/A", "/B", "/C"))
+        self.queue = WriteQueue(self.monitor, max_in_flight=2, refresh=10)
+
+    def test_coalesce(self):
+        self.queue.set_value(SERVICE, "/A", 1)
+        # /A is in flight, only the latest of the next values is sent after the reply
+        self.queue.set_value(SERVICE, "/A", 2)
+        self.queue.set_value(SERVICE, "/A", 3)
+        self.assertEqual([("/A", 1)], self.monitor.sent())
+        self.assertEqual(1, self.queue.counters["Coalesced"])
+        self.monitor.reply()
+        self.assertEqual([("/A", 3)], self.monitor.sent())
+        self.monitor.reply()
+        self.assertEqual(2, self.queue.counters["Sent"])
+        self.assertEqual(0, self.queue.pending)
+
+    def test_coalesce_to_value_in_flight(self):
+        self.queue.set_value(SERVICE, "/A", 1)
+        self.queue.set_value(SERVICE, "/A", 2)
+        self.queue.set_value(SERVICE, "/A", 1)
+        self.monitor.reply()
+        self.assertEqual([], self.monitor.sent())
+        self.assertEqual(0, self.queue.pending)
+
+    def test_skip_unchanged(self):
+        self.queue.set_value(SERVICE, "/A", 1)
+        # equal to the value in flight
+        self.queue.set_value(SERVICE, "/A", 1)
+        self.monitor.reply()
+        # equal to the value written and still reported by the service
+        self.queue.set_value(SERVICE, "/A", 1)
+        self.assertEqual(2, self.queue.counters["Skipped"])
+        self.assertEqual(1, self.queue.counters["Sent"])
+
+    def test_write_again_if_changed_by_others(self):
+        self.queue.set_value(SERVICE, "/A", 1)
+        self.monitor.reply()
+        self.monitor.values[(SERVICE, "/A")] = 5
+        self.queue.set_value(SERVICE, "/A", 1)
+        self.assertEqual([("/A", 1)], self.monitor.sent())
+
+    def test_refresh(self):
+        with mock.patch("writequeue.monotonic", return_value=100):
+            self.queue.set_value(SERVICE, "/A", 1)
+            self.monitor.reply()
+        with mock.patch("writequeue.monotonic", return_value=109):
+            self.queue.set_value(SERVICE, "/A", 1)
+        self.assertEqual([], self.monitor.sent())
+        with mock.patch("writequeue.monotonic", return_value=110):
+            self.queue.set_value(SERVICE, "/A", 1)
+        self.assertEqual([("/A", 1)], self.monitor.sent())
+
+    def test_in_flight_limit(self):
+        self.queue.set_value(SERVICE, "/A", 1)
+        self.queue.set_value(SERVICE, "/B", 2)
+        self.queue.set_value(SERVICE, "/C", 3)
+        self.assertEqual([("/A", 1), ("/B", 2)], self.monitor.sent())
+        self.assertEqual(3, self.queue.pending)
+        self.monitor.reply(1)
+        self.assertEqual([("/A", 1), ("/C", 3)], self.monitor.sent())
+
+    def test_failure_counter(self):
+        with self.assertLogs(level="WARNING") as logs:
+            self.queue.set_value(SERVICE, "/A", 1)
+            self.monitor.fail()
+            # retried by the next set_value, even with the same value, logged once only
+            self.queue.set_value(SERVICE, "/A", 1)
+            self.monitor.fail()
+        self.assertEqual(1, len(logs.output))
+        self.assertEqual(2, self.queue.counters["Failed"])
+        with self.assertLogs(level="INFO") as logs:
+            self.queue.set_value(SERVICE, "/A", 1)
+            self.monitor.reply()
+        self.assertIn("succeeded again", logs.output[0])
+        self.assertEqual(3, self.queue.counters["Sent"])
+
+    def test_not_monitored(self):
+        with self.assertLogs(level="WARNING"):
+            self.queue.set_value(SERVICE, "/Missing", 1)
+        self.assertEqual([], self.monitor.sent())
+        self.assertEqual(1, self.queue.counters["Failed"])
+        self.assertEqual(0, self.queue.pending)
+
+
+if __name__ == "__main__":
+    unittest.main()
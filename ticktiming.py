@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Timing of the stages of the update tick, published on /Debug/Tick/*.
+"""
+
+from time import monotonic
+
+STAGES = ("Read", "Reduce", "VictronCurrent", "ChargeParameters", "Ess", "Publish")
+
+
+class TickTiming:
+    """
+    Duration of the stages of the update tick, measured with the monotonic clock.
+
+    For each stage and the whole tick the last, exponentially weighted average and max. duration
+    in ms are kept. Ticks taking longer than the budget are counted as overruns.
+    A stage lasts from the previous stage() call (or start()) to its own stage() call.
+    """
+
+    def __init__(self, budget, stages=STAGES, alpha=0.1):
+        """
+        :param budget: max. duration of a tick in ms, e.g. UPDATE_INTERVAL_MS
+        :param stages: names of the stages in order
+        :param alpha: weight of the last duration in the average
+        """
+        self.budget = budget
+        self._alpha = alpha
+        # name: [last, average, max.]
+        self.stats = {name: [None, None, None] for name in stages + ("Total",)}
+        self.overruns = 0
+        self._paths = [(name, "/Debug/Tick/%s/" % name) for name in self.stats]
+        self._start = self._last = monotonic()
+
+    def start(self):
+        self._start = self._last = monotonic()
+
+    def stage(self, name):
+        now = monotonic()
+        self._record(name, (now - self._last) * 1000)
+        self._last = now
+
+    def finish(self):
+        duration = (monotonic() - self._start) * 1000
+        self._record("Total", duration)
+        if duration > self.budget:
+            self.overruns += 1
+
+    def _record(self, name, duration):
+        stats = self.stats[name]
+        stats[0] = duration
+        stats[1] = duration if stats[1] is None else stats[1] + self._alpha * (duration - stats[1])
+        stats[2] = duration if stats[2] is None else max(stats[2], duration)
+
+    def add_paths(self, dbusservice):
+        for name, path in self._paths:
+            for value in ("Last", "Ewma", "Max"):
+                dbusservice.add_path(path + value, None, writeable=False, gettextcallback=lambda a, x: "{:.2f}ms".format(x))
+        dbusservice.add_path("/Debug/Tick/Overruns", 0, writeable=False)
+
+    def publish(self, bus):
+        """
+        :param bus: VeDbusService, its context or the PublishPlan
+        """
+        for name, path in self._paths:
+            last, average, maximum = self.stats[name]
+            if last is None:
+                continue
+            bus[path + "Last"] = round(last, 2)
+            bus[path + "Ewma"] = round(average, 2)
+            bus[path + "Max"] = round(maximum, 2)
+        bus["/Debug/Tick/Overruns"] = self.overruns
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""
+Warm-start cache of the devices found by the last complete discovery.
+"""
+
+import logging
+
+from statestore import StateStore
+
+
+def device(dbusmonitor, service):
+    """
+    :return: entry of a device in the topology, identified by service name and device instance
+    """
+    return {"Service": service, "Instance": dbusmonitor.get_device_instance(service)}
+
+
+class TopologyCache:
+    """
+    Topology (settings, batteries with their names, SmartShunts in their order, Multi, MPPTs, grid meter)
+    kept in a StateStore journal.
+
+    A topology is only valid for the configuration it was found with, given as fingerprint. On startup
+    the cached topology is validated against the services scanned by the asynchronous DbusMonitor scan:
+    as soon as all of its services are scanned and still have the same device instances (and the batteries
+    and SmartShunts the same product and custom names), the service can start without searching the devices.
+    """
+
+    def __init__(self, path, fingerprint):
+        """
+        :param path: path of the journal file
+        :param fingerprint: string of the settings which influence the discovery
+        """
+        self.path = path
+        self._store = StateStore(path, {"Fingerprint": None, "Topology": None})
+        self.fingerprint = fingerprint
+        self.topology = None
+
+    def load(self):
+        """
+        :return: the cached topology, None if there is none for the current configuration
+        """
+        self.topology = None
+        if self._store.load() and self._store["Fingerprint"] == self.fingerprint:
+            self.topology = self._store["Topology"]
+            if not self._complete():
+                logging.warning("Cached topology in %s is incomplete, searching all devices" % self.path)
+                self.topology = None
+        return self.topology
+
+    def _complete(self):
+        # a valid record can still miss entries, e.g. if the file was edited
+        try:
+            entries = self.devices()
+        except (KeyError, TypeError):
+            return False
+        if not all(isinstance(entry, dict) and "Service" in entry and "Instance" in entry for entry in entries):
+            return False
+        return "NumBatteryShunts" in self.topology and all("Name" in entry for entry in self.topology["Batteries"])
+
+    def save(self, topology):
+        """
+        Write the topology, if it changed.
+        """
+        self._store.update(Fingerprint=self.fingerprint, Topology=topology)
+        self._store.flush()
+
+    def discard(self):
+        """
+        Don't use the cached topology for this start, it is replaced by the next complete discovery.
+        """
+        self.topology = None
+
+    def devices(self):
+        """
+        :return: all device entries of the cached topology
+        """
+        topology = self.topology
+        devices = [topology["Settings"]] + topology["Batteries"] + topology["SmartShunts"] + topology["Mppts"]
+        devices += [entry for entry in (topology["Multi"], topology["Grid"]) if entry is not None]
+        return devices
+
+    def pending(self, dbusmonitor):
+        """
+        :return: True if a service of the cached topology was not scanned yet
+        """
+        return any(entry["Service"] not in dbusmonitor.servicesByName for entry in self.devices())
+
+    def mismatch(self, dbusmonitor, checks):
+        """
+        Compare the cached topology with the scanned services.
+
+        :param checks: function(service) returning the values identifying a battery or SmartShunt, e.g. product and custom name,
+            compared with the "Checks" of their entries
+        :return: description of the first difference, None if the topology matches
+        """
+        for entry in self.devices():
+            instance = dbusmonitor.get_device_instance(entry["Service"])
+            if instance != entry["Instance"]:
+                return "%s has device instance %s instead of %s" % (entry["Service"], instance, entry["Instance"])
+            if "Checks" in entry and list(checks(entry["Service"])) != entry["Checks"]:
+                logging.debug("%s cached: %s, found: %s" % (entry["Service"], entry["Checks"], checks(entry["Service"])))
+                return "%s is not the same device anymore" % entry["Service"]
+        return None
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Non-blocking writes to the paths of other services, published counters on /Debug/Writes/*.
+"""
+
+import logging
+from collections import defaultdict
+from functools import partial
+from time import monotonic
+
+notset = object()
+
+
+class WriteQueue:
+    """
+    Write queue on top of DbusMonitor.set_value_async.
+
+    DbusMonitor.set_value waits for the reply of the service, so a slow service (e.g. the vebus service
+    on a busy mk2 link) blocks the main loop. The queue sends the writes asynchronously instead:
+    - the latest value per (service, path) wins, a value queued but not sent yet is replaced
+    - a value equal to the last written one is skipped, as long as the service still reports it
+      and it was written less than refresh seconds ago
+    - only one write per (service, path) and max_in_flight writes in total are waiting for a reply,
+      the others are sent when a reply arrives
+    Failed writes are counted, logged once until the path is written successfully again and
+    retried by the next set_value.
+    """
+
+    def __init__(self, dbusmonitor, max_in_flight=2, refresh=10):
+        """
+        :param dbusmonitor: DbusMonitor used to send the values and to read the current ones
+        :param max_in_flight: max. number of writes waiting for a reply
+        :param refresh: seconds after which an unchanged value is written again, e.g. to keep
+            the external control of the Multi alive
+        """
+        self._dbusmonitor = dbusmonitor
+        self.max_in_flight = max_in_flight
+        self.refresh = refresh
+        # (service, path): value, in order of the first set_value
+        self._pending = {}
+        # (service, path): value waiting for the reply
+        self._inFlight = {}
+        # (service, path): (value, time) of the last successful write
+        self._written = {}
+        # (service, path): consecutive failures
+        self._failures = defaultdict(int)
+        self._sending = False
+        self.counters = dict.fromkeys(("Sent", "Skipped", "Coalesced", "Failed"), 0)
+
+    def set_value(self, service, path, value):
+        """
+        Queue a write and send it, if less than max_in_flight writes are waiting for a reply.
+        """
+        key = (service, path)
+        if key in self._pending:
+            self.counters["Coalesced"] += 1
+            if self._inFlight.get(key, notset) == value:
+                # the write in flight already sends this value
+                del self._pending[key]
+            else:
+                self._pending[key] = value
+            return
+
+        last = self._inFlight.get(key, notset)
+        if last is notset:
+            written = self._written.get(key)
+            if written is not None and written[0] == value and monotonic() - written[1] < self.refresh and self._dbusmonitor.get_value(service, path) == value:
+                self.counters["Skipped"] += 1
+                return
+        elif last == value:
+            self.counters["Skipped"] += 1
+            return
+
+        self._pending[key] = value
+        self._send()
+
+    def _send(self):
+        # replies of the MockDbusMonitor arrive within set_value_async
+        if self._sending:
+            return
+        self._sending = True
+        try:
+            for key in list(self._pending):
+                if len(self._inFlight) >= self.max_in_flight:
+                    break
+                # keep the order of the writes to the same path
+                if key in self._inFlight:
+                    continue
+                value = self._pending.pop(key)
+                service, path = key
+                monitored = self._dbusmonitor.servicesByName.get(service)
+                if monitored is None or path not in monitored.paths:
+                    # set_value_async would neither call the reply nor the error handler
+                    self._failed(key, value, KeyError("%s%s is not monitored" % (service, path)))
+                    continue
+                self._inFlight[key] = value
+                self.counters["Sent"] += 1
+                self._dbusmonitor.set_value_async(
+                    service,
+                    path,
+                    value,
+                    reply_handler=partial(self._done, key, value),
+                    error_handler=partial(self._failed, key, value),
+                )
+        finally:
+            self._sending = False
+
+    def _done(self, key, value, *args):
+        self._inFlight.pop(key, None)
+        self._written[key] = (value, monotonic())
+        if self._failures.pop(key, 0):
+            logging.info("Writing %s%s succeeded again" % key)
+        self._send()
+
+    def _failed(self, key, value, exception):
+        self._inFlight.pop(key, None)
+        # not known what the service has now, write the next value in any case
+        self._written.pop(key, None)
+        self.counters["Failed"] += 1
+        self._failures[key] += 1
+        if self._failures[key] == 1:
+            logging.warning("Writing %s to %s%s failed: %s" % (value, key[0], key[1], exception))
+        self._send()
+
+    @property
+    def pending(self):
+        """
+        :return: number of writes queued or waiting for a reply
+        """
+        return len(self._pending) + len(self._inFlight)
+
+    def add_paths(self, dbusservice):
+        for name in self.counters:
+            dbusservice.add_path("/Debug/Writes/%s" % name, 0, writeable=False)
+        dbusservice.add_path("/Debug/Writes/Pending", 0, writeable=False)
+
+    def publish(self, bus):
+        """
+        :param bus: VeDbusService, its context or the PublishPlan
+        """
+        for name, value in self.counters.items():
+            bus["/Debug/Writes/%s" % name] = value
+        bus["/Debug/Writes/Pending"] = self.pending